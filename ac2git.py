@@ -25,8 +25,14 @@ import codecs
 import json
 import pytz
 import tempfile
+import fnmatch
+import itertools
+import socket
+import sqlite3
+import threading
 
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 import accurev
 import git
@@ -90,6 +96,160 @@ class Config(object):
                 self.logFile.write(self._FormatMessage(message))
                 self.logFile.write("\n")
         
+    class PathFilter(object):
+        # Include and exclude patterns are matched from the depot root, one path component at a time, using fnmatch style wildcards.
+        # A pattern matches a path if it matches the path itself or one of its parent directories.
+        @classmethod
+        def fromxmlelement(cls, xmlElement):
+            if xmlElement is not None and xmlElement.tag == 'path-filter':
+                includes = [ e.text.strip() for e in xmlElement.findall('include') if e.text is not None and len(e.text.strip()) > 0 ]
+                excludes = [ e.text.strip() for e in xmlElement.findall('exclude') if e.text is not None and len(e.text.strip()) > 0 ]
+
+                return cls(includes=includes, excludes=excludes)
+            else:
+                return None
+
+        def __init__(self, includes=None, excludes=None):
+            self.includes = includes if includes is not None else []
+            self.excludes = excludes if excludes is not None else []
+
+        def __repr__(self):
+            str = "Config.PathFilter(includes=" + repr(self.includes)
+            str += ", excludes="                + repr(self.excludes)
+            str += ")"
+
+            return str
+
+        @staticmethod
+        def _SplitPath(path):
+            return [ part for part in path.replace('\\', '/').split('/') if part not in [ '', '.' ] ]
+
+        @staticmethod
+        def _MatchesPathOrParent(pattern, pathParts):
+            patternParts = Config.PathFilter._SplitPath(pattern)
+            if len(pathParts) < len(patternParts):
+                return False
+            for i in range(0, len(patternParts)):
+                if not fnmatch.fnmatchcase(pathParts[i], patternParts[i]):
+                    return False
+            return True
+
+        @staticmethod
+        def _IsParentOfMatch(pathParts, pattern):
+            patternParts = Config.PathFilter._SplitPath(pattern)
+            if len(pathParts) >= len(patternParts):
+                return False
+            for i in range(0, len(pathParts)):
+                if not fnmatch.fnmatchcase(pathParts[i], patternParts[i]):
+                    return False
+            return True
+
+        def IsActive(self):
+            return len(self.includes) > 0 or len(self.excludes) > 0
+
+        # Returns True if the depot relative path (e.g. /./src/file.c or src\file.c) should be converted.
+        def IsIncluded(self, path):
+            parts = Config.PathFilter._SplitPath(path)
+            if len(self.includes) > 0 and not any(Config.PathFilter._MatchesPathOrParent(p, parts) for p in self.includes):
+                return False
+            return not any(Config.PathFilter._MatchesPathOrParent(p, parts) for p in self.excludes)
+
+        # Returns True if the directory is included or if it may contain included paths.
+        def IsDirNeeded(self, path):
+            if self.IsIncluded(path):
+                return True
+            parts = Config.PathFilter._SplitPath(path)
+            if any(Config.PathFilter._MatchesPathOrParent(p, parts) for p in self.excludes):
+                return False
+            return any(Config.PathFilter._IsParentOfMatch(parts, p) for p in self.includes)
+
+        # Returns the list of depot relative paths that need to be populated to get all of the included paths. Since accurev
+        # can't expand wildcards only the leading part of each include pattern, up to its first wildcard, is used.
+        def GetPopulateList(self):
+            if len(self.includes) == 0:
+                return [ '.' ]
+            prefixes = []
+            for pattern in self.includes:
+                prefix = []
+                for part in Config.PathFilter._SplitPath(pattern):
+                    if any(c in part for c in '*?['):
+                        break
+                    prefix.append(part)
+                if len(prefix) == 0:
+                    return [ '.' ]
+                prefixes.append(prefix)
+            rv = []
+            for prefix in sorted(prefixes, key=len):
+                if not any(prefix[:len(p)] == p for p in rv):
+                    rv.append(prefix)
+            return [ '/./{0}'.format('/'.join(p)) for p in rv ]
+
+        def IsTransactionIncluded(self, transaction):
+            paths = [ v.path for v in transaction.versions if v is not None and v.path is not None ]
+            for move in transaction.moves:
+                if move is not None:
+                    paths.extend([ p for p in [ move.source, move.dest ] if p is not None ])
+            if len(paths) == 0:
+                return True # Transactions that don't list any elements (e.g. chstream) could affect anything.
+            return any(self.IsIncluded(p) for p in paths)
+
+        # Returns a copy of the obj.Diff containing only the elements which have at least one included path.
+        def FilterDiff(self, diff):
+            if diff is None or not self.IsActive():
+                return diff
+            elements = []
+            for element in diff.elements:
+                for change in element.changes:
+                    if any(stream is not None and stream.name is not None and self.IsIncluded(stream.name) for stream in [ change.stream1, change.stream2 ]):
+                        elements.append(element)
+                        break
+            return accurev.obj.Diff(taskId=diff.taskId, elements=elements)
+
+    class Governor(object):
+        # Configures the accurev.CommandGovernor which admits the accurev commands to the server. Per command limits are given as
+        # <limit command="pop">2</limit> child elements.
+        @classmethod
+        def fromxmlelement(cls, xmlElement):
+            if xmlElement is not None and xmlElement.tag == 'governor':
+                maxConcurrent = xmlElement.attrib.get('max-concurrent')
+                if maxConcurrent is not None:
+                    maxConcurrent = int(maxConcurrent)
+                rate = xmlElement.attrib.get('commands-per-second')
+                if rate is not None:
+                    rate = float(rate)
+                kindLimits = {}
+                for limitElement in xmlElement.findall('limit'):
+                    kindLimits[limitElement.attrib.get('command')] = int(limitElement.text)
+
+                return cls(maxConcurrent=maxConcurrent, rate=rate, kindLimits=kindLimits)
+            else:
+                return None
+
+        def __init__(self, maxConcurrent=None, rate=None, kindLimits=None):
+            self.maxConcurrent = maxConcurrent
+            self.rate = rate
+            self.kindLimits = kindLimits if kindLimits is not None else {}
+
+        def __repr__(self):
+            str = "Config.Governor(maxConcurrent=" + repr(self.maxConcurrent)
+            str += ", rate="                       + repr(self.rate)
+            str += ", kindLimits="                 + repr(self.kindLimits)
+            str += ")"
+
+            return str
+
+        def IsActive(self):
+            return self.maxConcurrent is not None or self.rate is not None or len(self.kindLimits) > 0
+
+        # Enables the accurev.CommandGovernor, if the governor is configured, and returns it.
+        def Enable(self):
+            if not self.IsActive():
+                return None
+            kwargs = { 'rate': self.rate, 'kindLimits': self.kindLimits }
+            if self.maxConcurrent is not None:
+                kwargs['maxConcurrent'] = self.maxConcurrent
+            return accurev.ext.enable_governor(**kwargs)
+
     class AccuRev(object):
         @classmethod
         def fromxmlelement(cls, xmlElement):
@@ -100,6 +260,20 @@ class Config(object):
                 startTransaction = xmlElement.attrib.get('start-transaction')
                 endTransaction   = xmlElement.attrib.get('end-transaction')
                 commandCacheFilename = xmlElement.attrib.get('command-cache-filename')
+                populateJobs = xmlElement.attrib.get('populate-jobs')
+                if populateJobs is not None:
+                    populateJobs = int(populateJobs)
+                diffProbeWindow = xmlElement.attrib.get('diff-probe-window')
+                if diffProbeWindow is not None:
+                    diffProbeWindow = int(diffProbeWindow)
+                diffPrefetch = xmlElement.attrib.get('diff-prefetch')
+                if diffPrefetch is not None:
+                    diffPrefetch = int(diffPrefetch)
+                partitions = xmlElement.attrib.get('partitions')
+                if partitions is not None:
+                    partitions = int(partitions)
+                workspace = xmlElement.attrib.get('workspace')
+                queryService = xmlElement.attrib.get('query-service')
                 
                 streamMap = None
                 streamListElement = xmlElement.find('stream-list')
@@ -113,12 +287,15 @@ class Config(object):
                             branchName = streamName
 
                         streamMap[streamName] = branchName
+
+                pathFilter = Config.PathFilter.fromxmlelement(xmlElement.find('path-filter'))
+                governor = Config.Governor.fromxmlelement(xmlElement.find('governor'))
                 
-                return cls(depot, username, password, startTransaction, endTransaction, streamMap, commandCacheFilename)
+                return cls(depot, username, password, startTransaction, endTransaction, streamMap, commandCacheFilename, populateJobs, pathFilter, diffProbeWindow, diffPrefetch, partitions, workspace, governor, queryService)
             else:
                 return None
             
-        def __init__(self, depot = None, username = None, password = None, startTransaction = None, endTransaction = None, streamMap = None, commandCacheFilename = None):
+        def __init__(self, depot = None, username = None, password = None, startTransaction = None, endTransaction = None, streamMap = None, commandCacheFilename = None, populateJobs = None, pathFilter = None, diffProbeWindow = None, diffPrefetch = None, partitions = None, workspace = None, governor = None, queryService = None):
             self.depot    = depot
             self.username = username
             self.password = password
@@ -126,6 +303,14 @@ class Config(object):
             self.endTransaction   = endTransaction
             self.streamMap = streamMap
             self.commandCacheFilename = commandCacheFilename
+            self.populateJobs = populateJobs
+            self.pathFilter = pathFilter if pathFilter is not None else Config.PathFilter()
+            self.diffProbeWindow = diffProbeWindow
+            self.diffPrefetch = diffPrefetch
+            self.partitions = partitions
+            self.workspace = workspace
+            self.governor = governor if governor is not None else Config.Governor()
+            self.queryService = queryService
     
         def __repr__(self):
             str = "Config.AccuRev(depot=" + repr(self.depot)
@@ -135,6 +320,10 @@ class Config(object):
             str += ", endTransaction="    + repr(self.endTransaction)
             if streamMap is not None:
                 str += ", streamMap="    + repr(self.streamMap)
+            if self.pathFilter.IsActive():
+                str += ", pathFilter="   + repr(self.pathFilter)
+            if self.governor.IsActive():
+                str += ", governor="     + repr(self.governor)
             str += ")"
             
             return str
@@ -171,6 +360,42 @@ class Config(object):
             
             return str
             
+    class Depot(object):
+        @classmethod
+        def fromxmlelement(cls, xmlElement):
+            if xmlElement is not None and xmlElement.tag == 'depot':
+                name     = xmlElement.attrib.get('name')
+                repoPath = xmlElement.attrib.get('repo-path')
+
+                streamMap = None
+                streamListElement = xmlElement.find('stream-list')
+                if streamListElement is not None:
+                    streamMap = OrderedDict()
+                    for streamElement in streamListElement.findall('stream'):
+                        streamName = streamElement.text
+                        branchName = streamElement.attrib.get("branch-name")
+                        if branchName is None:
+                            branchName = streamName
+
+                        streamMap[streamName] = branchName
+
+                return cls(name=name, repoPath=repoPath, streamMap=streamMap)
+            else:
+                return None
+
+        def __init__(self, name, repoPath, streamMap=None):
+            self.name      = name
+            self.repoPath  = repoPath
+            self.streamMap = streamMap
+
+        def __repr__(self):
+            str = "Config.Depot(name=" + repr(self.name)
+            str += ", repoPath="       + repr(self.repoPath)
+            str += ", streamMap="      + repr(self.streamMap)
+            str += ")"
+
+            return str
+
     class UserMap(object):
         @classmethod
         def fromxmlelement(cls, xmlElement):
@@ -232,13 +457,35 @@ class Config(object):
             if logFileElem is not None:
                 logFilename = logFileElem.text
 
+            followInterval = None
+            followElem = xmlRoot.find('follow')
+            if followElem is not None and followElem.text is not None:
+                followInterval = int(followElem.text)
+
+            workQueueFilename = None
+            workQueueRole = None
+            workQueueElem = xmlRoot.find('work-queue')
+            if workQueueElem is not None:
+                workQueueFilename = workQueueElem.text
+                workQueueRole = workQueueElem.attrib.get('role')
+
+            depots = []
+            maxConcurrentDepots = None
+            depotsElem = xmlRoot.find('depots')
+            if depotsElem is not None:
+                for depotElem in depotsElem.findall('depot'):
+                    depots.append(Config.Depot.fromxmlelement(depotElem))
+                maxConcurrentDepots = depotsElem.attrib.get('max-concurrent')
+                if maxConcurrentDepots is not None:
+                    maxConcurrentDepots = int(maxConcurrentDepots)
+
             usermaps = []
             userMapsElem = xmlRoot.find('usermaps')
             if userMapsElem is not None:
                 for userMapElem in userMapsElem.findall('map-user'):
                     usermaps.append(Config.UserMap.fromxmlelement(userMapElem))
             
-            return cls(accurev=accurev, git=git, usermaps=usermaps, method=method, logFilename=logFilename)
+            return cls(accurev=accurev, git=git, usermaps=usermaps, method=method, logFilename=logFilename, followInterval=followInterval, workQueueFilename=workQueueFilename, workQueueRole=workQueueRole, depots=depots, maxConcurrentDepots=maxConcurrentDepots)
         else:
             # Invalid XML for an accurev2git configuration file.
             return None
@@ -253,12 +500,17 @@ class Config(object):
         
         return config
 
-    def __init__(self, accurev = None, git = None, usermaps = None, method = None, logFilename = None):
+    def __init__(self, accurev = None, git = None, usermaps = None, method = None, logFilename = None, followInterval = None, workQueueFilename = None, workQueueRole = None, depots = None, maxConcurrentDepots = None):
         self.accurev     = accurev
         self.git         = git
         self.usermaps    = usermaps
         self.method      = method
         self.logFilename = logFilename
+        self.followInterval = followInterval
+        self.workQueueFilename = workQueueFilename
+        self.workQueueRole = workQueueRole
+        self.depots = depots if depots is not None else []
+        self.maxConcurrentDepots = maxConcurrentDepots
         self.logger      = Config.Logger()
         
     def __repr__(self):
@@ -286,17 +538,201 @@ class Config(object):
 #     * Commit the current state of the directory but don't respect the .gitignore file contents. (in case it was added to accurev in the past).
 #     * Increment the transaction number by one
 #     * Obtain a diff from accurev listing all of the files that have changed and delete them all.
+# Chooses the method used to convert a stream when the 'auto' method is configured. The statistics of the transactions converted since
+# the last checkpoint are collected with Record() and every checkpointCommitCount commits Checkpoint() re-evaluates the method:
+#   - deep-hist -> diff:      when most of the transactions in the range are deep-hist candidates anyway.
+#   - diff      -> deep-hist: when most of the diffs are empty.
+#   - any       -> pop:       when a full populate costs less per transaction than the current method. The cost of a full populate is
+#                             only known if the stream's first transaction was populated in full, so a seeded or resumed branch never
+#                             switches to pop.
+class AutoMethodSelector(object):
+    checkpointCommitCount    = 50
+    deepHistDensityThreshold = 0.5
+    diffChangeRateThreshold  = 0.1
+
+    def __init__(self, logger, streamName, method="deep-hist"):
+        self.logger     = logger
+        self.streamName = streamName
+        self.method     = method
+        self.costs      = {} # The last measured cost, in seconds per transaction, of each method.
+        self.Reset()
+
+    def Reset(self):
+        self.commitCount      = 0
+        self.transactionCount = 0
+        self.candidateCount   = 0
+        self.seconds          = 0.0
+
+    # Records one commit which advanced the stream by transactionCount transactions. The candidateCount is the number of deep-hist
+    # transactions among them (deep-hist method only).
+    def Record(self, transactionCount, candidateCount, seconds):
+        self.commitCount      += 1
+        self.transactionCount += transactionCount
+        self.candidateCount   += candidateCount if candidateCount is not None else 0
+        self.seconds          += seconds
+
+    # Returns the method to use from now on.
+    def Checkpoint(self):
+        if self.commitCount < AutoMethodSelector.checkpointCommitCount or self.transactionCount == 0:
+            return self.method
+
+        cost = self.seconds / self.transactionCount
+        self.costs[self.method] = cost
+        method = self.method
+        if self.method == "deep-hist":
+            density = float(self.candidateCount) / self.transactionCount
+            reason = "candidate density {0:.2f}".format(density)
+            if density >= AutoMethodSelector.deepHistDensityThreshold:
+                method = "diff"
+        elif self.method == "diff":
+            changeRate = float(self.commitCount) / self.transactionCount
+            reason = "change rate {0:.2f}".format(changeRate)
+            if changeRate < AutoMethodSelector.diffChangeRateThreshold:
+                method = "deep-hist"
+        else:
+            reason = "pop cost {0:.3f}s/tr.".format(cost)
+            otherCosts = [ (c, m) for m, c in self.costs.items() if m != "pop" ]
+            if len(otherCosts) > 0 and min(otherCosts)[0] < cost:
+                method = min(otherCosts)[1]
+
+        if method != "pop" and "pop" in self.costs and self.costs["pop"] < self.costs.get(method, cost):
+            reason += ", pop cost {0:.3f}s/tr. < {1:.3f}s/tr.".format(self.costs["pop"], self.costs.get(method, cost))
+            method = "pop"
+
+        if method != self.method:
+            self.logger.info( "{0}: auto method switching from {1} to {2} ({3} commits over {4} transactions, {5:.3f}s/tr., {6}).".format(self.streamName, self.method, method, self.commitCount, self.transactionCount, cost, reason) )
+        else:
+            self.logger.dbg( "{0}: auto method keeping {1} ({2} commits over {3} transactions, {4:.3f}s/tr., {5}).".format(self.streamName, self.method, self.commitCount, self.transactionCount, cost, reason) )
+        self.method = method
+        self.Reset()
+        return self.method
+
+# The work queue shared by the coordinator and the workers of a distributed conversion. It is an sqlite database with one row per stream.
+# The workers publish the branches that they have converted as git bundles in a directory next to the database. The coordinator fetches them
+# into the final repository. The database and the bundle directory must be on a filesystem that all of the nodes can access.
+class WorkQueue(object):
+    createTableQuery = '''
+CREATE TABLE IF NOT EXISTS work_items (
+  id                INTEGER PRIMARY KEY AUTOINCREMENT,
+  stream            TEXT NOT NULL,
+  branch_name       TEXT NOT NULL,
+  start_transaction TEXT,
+  end_transaction   TEXT,
+  seed_bundle       TEXT,
+  state             TEXT NOT NULL,
+  worker            TEXT,
+  transaction_id    INT,
+  commit_hash       TEXT,
+  bundle            TEXT,
+  heartbeat         REAL
+);
+'''
+    # The states that a work item goes through. A failed item can be retried by running the coordinator again.
+    statePending = 'pending'
+    stateClaimed = 'claimed'
+    stateDone    = 'done'
+    stateFailed  = 'failed'
+    stateFetched = 'fetched'
+
+    # A worker renews its claim every heartbeatInterval seconds. A claim that hasn't been renewed for claimTimeout seconds belongs
+    # to a worker which has stopped and its item is pending again.
+    heartbeatInterval = 60
+    claimTimeout = 600
+
+    def __enter__(self):
+        self.Close()
+        self.Open()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
+        return False
+
+    def __init__(self, filepath):
+        self.filepath = os.path.abspath(filepath)
+        self.bundleDir = '{0}.bundles'.format(self.filepath)
+        self.connection = None
+
+    def Open(self):
+        if not os.path.isdir(self.bundleDir):
+            os.makedirs(self.bundleDir)
+        # The transactions are managed explicitly. BEGIN IMMEDIATE makes the claims atomic across processes and nodes.
+        self.connection = sqlite3.connect(self.filepath, timeout=60, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(WorkQueue.createTableQuery)
+        # Queues made before the claims had a heartbeat lack its column.
+        if 'heartbeat' not in [ row['name'] for row in self.connection.execute('PRAGMA table_info(work_items);') ]:
+            self.connection.execute('ALTER TABLE work_items ADD COLUMN heartbeat REAL;')
+
+    def Close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def Add(self, streamName, branchName, startTransaction, endTransaction, seedBundle=None):
+        cursor = self.connection.execute('INSERT INTO work_items (stream, branch_name, start_transaction, end_transaction, seed_bundle, state) VALUES (?, ?, ?, ?, ?, ?);', (streamName, branchName, str(startTransaction), str(endTransaction), seedBundle, WorkQueue.statePending))
+        return cursor.lastrowid
+
+    # Returns the work items, oldest first, optionally only those in the given state.
+    def Items(self, state=None):
+        if state is None:
+            return [ dict(row) for row in self.connection.execute('SELECT * FROM work_items ORDER BY id;') ]
+        return [ dict(row) for row in self.connection.execute('SELECT * FROM work_items WHERE state = ? ORDER BY id;', (state,)) ]
+
+    # Returns the oldest pending work item, marked as claimed by the given worker, or None if there are no pending items. The items
+    # with stale claims are pending again beforehand.
+    def Claim(self, worker):
+        self.connection.execute('BEGIN IMMEDIATE;')
+        try:
+            self.RequeueStale()
+            row = self.connection.execute('SELECT * FROM work_items WHERE state = ? ORDER BY id LIMIT 1;', (WorkQueue.statePending,)).fetchone()
+            if row is not None:
+                self.connection.execute('UPDATE work_items SET state = ?, worker = ?, heartbeat = ? WHERE id = ?;', (WorkQueue.stateClaimed, worker, time.time(), row['id']))
+            self.connection.execute('COMMIT;')
+        except:
+            self.connection.execute('ROLLBACK;')
+            raise
+        if row is None:
+            return None
+        item = dict(row)
+        item['state'] = WorkQueue.stateClaimed
+        item['worker'] = worker
+        item['heartbeat'] = time.time()
+        return item
+
+    # Renews the claim of the worker on the item. Returns False if the item is no longer claimed by it.
+    def Heartbeat(self, itemId, worker):
+        cursor = self.connection.execute('UPDATE work_items SET heartbeat = ? WHERE id = ? AND worker = ? AND state = ?;', (time.time(), itemId, worker, WorkQueue.stateClaimed))
+        return cursor.rowcount > 0
+
+    # Makes the items whose claims are stale pending again and returns their number.
+    def RequeueStale(self):
+        cursor = self.connection.execute('UPDATE work_items SET state = ?, worker = NULL WHERE state = ? AND (heartbeat IS NULL OR heartbeat < ?);', (WorkQueue.statePending, WorkQueue.stateClaimed, time.time() - WorkQueue.claimTimeout))
+        return cursor.rowcount
+
+    def Complete(self, itemId, transactionId, commitHash, bundle):
+        self.connection.execute('UPDATE work_items SET state = ?, transaction_id = ?, commit_hash = ?, bundle = ? WHERE id = ?;', (WorkQueue.stateDone, transactionId, commitHash, bundle, itemId))
+
+    def SetState(self, itemId, state):
+        self.connection.execute('UPDATE work_items SET state = ? WHERE id = ?;', (state, itemId))
+
 class AccuRev2Git(object):
     gitNotesRef_AccurevHistXml = 'accurev/xml/hist'
     gitNotesRef_AccurevHist    = 'accurev/hist'
 
     commandFailureRetryCount = 3
+    singlePassChunkSize = 1000 # The number of transactions for which the affected streams are retrieved at once by the single-pass method.
 
     def __init__(self, config):
         self.config = config
         self.cwd = None
         self.gitRepo = None
         self.gitBranchList = None
+        self.diffExecutor = None # The thread pool of the diff prefetch and the diff probes, see GetDiffExecutor().
+        self.diffPrefetch = {}
+        self.lastFullPopSeconds = None
+        self.lastCommitResult = None # The git.GitResult of the `git commit` run by the last Commit() call.
 
     # Returns True if the path was deleted, otherwise false
     def DeletePath(self, path):
@@ -359,6 +795,18 @@ class AccuRev2Git(object):
                             deletedDirs.append(path)
         return deletedDirs
 
+    # Deletes the empty .gitignore files that PreserveEmptyDirs() added but leaves the directories in place.
+    def DeleteEmptyDirPlaceholders(self):
+        deletedPlaceholders = []
+        for root, dirs, files in os.walk(self.gitRepo.path, topdown=True):
+            for name in dirs:
+                path = os.path.join(root, name).replace('\\','/')
+                if git.GetGitDirPrefix(path) is None and os.listdir(path) == [ '.gitignore' ]:
+                    placeholder = os.path.join(path, '.gitignore')
+                    if os.path.getsize(placeholder) == 0 and self.DeletePath(placeholder):
+                        deletedPlaceholders.append(placeholder)
+        return deletedPlaceholders
+
     def GetGitUserFromAccuRevUser(self, accurevUsername):
         if accurevUsername is not None:
             for usermap in self.config.usermaps:
@@ -445,7 +893,7 @@ class AccuRev2Git(object):
                 self.config.logger.dbg( "Added script state note for {0}.".format(commitHash) )
             else:
                 self.config.logger.error( "Failed to add script state note for {0}, tr. {1}".format(commitHash, transaction.id) )
-                self.config.logger.error(self.gitRepo.lastStderr)
+                self.config.logger.error(self.gitRepo.lastResult.stderr)
             
             return rv
         else:
@@ -475,7 +923,7 @@ class AccuRev2Git(object):
                 self.config.logger.dbg( "Added accurev hist{0} note for {1}.".format(' xml' if isXml else '', commitHash) )
             else:
                 self.config.logger.error( "Failed to add accurev hist{0} note for {1}".format(' xml' if isXml else '', commitHash) )
-                self.config.logger.error(self.gitRepo.lastStderr)
+                self.config.logger.error(self.gitRepo.lastResult.stderr)
             
             return rv
         else:
@@ -486,6 +934,7 @@ class AccuRev2Git(object):
     def GetFirstTransaction(self, depot, streamName, startTransaction=None, endTransaction=None):
         # Get the stream creation transaction (mkstream). Note: The first stream in the depot doesn't have an mkstream transaction.
         for i in range(0, AccuRev2Git.commandFailureRetryCount):
+            accurev.ext.backoff(attempt=i)
             mkstream = accurev.hist(stream=streamName, transactionKind="mkstream", timeSpec="now")
             if mkstream is not None:
                 break
@@ -506,7 +955,7 @@ class AccuRev2Git(object):
                 self.config.logger.error( "There seem to be multiple mkstream transactions for this stream... Using {0}".format(tr.id) )
 
         if startTransaction is not None:
-            startTrHist = self.TryHist(depot=depot, trNum=startTransaction)
+            startTrHist = self.TryHist(depot=depot, trNum=startTransaction, transactionOnly=True)
             if startTrHist is None:
                 return None
 
@@ -515,7 +964,7 @@ class AccuRev2Git(object):
                 self.config.logger.info( "The first transaction (#{0}) for stream {1} is earlier than the conversion start transaction (#{2}).".format(tr.id, streamName, startTr.id) )
                 tr = startTr
         if endTransaction is not None:
-            endTrHist = self.TryHist(depot=depot, trNum=endTransaction)
+            endTrHist = self.TryHist(depot=depot, trNum=endTransaction, transactionOnly=True)
             if endTrHist is None:
                 return None
 
@@ -579,6 +1028,76 @@ class AccuRev2Git(object):
                 return hist
         return None
 
+    # Returns a (commitHash, stateObj) tuple for the newest commit on the given branch whose script state note records a
+    # transaction number that is less than or equal to trNumber. Returns (None, None) if no such commit exists.
+    def GetBranchCommitForTransaction(self, branchName, trNumber):
+        # The script state notes for a branch are stored under a notes ref of the same name (see Commit()), so a single git log
+        # command is enough to retrieve every commit along with its state.
+        cmd = [ u'git', u'log', u'--notes={0}'.format(branchName), u'--format=format:%H %N', branchName ]
+        output = self.gitRepo.raw_cmd(cmd)
+        if output is None:
+            return (None, None)
+
+        for line in output.split(u'\n'):
+            m = re.match(r'^([0-9A-Fa-f]+) (\{.*\})\s*$', line)
+            if m is not None:
+                try:
+                    stateObj = json.loads(m.group(2))
+                except ValueError:
+                    continue
+                if stateObj.get("transaction_number") is not None and int(stateObj["transaction_number"]) <= int(trNumber):
+                    return (m.group(1), stateObj)
+
+        return (None, None)
+
+    # Seeds the working directory and the index of a newly created branch with the tree of the branch into which its parent
+    # stream was converted. The elements which differ between the parent (at the seed commit's transaction) and the child
+    # (at the given transaction) are then deleted so that a populate without the overwrite option only retrieves the child's
+    # differences instead of the entire code base.
+    # Returns True if the branch was seeded. Otherwise it returns False and leaves the branch clean for a full populate.
+    def SeedBranchFromParent(self, depot, stream, transaction):
+        if self.config.accurev.streamMap is None:
+            return False
+
+        streams = accurev.show.streams(depot=depot, stream=stream.streamNumber, timeSpec=transaction.id)
+        if streams is None or streams.streams is None or len(streams.streams) == 0:
+            self.config.logger.dbg( "{0}: accurev show streams -s {1} -t {2} failed. Can't seed from the parent branch.".format(stream.name, stream.streamNumber, transaction.id) )
+            return False
+        streamAtTr = streams.streams[0]
+
+        parentName = streamAtTr.basis
+        if parentName is None or parentName not in self.config.accurev.streamMap:
+            return False
+        parentBranchName = self.config.accurev.streamMap[parentName]
+
+        parentCommitHash, parentState = self.GetBranchCommitForTransaction(branchName=parentBranchName, trNumber=transaction.id)
+        if parentCommitHash is None:
+            self.config.logger.dbg( "{0}: parent branch {1} has no commit at or before tr. #{2}. Can't seed from it.".format(stream.name, parentBranchName, transaction.id) )
+            return False
+        parentTrNumber = int(parentState["transaction_number"])
+
+        # Compare the parent, as it was in the seed commit, to the child at the given transaction.
+        diff = self.TryDiff(streamName=parentName, firstTrNumber=parentTrNumber, secondTrNumber=transaction.id, secondStreamName=streamAtTr.name)
+        if diff is None:
+            return False
+
+        self.config.logger.info( "{0}: seeding from {1} ({2}, tr. #{3}). {4} elements differ at tr. #{5}.".format(stream.name, parentBranchName, parentCommitHash[:8], parentTrNumber, len(diff.elements), transaction.id) )
+        if not self.gitRepo.read_tree(treeish=parentCommitHash) or not self.gitRepo.checkout_index(all=True, force=True):
+            self.config.logger.error( "Failed to seed {0} from {1}. Falling back to a full populate.".format(stream.name, parentCommitHash) )
+            self.config.logger.error(self.gitRepo.lastResult.stderr)
+            self.ClearGitRepo()
+            return False
+
+        try:
+            self.DeleteDiffItemsFromRepo(diff=diff)
+            self.DeleteEmptyDirs()
+        except:
+            self.config.logger.error( "Failed to delete the elements that differ from the parent. Falling back to a full populate." )
+            self.ClearGitRepo()
+            return False
+
+        return True
+
     def CreateCleanGitBranch(self, branchName):
         # Create the git branch.
         self.config.logger.info( "Creating {0}".format(branchName) )
@@ -588,7 +1107,12 @@ class AccuRev2Git(object):
         self.gitRepo.rm(fileList=['.'], force=True, recursive=True)
         self.ClearGitRepo()
 
+    # Returns True if the last Commit() didn't commit anything because nothing had changed.
+    def IsNothingToCommit(self):
+        return self.lastCommitResult is not None and "nothing to commit" in self.lastCommitResult.stdout
+
     def Commit(self, depot, stream, transaction, branchName=None, isFirstCommit=False):
+        self.lastCommitResult = None
         self.PreserveEmptyDirs()
 
         # Add all of the files to the index
@@ -623,7 +1147,9 @@ class AccuRev2Git(object):
         # For now just force the time to be UTC centric but preferrably we would have this set-up to either use the local timezone
         # or allow each user to be given a timezone for geographically distributed teams...
         # The PyTz library should be considered for the timezone conversions. Do not roll your own...
-        if self.gitRepo.commit(messageFile=messageFilePath, committer=committer, committer_date=committerDate, committer_tz=committerTimezone, author=committer, date=committerDate, tz=committerTimezone, allow_empty_message=True, gitOpts=[u'-c', u'core.autocrlf=false']):
+        isCommitted = self.gitRepo.commit(messageFile=messageFilePath, committer=committer, committer_date=committerDate, committer_tz=committerTimezone, author=committer, date=committerDate, tz=committerTimezone, allow_empty_message=True, gitOpts=[u'-c', u'core.autocrlf=false'])
+        self.lastCommitResult = self.gitRepo.lastResult
+        if isCommitted:
             commitHash = self.GetLastCommitHash()
             if commitHash is not None:
                 if lastCommitHash != commitHash:
@@ -651,65 +1177,203 @@ class AccuRev2Git(object):
             else:
                 self.config.logger.error("Failed to commit! No last hash available.")
                 return None
-        elif "nothing to commit" in self.gitRepo.lastStdout:
+        elif self.IsNothingToCommit():
             self.config.logger.dbg( "nothing to commit after populating transaction {0}...?".format(transaction.id) )
         else:
             self.config.logger.error( "Failed to commit transaction {0}".format(transaction.id) )
-            self.config.logger.error( "\n{0}\n{1}\n".format(self.gitRepo.lastStdout, self.gitRepo.lastStderr) )
+            self.config.logger.error( "\n{0}\n{1}\n".format(self.lastCommitResult.stdout, self.lastCommitResult.stderr) )
         os.remove(messageFilePath)
 
         return commitHash
 
-    def TryDiff(self, streamName, firstTrNumber, secondTrNumber):
+    # Diffs the streamName at firstTrNumber against the secondStreamName (which defaults to streamName) at secondTrNumber.
+    def TryDiff(self, streamName, firstTrNumber, secondTrNumber, secondStreamName=None):
+        if secondStreamName is None:
+            secondStreamName = streamName
         for i in range(0, AccuRev2Git.commandFailureRetryCount):
-            diff = accurev.diff(all=True, informationOnly=True, verSpec1=streamName, verSpec2=streamName, transactionRange="{0}-{1}".format(firstTrNumber, secondTrNumber), useCache=self.config.accurev.UseCommandCache())
+            accurev.ext.backoff(attempt=i)
+            diff = accurev.diff(all=True, informationOnly=True, verSpec1=streamName, verSpec2=secondStreamName, transactionRange="{0}-{1}".format(firstTrNumber, secondTrNumber), useCache=self.config.accurev.UseCommandCache())
             if diff is not None:
+                diff = self.config.accurev.pathFilter.FilterDiff(diff)
                 break
         if diff is None:
-            self.config.logger.error( "accurev diff failed! stream: {0} time-spec: {1}-{2}".format(streamName, firstTrNumber, secondTrNumber) )
+            self.config.logger.error( "accurev diff failed! stream: {0} time-spec: {1}-{2}".format(streamName if secondStreamName == streamName else "{0}, {1}".format(streamName, secondStreamName), firstTrNumber, secondTrNumber) )
         return diff
     
-    def FindNextChangeTransaction(self, streamName, startTrNumber, endTrNumber, deepHist=None):
-        # Iterate over transactions in order using accurev diff -a -i -v streamName -V streamName -t <lastProcessed>-<current iterator>
-        if self.config.method == "diff":
-            nextTr = startTrNumber + 1
-            diff = self.TryDiff(streamName=streamName, firstTrNumber=startTrNumber, secondTrNumber=nextTr)
+    # Returns True if the diff between the two transactions is not empty, False if it is and None on failure.
+    # The accurev diff command is terminated as soon as the first changed element is seen. If a path filter is configured the
+    # full diff is needed to decide whether any of the changed elements are included.
+    def TryDiffHasChanges(self, streamName, firstTrNumber, secondTrNumber):
+        if self.config.accurev.pathFilter.IsActive():
+            diff = self.TryDiff(streamName=streamName, firstTrNumber=firstTrNumber, secondTrNumber=secondTrNumber)
             if diff is None:
-                return (None, None)
-    
+                return None
+            return len(diff.elements) > 0
+
+        for i in range(0, AccuRev2Git.commandFailureRetryCount):
+            accurev.ext.backoff(attempt=i)
+            hasChanges = accurev.diff_probe(all=True, informationOnly=True, verSpec1=streamName, verSpec2=streamName, transactionRange="{0}-{1}".format(firstTrNumber, secondTrNumber), useCache=self.config.accurev.UseCommandCache())
+            if hasChanges is not None:
+                break
+        if hasChanges is None:
+            self.config.logger.error( "accurev diff probe failed! stream: {0} time-spec: {1}-{2}".format(streamName, firstTrNumber, secondTrNumber) )
+        return hasChanges
+
+    # Starts computing the diffs between the next `diff-prefetch` consecutive deep-hist candidates on a thread pool so that they are
+    # ready by the time the previous transaction has been committed. The prefetch assumes that every candidate results in a commit.
+    # When one doesn't the start transaction of the following diff changes and the prefetched diffs keyed on it are discarded.
+    def PrefetchDeepHistDiffs(self, streamName, startTrNumber, candidates):
+        depth = self.config.accurev.diffPrefetch
+        if depth is None or depth < 1:
+            return
+
+        # Discard the prefetched diffs that can no longer be used.
+        for key in list(self.diffPrefetch.keys()):
+            if key[0] != streamName or key[1] < startTrNumber:
+                self.diffPrefetch.pop(key).cancel()
+
+        executor = self.GetDiffExecutor()
+        trNumbers = [ startTrNumber ] + candidates[:depth]
+        for firstTrNumber, secondTrNumber in zip(trNumbers, trNumbers[1:]):
+            key = (streamName, firstTrNumber, secondTrNumber)
+            if key not in self.diffPrefetch:
+                self.diffPrefetch[key] = executor.submit(self.TryDiff, streamName=streamName, firstTrNumber=firstTrNumber, secondTrNumber=secondTrNumber)
+
+    # Returns the prefetched diff between the two transactions or None if it wasn't prefetched or the prefetch has failed.
+    def TakePrefetchedDiff(self, streamName, firstTrNumber, secondTrNumber):
+        future = self.diffPrefetch.pop((streamName, firstTrNumber, secondTrNumber), None)
+        if future is None:
+            return None
+        return future.result()
+
+    # Returns the thread pool on which the diffs are prefetched and probed. It is created on first use, with enough threads for the
+    # `diff-prefetch` depth and the `diff-probe-window` together, and is shut down by ClearDiffPrefetch().
+    def GetDiffExecutor(self):
+        if self.diffExecutor is None:
+            depth = self.config.accurev.diffPrefetch if self.config.accurev.diffPrefetch is not None else 0
+            window = self.config.accurev.diffProbeWindow if self.config.accurev.diffProbeWindow is not None else 0
+            self.diffExecutor = ThreadPoolExecutor(max_workers=max(1, max(0, depth) + max(0, window)))
+        return self.diffExecutor
+
+    # Discards the prefetched diffs and shuts down the diff thread pool. Called at the end of each stream and of the conversion.
+    def ClearDiffPrefetch(self):
+        for future in self.diffPrefetch.values():
+            future.cancel()
+        self.diffPrefetch = {}
+        if self.diffExecutor is not None:
+            self.diffExecutor.shutdown(wait=True)
+            self.diffExecutor = None
+
+    # Returns a (trNumber, hasChanges) tuple where trNumber is the first of the trNumbers, in the given order, whose diff against the
+    # startTrNumber is not empty. If all of the diffs are empty (None, False) is returned and on failure (None, None) is returned.
+    # Since each of the diffs is independent of the others for a fixed startTrNumber, up to `diff-probe-window` of them are probed
+    # concurrently to hide the accurev server latency. The result is the same as if they were probed one at a time.
+    def FindFirstChangeTransaction(self, streamName, startTrNumber, trNumbers):
+        window = self.config.accurev.diffProbeWindow
+        if window is None or window < 1:
+            window = 1
+
+        trNumbers = iter(trNumbers)
+        while True:
+            batch = list(itertools.islice(trNumbers, window))
+            if len(batch) == 0:
+                break
+            elif len(batch) == 1:
+                results = [ self.TryDiffHasChanges(streamName=streamName, firstTrNumber=startTrNumber, secondTrNumber=trNumber) for trNumber in batch ]
+            else:
+                executor = self.GetDiffExecutor()
+                futures = [ executor.submit(self.TryDiffHasChanges, streamName=streamName, firstTrNumber=startTrNumber, secondTrNumber=trNumber) for trNumber in batch ]
+                results = [ f.result() for f in futures ]
+            for trNumber, hasChanges in zip(batch, results):
+                if hasChanges is None:
+                    return (None, None)
+                elif hasChanges:
+                    return (trNumber, True)
+
+        return (None, False)
+
+    # Yields the ids of the deep-hist transactions that come after the startTrNumber and touch the included paths. The deepHist is an
+    # accurev.obj.TransactionList or an accurev.obj.TransactionCursor so the list is never scanned from the start.
+    def IterDeepHistCandidates(self, deepHist, startTrNumber):
+        for tr in deepHist.iter_after(startTrNumber):
+            if not self.config.accurev.pathFilter.IsTransactionIncluded(tr):
+                self.config.logger.dbg("FindNextChangeTransaction deep-hist skipping: {0}, no included paths...".format(tr.id))
+                continue
+            yield tr.id
+
+    def FindNextChangeTransaction(self, streamName, startTrNumber, endTrNumber, deepHist=None, method=None):
+        if method is None:
+            method = self.config.method
+        # Iterate over transactions in order using accurev diff -a -i -v streamName -V streamName -t <lastProcessed>-<current iterator>
+        if method == "diff":
             # Note: This is likely to be a hot path. However, it cannot be optimized since a revert of a transaction would not show up in the diff even though the
             #       state of the stream was changed during that period in time. Hence to be correct we must iterate over the transactions one by one unless we have
             #       explicit knowlege of all the transactions which could affect us via some sort of deep history option...
-            while nextTr <= endTrNumber and len(diff.elements) == 0:
-                nextTr += 1
+            #       The probes can still be issued concurrently, see FindFirstChangeTransaction().
+            nextTr, hasChanges = self.FindFirstChangeTransaction(streamName=streamName, startTrNumber=startTrNumber, trNumbers=range(startTrNumber + 1, endTrNumber + 1))
+            if hasChanges is None:
+                return (None, None)
+            elif not hasChanges:
+                nextTr = endTrNumber + 1
+
+            # Only the transaction that we are going to commit needs the full diff.
+            if hasChanges:
                 diff = self.TryDiff(streamName=streamName, firstTrNumber=startTrNumber, secondTrNumber=nextTr)
                 if diff is None:
                     return (None, None)
+            else:
+                diff = accurev.obj.Diff(taskId=None, elements=[])
         
             self.config.logger.dbg("FindNextChangeTransaction diff: {0}".format(nextTr))
             return (nextTr, diff)
-        elif self.config.method == "deep-hist":
+        elif method == "deep-hist":
             if deepHist is None:
                 raise Exception("Script error! deepHist argument cannot be none when running a deep-hist method.")
             # Find the next transaction
-            for tr in deepHist:
-                if tr.id > startTrNumber:
-                    diff = self.TryDiff(streamName=streamName, firstTrNumber=startTrNumber, secondTrNumber=tr.id)
-                    if diff is None:
-                        return (None, None)
-                    elif len(diff.elements) > 0:
-                        self.config.logger.dbg("FindNextChangeTransaction deep-hist: {0}".format(tr.id))
-                        return (tr.id, diff)
-                    else:
-                        self.config.logger.dbg("FindNextChangeTransaction deep-hist skipping: {0}, diff was empty...".format(tr.id))
+            candidates = self.IterDeepHistCandidates(deepHist=deepHist, startTrNumber=startTrNumber)
+            upcoming = list(itertools.islice(candidates, max(1, self.config.accurev.diffPrefetch or 0)))
+
+            self.PrefetchDeepHistDiffs(streamName=streamName, startTrNumber=startTrNumber, candidates=upcoming)
+            if len(upcoming) > 0:
+                diff = self.TakePrefetchedDiff(streamName=streamName, firstTrNumber=startTrNumber, secondTrNumber=upcoming[0])
+                if diff is not None:
+                    if len(diff.elements) > 0:
+                        self.config.logger.dbg("FindNextChangeTransaction deep-hist (prefetched): {0}".format(upcoming[0]))
+                        return (upcoming[0], diff)
+                    self.config.logger.dbg("FindNextChangeTransaction deep-hist skipping: {0}, prefetched diff was empty...".format(upcoming[0]))
+                    upcoming = upcoming[1:]
+
+            nextTr, hasChanges = self.FindFirstChangeTransaction(streamName=streamName, startTrNumber=startTrNumber, trNumbers=itertools.chain(upcoming, candidates))
+            if hasChanges is None:
+                return (None, None)
+            elif hasChanges:
+                diff = self.TryDiff(streamName=streamName, firstTrNumber=startTrNumber, secondTrNumber=nextTr)
+                if diff is None:
+                    return (None, None)
+                self.config.logger.dbg("FindNextChangeTransaction deep-hist: {0}".format(nextTr))
+                return (nextTr, diff)
 
             diff = self.TryDiff(streamName=streamName, firstTrNumber=startTrNumber, secondTrNumber=endTrNumber)
             return (endTrNumber + 1, diff) # The end transaction number is inclusive. We need to return the one after it.
-        elif self.config.method == "pop":
+        elif method == "pop":
             self.config.logger.dbg("FindNextChangeTransaction pop: {0}".format(startTrNumber + 1))
             return (startTrNumber + 1, None)
+        elif method == "update":
+            # Like the diff method the workspace must be stepped through the transactions one at a time or a revert could be missed. The update
+            # reports the elements that it changed so the transactions which didn't change anything are skipped without looking at the git repo.
+            # The empty directory placeholders are removed first so that `accurev update` can remove the directories which were defuncted.
+            self.DeleteEmptyDirPlaceholders()
+            for trNumber in range(startTrNumber + 1, endTrNumber + 1):
+                update = self.TryUpdate(trNumber=trNumber)
+                if update is None:
+                    return (None, None)
+                elif len(update.elements) > 0:
+                    self.config.logger.dbg("FindNextChangeTransaction update: {0} ({1} elements)".format(trNumber, len(update.elements)))
+                    return (trNumber, update)
+                self.config.logger.dbg("FindNextChangeTransaction update skipping: {0}, nothing was updated...".format(trNumber))
+            return (endTrNumber + 1, accurev.obj.Update(elements=[]))
         else:
-            self.config.logger.error("Method is unrecognized, allowed values are 'pop', 'diff' and 'deep-hist'")
+            self.config.logger.error("Method is unrecognized, allowed values are 'pop', 'diff', 'deep-hist', 'single-pass', 'update' and 'auto'")
             raise Exception("Invalid configuration, method unrecognized!")
 
     def DeleteDiffItemsFromRepo(self, diff):
@@ -730,18 +1394,59 @@ class AccuRev2Git(object):
 
         return deletedPathList
 
-    def TryHist(self, depot, trNum):
+    # If transactionOnly is set the versions of the transaction aren't requested which is cheaper when only its id is needed.
+    def TryHist(self, depot, trNum, transactionOnly=False):
         for i in range(0, AccuRev2Git.commandFailureRetryCount):
-            endTrHist = accurev.hist(depot=depot, timeSpec="{0}.1".format(trNum), useCache=self.config.accurev.UseCommandCache())
+            accurev.ext.backoff(attempt=i)
+            endTrHist = accurev.hist(depot=depot, timeSpec="{0}.1".format(trNum), transactionMode=transactionOnly, useCache=self.config.accurev.UseCommandCache())
             if endTrHist is not None:
                 break
         return endTrHist
 
+    # Deletes everything from the git repository that the path filter doesn't include.
+    def PruneFilteredPaths(self):
+        prunedPathList = []
+        pathFilter = self.config.accurev.pathFilter
+        if pathFilter.IsActive():
+            for root, dirs, files in os.walk(self.gitRepo.path, topdown=True):
+                relRoot = os.path.relpath(root, self.gitRepo.path)
+                for name in list(dirs):
+                    relPath = os.path.join(relRoot, name)
+                    if relRoot == '.' and name == '.git':
+                        dirs.remove(name)
+                    elif not pathFilter.IsDirNeeded(relPath):
+                        dirs.remove(name)
+                        if self.DeletePath(os.path.join(root, name)):
+                            prunedPathList.append(relPath)
+                for name in files:
+                    relPath = os.path.join(relRoot, name)
+                    if relRoot == '.' and name == '.git':
+                        continue # A git worktree has a .git file instead of a directory.
+                    elif not pathFilter.IsIncluded(relPath):
+                        if self.DeletePath(os.path.join(root, name)):
+                            prunedPathList.append(relPath)
+            if len(prunedPathList) > 0:
+                self.config.logger.dbg("Pruned {0} paths excluded by the path filter.".format(len(prunedPathList)))
+        return prunedPathList
+
     def TryPop(self, streamName, transaction, overwrite=False):
+        popList = self.config.accurev.pathFilter.GetPopulateList()
+        startTime = time.time()
         for i in range(0, AccuRev2Git.commandFailureRetryCount):
-            popResult = accurev.pop(verSpec=streamName, location=self.gitRepo.path, isRecursive=True, isOverride=overwrite, timeSpec=transaction.id, elementList='.')
+            accurev.ext.backoff(attempt=i)
+            if overwrite and self.config.accurev.populateJobs is not None and self.config.accurev.populateJobs > 1:
+                # A full populate can be split up by top-level elements and done concurrently.
+                popResult = accurev.ext.parallel_pop(verSpec=streamName, location=self.gitRepo.path, timeSpec=transaction.id, jobs=self.config.accurev.populateJobs, isOverride=overwrite, elementList=(None if popList == [ '.' ] else popList))
+            else:
+                popResult = accurev.pop(verSpec=streamName, location=self.gitRepo.path, isRecursive=True, isOverride=overwrite, timeSpec=transaction.id, elementList=popList)
             if popResult:
+                self.PruneFilteredPaths()
+                if overwrite:
+                    # Used by the auto method to estimate the cost of the pop method.
+                    self.lastFullPopSeconds = time.time() - startTime
                 break
+            elif popResult is None:
+                self.config.logger.error("accurev pop failed! No output.")
             else:
                 self.config.logger.error("accurev pop failed:")
                 for message in popResult.messages:
@@ -752,9 +1457,46 @@ class AccuRev2Git(object):
         
         return popResult
 
-    def ProcessStream(self, depot, stream, branchName, startTransaction, endTransaction):
-        self.config.logger.info( "Processing {0} -> {1} : {2} - {3}".format(stream.name, branchName, startTransaction, endTransaction) )
+    # Updates the workspace of the 'update' method, which is located in the git repository, to the given transaction. Note that
+    # `accurev update` operates on the workspace in the current working directory which is the git repository (see Start()).
+    def TryUpdate(self, trNumber, isOverride=False):
+        for i in range(0, AccuRev2Git.commandFailureRetryCount):
+            accurev.ext.backoff(attempt=i)
+            update = accurev.update(transactionNumber=trNumber, isOverride=isOverride)
+            if update:
+                if len(update.messages) > 0:
+                    self.config.logger.dbg("accurev update -t {0}: {1}".format(trNumber, ' '.join([ str(message) for message in update.messages ])))
+                return update
+            elif update is None:
+                self.config.logger.error("accurev update -t {0} failed! No output.".format(trNumber))
+            else:
+                self.config.logger.error("accurev update -t {0} failed:".format(trNumber))
+                for message in update.messages + [ error for error in update.errors if error not in update.messages ]:
+                    self.config.logger.error("  {0}".format(message))
+        return None
 
+    # Reparents the dedicated workspace of the 'update' method onto the stream, moves it into the git repository and updates it to the
+    # given transaction, overwriting what was populated or checked out there. Returns True if the workspace is ready for `accurev update -t`.
+    def StartWorkspace(self, stream, transaction):
+        workspace = self.config.accurev.workspace
+        if workspace is None:
+            self.config.logger.error("The 'update' method requires a workspace. Set the workspace attribute of the accurev element in the config or use the --workspace option.")
+            return False
+        if not accurev.chws(workspace=workspace, newBackingStream=stream.name, newLocation=os.path.abspath(self.gitRepo.path)):
+            self.config.logger.error("Failed to reparent workspace {0} onto {1} at {2}.".format(workspace, stream.name, os.path.abspath(self.gitRepo.path)))
+            return False
+        self.DeleteEmptyDirPlaceholders()
+        if self.TryUpdate(trNumber=transaction.id, isOverride=True) is None:
+            # A workspace can't be updated to a transaction before its current update level.
+            self.config.logger.error("Failed to update workspace {0} to tr. #{1}.".format(workspace, transaction.id))
+            return False
+        self.PruneFilteredPaths()
+        self.config.logger.dbg("Workspace {0} is on {1} at tr. #{2}.".format(workspace, stream.name, transaction.id))
+        return True
+
+    # Checks out the branch for the stream, making its first commit if it is a new branch, and returns a (tr, stream, commitHash) tuple
+    # where tr is the last processed transaction and stream is the obj.Stream at that transaction. Returns (None, None, None) on failure.
+    def StartStream(self, depot, stream, branchName, startTransaction, endTransaction):
         # Find the matching git branch
         branch = None
         for b in self.gitBranchList:
@@ -767,6 +1509,8 @@ class AccuRev2Git(object):
             # Get the last processed transaction
             self.ClearGitRepo()
             self.gitRepo.checkout(branchName=branchName)
+            # If the branch was already checked out (e.g. when following the depot) the checkout doesn't restore the deleted files.
+            self.gitRepo.reset(isHard=True)
             status = self.gitRepo.status()
 
         tr = None
@@ -783,9 +1527,17 @@ class AccuRev2Git(object):
                 except:
                     destStream = None
                 self.config.logger.dbg( "{0} pop (init): {1} {2}{3}".format(stream.name, tr.Type, tr.id, " to {0}".format(destStream) if destStream is not None else "") )
-                popResult = self.TryPop(streamName=stream.name, transaction=tr, overwrite=True)
+                popResult = None
+                if self.SeedBranchFromParent(depot=depot, stream=stream, transaction=tr):
+                    # Only the elements in which we differ from the parent are missing so don't overwrite.
+                    popResult = self.TryPop(streamName=stream.name, transaction=tr, overwrite=False)
+                    if not popResult:
+                        self.config.logger.info( "{0}: populate after seeding failed. Falling back to a full populate.".format(stream.name) )
+                        self.ClearGitRepo()
                 if not popResult:
-                    return (None, None)
+                    popResult = self.TryPop(streamName=stream.name, transaction=tr, overwrite=True)
+                if not popResult:
+                    return (None, None, None)
                 
                 stream = accurev.show.streams(depot=depot, stream=stream.streamNumber, timeSpec=tr.id).streams[0]
                 commitHash = self.Commit(depot=depot, stream=stream, transaction=tr, branchName=branchName, isFirstCommit=True)
@@ -795,7 +1547,7 @@ class AccuRev2Git(object):
                     self.config.logger.info( "stream {0}: tr. #{1} {2} into {3} -> commit {4} on {5}".format(stream.name, tr.id, tr.Type, destStream if destStream is not None else 'unknown', commitHash[:8], branchName) )
             else:
                 self.config.logger.info( "Failed to get the first transaction for {0} from accurev. Won't process any further.".format(stream.name) )
-                return (None, None)
+                return (None, None, None)
         else:
             # Get the last processed transaction
             commitHash = self.GetLastCommitHash(branchName=branchName)
@@ -810,7 +1562,7 @@ class AccuRev2Git(object):
                     subprocess.check_call(resetCmd)
                 except subprocess.CalledProcessError:
                     self.config.logger.error("Failed to reset branch. Aborting!")
-                    return (None, None)
+                    return (None, None, None)
 
                 commitHash = self.GetLastCommitHash(branchName=branchName)
                 hist = self.GetHistForCommit(commitHash=commitHash, branchName=branchName)
@@ -818,135 +1570,775 @@ class AccuRev2Git(object):
                 if hist is None:
                     self.config.logger.error("Repo in invalid state. Please reset this branch to a previous commit with valid notes.")
                     self.config.logger.error("  e.g. git reset --hard {0}~1".format(branchName))
-                    return (None, None)
+                    return (None, None, None)
 
             tr = hist.transactions[0]
             stream = accurev.show.streams(depot=depot, stream=stream.streamNumber, timeSpec=tr.id).streams[0]
             self.config.logger.dbg("{0}: last processed transaction was #{1}".format(stream.name, tr.id))
 
-        endTrHist = self.TryHist(depot=depot, trNum=endTransaction)
+        return (tr, stream, commitHash)
+
+    # Applies the diff (or clears the repo for the pop method), populates and commits the transaction trNumber onto the branch which must
+    # be checked out. Returns a (tr, stream, commitHash) tuple where the commitHash is None if nothing was committed, see IsNothingToCommit()
+    # for the reason. Returns (None, None, None) on failure.
+    def CommitTransaction(self, depot, stream, branchName, trNumber, diff, method=None):
+        if method is None:
+            method = self.config.method
+        # Delete all of the files which are even mentioned in the diff so that we can do a quick populate (wouth the overwrite option)
+        deletedPathList = []
+        popOverwrite = (method == "pop")
+        if method == "pop":
+            self.ClearGitRepo()
+        elif method == "update":
+            pass # The workspace was already updated to the transaction by FindNextChangeTransaction(). `accurev update` removes and downloads the changed elements itself.
+        else:
+            try:
+                deletedPathList = self.DeleteDiffItemsFromRepo(diff=diff)
+            except:
+                popOverwrite = True
+                self.config.logger.info("Error trying to delete changed elements. Fatal, aborting!")
+                # This might be ok only in the case when the files/directories were changed but not in the case when there
+                # was a deletion that occurred. Abort and be safe!
+                # TODO: This must be solved somehow since this could hinder this script from continuing at all!
+                return (None, None, None)
+
+            # Remove all the empty directories (this includes directories which contain an empty .gitignore file since that's what we is done to preserve them)
+            try:
+                self.DeleteEmptyDirs()
+            except:
+                popOverwrite = True
+                self.config.logger.info("Error trying to delete empty directories. Fatal, aborting!")
+                # This might be ok only in the case when the files/directories were changed but not in the case when there
+                # was a deletion that occurred. Abort and be safe!
+                # TODO: This must be solved somehow since this could hinder this script from continuing at all!
+                return (None, None, None)
+
+        # The accurev hist command here must be used with the depot option since the transaction that has affected us may not
+        # be a promotion into the stream we are looking at but into one of its parent streams. Hence we must query the history
+        # of the depot and not the stream itself.
+        hist = self.TryHist(depot=depot, trNum=trNumber)
+        if hist is None:
+            self.config.logger.dbg("accurev hist -p {0} -t {1}.1 failed.".format(depot, trNumber))
+            return (None, None, None)
+        tr = hist.transactions[0]
+        stream = accurev.show.streams(depot=depot, stream=stream.streamNumber, timeSpec=tr.id).streams[0]
+
+        # Populate
+        #destStream = self.GetDestinationStreamName(history=hist, depot=depot) # Slower: This performes an extra accurev.show.streams() command for correct stream names.
+        destStream = self.GetDestinationStreamName(history=hist, depot=None) # Quicker: This does not perform an extra accurev.show.streams() command for correct stream names.
+        self.config.logger.dbg( "{0} pop: {1} {2}{3}".format(stream.name, tr.Type, tr.id, " to {0}".format(destStream) if destStream is not None else "") )
+
+        if method == "update":
+            # The elements reported by the update stand in for the populated elements.
+            popResult = diff
+            self.PruneFilteredPaths()
+        else:
+            popResult = self.TryPop(streamName=stream.name, transaction=tr, overwrite=popOverwrite)
+            if not popResult:
+                return (None, None, None)
+
+        # Commit
+        commitHash = self.Commit(depot=depot, stream=stream, transaction=tr, branchName=branchName, isFirstCommit=False)
+        if commitHash is None:
+            if self.IsNothingToCommit():
+                if diff is not None and method != "update":
+                    self.config.logger.dbg( "diff info ({0} elements):".format(len(diff.elements)) )
+                    for element in diff.elements:
+                        for change in element.changes:
+                            self.config.logger.dbg( "  what changed: {0}".format(change.what) )
+                            self.config.logger.dbg( "  original: {0}".format(change.stream1) )
+                            self.config.logger.dbg( "  new:      {0}".format(change.stream2) )
+                self.config.logger.dbg( "deleted {0} files:".format(len(deletedPathList)) )
+                for p in deletedPathList:
+                    self.config.logger.dbg( "  {0}".format(p) )
+                self.config.logger.dbg( "populated {0} files:".format(len(popResult.elements)) )
+                for e in popResult.elements:
+                    self.config.logger.dbg( "  {0}".format(e.location) )
+                self.config.logger.info("stream {0}: tr. #{1} is a no-op. Potential but unlikely error. Continuing.".format(stream.name, tr.id))
+        else:
+            self.config.logger.info( "stream {0}: tr. #{1} {2} into {3} -> commit {4} on {5}".format(stream.name, tr.id, tr.Type, destStream if destStream is not None else 'unknown', commitHash[:8], branchName) )
+
+        return (tr, stream, commitHash)
+
+    # Returns an accurev.obj.TransactionCursor over the deep history of the stream for the deep-hist method.
+    def StartDeepHist(self, depot, stream, startTrNumber, endTrNumber):
+        ignoreTimelocks=False # The transactions made in the parent streams after a timelock can't affect the stream so they are skipped. The timelocks are
+                              # resolved using a local transaction time index (see accurev.ext.TransactionTimeIndex) so this costs no extra accurev commands.
+        # The versions of the transactions are only needed to check them against the path filter.
+        transactionsOnly = not self.config.accurev.pathFilter.IsActive()
+        self.config.logger.dbg("accurev.ext.iter_deep_hist(depot={0}, stream={1}, timeSpec='{2}-{3}', ignoreTimelocks={4}, transactionsOnly={5})".format(depot, stream.name, startTrNumber, endTrNumber, ignoreTimelocks, transactionsOnly))
+        # The deep history is generated lazily, as the conversion progresses, instead of being retrieved in its entirety up front.
+        return accurev.obj.TransactionCursor(accurev.ext.iter_deep_hist(depot=depot, stream=stream.name, timeSpec="{0}-{1}".format(startTrNumber, endTrNumber), ignoreTimelocks=ignoreTimelocks, transactionsOnly=transactionsOnly))
+
+    def ProcessStream(self, depot, stream, branchName, startTransaction, endTransaction):
+        self.config.logger.info( "Processing {0} -> {1} : {2} - {3}".format(stream.name, branchName, startTransaction, endTransaction) )
+
+        self.lastFullPopSeconds = None
+        tr, stream, commitHash = self.StartStream(depot=depot, stream=stream, branchName=branchName, startTransaction=startTransaction, endTransaction=endTransaction)
+        if tr is None:
+            return (None, None)
+
+        endTrHist = self.TryHist(depot=depot, trNum=endTransaction, transactionOnly=True)
         if endTrHist is None:
             self.config.logger.dbg("accurev hist -p {0} -t {1}.1 failed.".format(depot, endTransaction))
             return (None, None)
         endTr = endTrHist.transactions[0]
         self.config.logger.info("{0}: processing transaction range #{1} - #{2}".format(stream.name, tr.id, endTr.id))
 
-        deepHist = None
-        if self.config.method == "deep-hist":
-            ignoreTimelocks=True # The code for the timelocks is not tested fully yet. Once tested setting this to false should make the resulting set of transactions smaller
-                                 # at the cost of slightly larger number of upfront accurev commands called.
-            self.config.logger.dbg("accurev.ext.deep_hist(depot={0}, stream={1}, timeSpec='{2}-{3}', ignoreTimelocks={4})".format(depot, stream.name, tr.id, endTr.id, ignoreTimelocks))
-            deepHist = accurev.ext.deep_hist(depot=depot, stream=stream.name, timeSpec="{0}-{1}".format(tr.id, endTr.id), ignoreTimelocks=ignoreTimelocks)
-            self.config.logger.info("Deep-hist returned {count} transactions to process.".format(count=len(deepHist)))
-            if deepHist is None:
-                raise Exception("accurev.ext.deep_hist() failed to return a result!")
-        while True:
-            nextTr, diff = self.FindNextChangeTransaction(streamName=stream.name, startTrNumber=tr.id, endTrNumber=endTr.id, deepHist=deepHist)
-            if nextTr is None or diff is None:
-                self.config.logger.dbg( "FindNextChangeTransaction(streamName='{0}', startTrNumber={1}, endTrNumber={2}, deepHist={3}) failed!".format(stream.name, tr.id, endTr.id, deepHist) )
-                return (None, None)
+        method = self.config.method
+        selector = None
+        if method == "auto":
+            selector = AutoMethodSelector(logger=self.config.logger, streamName=stream.name)
+            if self.lastFullPopSeconds is not None:
+                selector.costs["pop"] = self.lastFullPopSeconds
+            method = selector.method
+        elif method == "update" and not self.StartWorkspace(stream=stream, transaction=tr):
+            self.config.logger.info("{0}: can't convert with the 'update' method. Falling back to the 'deep-hist' method.".format(stream.name))
+            method = "deep-hist"
+
+        try:
+            deepHist = None
+            if method == "deep-hist":
+                deepHist = self.StartDeepHist(depot=depot, stream=stream, startTrNumber=tr.id, endTrNumber=endTr.id)
+            while True:
+                startTime = time.time()
+                startTrNumber = tr.id
+                nextTr, diff = self.FindNextChangeTransaction(streamName=stream.name, startTrNumber=tr.id, endTrNumber=endTr.id, deepHist=deepHist, method=method)
+                if nextTr is None or (diff is None and method != "pop"):
+                    self.config.logger.dbg( "FindNextChangeTransaction(streamName='{0}', startTrNumber={1}, endTrNumber={2}, deepHist={3}) failed!".format(stream.name, tr.id, endTr.id, deepHist) )
+                    return (None, None)
 
-            self.config.logger.dbg( "{0}: next transaction {1} (end tr. {2})".format(stream.name, nextTr, endTr.id) )
-            if nextTr <= endTr.id:
-                # Right now nextTr is an integer representation of our next transaction.
-                # Delete all of the files which are even mentioned in the diff so that we can do a quick populate (wouth the overwrite option)
-                popOverwrite = (self.config.method == "pop")
-                if self.config.method == "pop":
-                    self.ClearGitRepo()
-                else:
-                    try:
-                        deletedPathList = self.DeleteDiffItemsFromRepo(diff=diff)
-                    except:
-                        popOverwrite = True
-                        self.config.logger.info("Error trying to delete changed elements. Fatal, aborting!")
-                        # This might be ok only in the case when the files/directories were changed but not in the case when there
-                        # was a deletion that occurred. Abort and be safe!
-                        # TODO: This must be solved somehow since this could hinder this script from continuing at all!
-                        return (None, None)
+                self.config.logger.dbg( "{0}: next transaction {1} (end tr. {2})".format(stream.name, nextTr, endTr.id) )
+                if nextTr <= endTr.id:
+                    candidateCount = None
+                    if selector is not None and deepHist is not None:
+                        candidateCount = len(list(itertools.takewhile(lambda candidate: candidate.id <= nextTr, deepHist.iter_after(startTrNumber))))
 
-                    # Remove all the empty directories (this includes directories which contain an empty .gitignore file since that's what we is done to preserve them)
-                    try:
-                        self.DeleteEmptyDirs()
-                    except:
-                        popOverwrite = True
-                        self.config.logger.info("Error trying to delete empty directories. Fatal, aborting!")
-                        # This might be ok only in the case when the files/directories were changed but not in the case when there
-                        # was a deletion that occurred. Abort and be safe!
-                        # TODO: This must be solved somehow since this could hinder this script from continuing at all!
+                    # Right now nextTr is an integer representation of our next transaction.
+                    tr, stream, commitHash = self.CommitTransaction(depot=depot, stream=stream, branchName=branchName, trNumber=nextTr, diff=diff, method=method)
+                    if tr is None:
                         return (None, None)
+                    elif commitHash is None and not self.IsNothingToCommit():
+                        break # Early return from processing this stream. Restarting should clean everything up.
 
-                # The accurev hist command here must be used with the depot option since the transaction that has affected us may not
-                # be a promotion into the stream we are looking at but into one of its parent streams. Hence we must query the history
-                # of the depot and not the stream itself.
-                hist = self.TryHist(depot=depot, trNum=nextTr)
-                if hist is None:
-                    self.config.logger.dbg("accurev hist -p {0} -t {1}.1 failed.".format(depot, endTransaction))
-                    return (None, None)
-                tr = hist.transactions[0]
-                stream = accurev.show.streams(depot=depot, stream=stream.streamNumber, timeSpec=tr.id).streams[0]
+                    if selector is not None:
+                        selector.Record(transactionCount=(nextTr - startTrNumber), candidateCount=candidateCount, seconds=(time.time() - startTime))
+                        newMethod = selector.Checkpoint()
+                        if newMethod != method:
+                            method = newMethod
+                            self.ClearDiffPrefetch()
+                            deepHist = None
+                            if method == "deep-hist":
+                                deepHist = self.StartDeepHist(depot=depot, stream=stream, startTrNumber=tr.id, endTrNumber=endTr.id)
+                else:
+                    self.config.logger.info( "Reached end transaction #{0} for {1} -> {2}".format(endTr.id, stream.name, branchName) )
+                    break
 
-                # Populate
-                #destStream = self.GetDestinationStreamName(history=hist, depot=depot) # Slower: This performes an extra accurev.show.streams() command for correct stream names.
-                destStream = self.GetDestinationStreamName(history=hist, depot=None) # Quicker: This does not perform an extra accurev.show.streams() command for correct stream names.
-                self.config.logger.dbg( "{0} pop: {1} {2}{3}".format(stream.name, tr.Type, tr.id, " to {0}".format(destStream) if destStream is not None else "") )
+        finally:
+            self.ClearDiffPrefetch()
+        return (tr, commitHash)
 
-                popResult = self.TryPop(streamName=stream.name, transaction=tr, overwrite=popOverwrite)
-                if not popResult:
-                    return (None, None)
+    # Returns a list of dictionaries describing the commits on the given branch, oldest first, or None on failure.
+    def GetCommitMetadataList(self, branchName):
+        fields = [ "hash", "tree", "author_name", "author_email", "author_date", "committer_name", "committer_email", "committer_date", "message" ]
+        output = self.gitRepo.raw_cmd([ u'git', u'log', u'--reverse', u'-z', u'--date=raw', u'--format=format:%H%x00%T%x00%an%x00%ae%x00%ad%x00%cn%x00%ce%x00%cd%x00%B', branchName ])
+        if output is None:
+            self.config.logger.error("Failed to list the commits on branch {0}. Err: {1}".format(branchName, self.gitRepo.lastResult.stderr))
+            return None
+        values = output.split('\0')
+        if len(values) % len(fields) != 0:
+            self.config.logger.error("Failed to parse the commits on branch {0}.".format(branchName))
+            return None
+        return [ dict(zip(fields, values[i:i + len(fields)])) for i in range(0, len(values), len(fields)) ]
+
+    # Joins the histories of the partitions converted by ProcessStreamPartitioned() into a single linear history on the given branch
+    # using git fast-import. The commits keep their trees and metadata and the script state notes are carried over to the new commits.
+    # The first commit of every partition but the first is a full populate of the last transaction of the previous partition so its tree
+    # must match the tree of the last commit of the previous partition. It is used only for this check and isn't included in the history.
+    # Returns the hash of the last commit on the branch or None on failure.
+    def GraftPartitions(self, branchName, partitions):
+        commitList = []
+        noteMap = {}
+        lastTree = None
+        for i, partition in enumerate(partitions):
+            partitionCommitList = self.GetCommitMetadataList(branchName=partition["branch_name"])
+            if partitionCommitList is None or len(partitionCommitList) == 0:
+                self.config.logger.error("Partition {0} ({1}) has no commits.".format(i, partition["branch_name"]))
+                return None
+            if lastTree is not None:
+                if partitionCommitList[0]["tree"] != lastTree:
+                    self.config.logger.error("Partition {0} ({1}) doesn't continue from where partition {2} ended. Tree {3} at tr. #{4} should have been {5}.".format(i, partition["branch_name"], i - 1, partitionCommitList[0]["tree"], partition["start"], lastTree))
+                    return None
+                self.config.logger.dbg("Partition {0} matches partition {1} at tr. #{2} (tree {3}).".format(i, i - 1, partition["start"], lastTree))
+            lastTree = partitionCommitList[-1]["tree"]
+            commitList.extend(partitionCommitList if i == 0 else partitionCommitList[1:])
 
-                # Commit
-                commitHash = self.Commit(depot=depot, stream=stream, transaction=tr, branchName=branchName, isFirstCommit=False)
-                if commitHash is None:
-                    if"nothing to commit" in self.gitRepo.lastStdout:
-                        self.config.logger.dbg( "diff info ({0} elements):".format(len(diff.elements)) )
-                        for element in diff.elements:
-                            for change in element.changes:
-                                self.config.logger.dbg( "  what changed: {0}".format(change.what) )
-                                self.config.logger.dbg( "  original: {0}".format(change.stream1) )
-                                self.config.logger.dbg( "  new:      {0}".format(change.stream2) )
-                        self.config.logger.dbg( "deleted {0} files:".format(len(deletedPathList)) )
-                        for p in deletedPathList:
-                            self.config.logger.dbg( "  {0}".format(p) )
-                        self.config.logger.dbg( "populated {0} files:".format(len(popResult.elements)) )
-                        for e in popResult.elements:
-                            self.config.logger.dbg( "  {0}".format(e.location) )
-                        self.config.logger.info("stream {0}: tr. #{1} is a no-op. Potential but unlikely error. Continuing.".format(stream.name, tr.id))
-                    else:
-                        break # Early return from processing this stream. Restarting should clean everything up.
-                else:
-                    self.config.logger.info( "stream {0}: tr. #{1} {2} into {3} -> commit {4} on {5}".format(stream.name, tr.id, tr.Type, destStream if destStream is not None else 'unknown', commitHash[:8], branchName) )
-            else:
-                self.config.logger.info( "Reached end transaction #{0} for {1} -> {2}".format(endTr.id, stream.name, branchName) )
+            notesOutput = self.gitRepo.raw_cmd([ u'git', u'notes', u'--ref', partition["branch_name"], u'list' ])
+            if notesOutput is None:
+                self.config.logger.error("Failed to list the notes for partition {0} ({1}). Err: {2}".format(i, partition["branch_name"], self.gitRepo.lastResult.stderr))
+                return None
+            for line in notesOutput.splitlines():
+                noteBlob, commitHash = line.split()
+                noteMap[commitHash] = noteBlob
+
+        # Commits are recreated with the same trees, authors, dates and messages so the result doesn't depend on how the range was partitioned.
+        with tempfile.NamedTemporaryFile(mode='w+b', prefix='ac2git_fast_import_', delete=False) as streamFile:
+            streamFilePath = streamFile.name
+            for mark, commit in enumerate(commitList, start=1):
+                message = commit["message"].encode('utf-8')
+                streamFile.write(u'commit refs/heads/{0}\nmark :{1}\n'.format(branchName, mark).encode('utf-8'))
+                streamFile.write(u'author {0} <{1}> {2}\n'.format(commit["author_name"], commit["author_email"], commit["author_date"]).encode('utf-8'))
+                streamFile.write(u'committer {0} <{1}> {2}\n'.format(commit["committer_name"], commit["committer_email"], commit["committer_date"]).encode('utf-8'))
+                streamFile.write(u'data {0}\n'.format(len(message)).encode('utf-8') + message + b'\n')
+                if mark > 1:
+                    streamFile.write(u'from :{0}\n'.format(mark - 1).encode('utf-8'))
+                streamFile.write(u'M 040000 {0} ""\n\n'.format(commit["tree"]).encode('utf-8'))
+            # The notes are recorded in a single commit on the branch's notes ref, made by the committer of the last converted commit.
+            lastCommit = commitList[-1]
+            streamFile.write(u'commit refs/notes/{0}\n'.format(branchName).encode('utf-8'))
+            streamFile.write(u'committer {0} <{1}> {2}\ndata 0\n'.format(lastCommit["committer_name"], lastCommit["committer_email"], lastCommit["committer_date"]).encode('utf-8'))
+            for mark, commit in enumerate(commitList, start=1):
+                if commit["hash"] in noteMap:
+                    streamFile.write(u'N {0} :{1}\n'.format(noteMap[commit["hash"]], mark).encode('utf-8'))
+            streamFile.write(b'\n')
+
+        with open(streamFilePath, 'rb') as streamFile:
+            process = subprocess.Popen(args=[ u'git', u'fast-import', u'--quiet' ], cwd=self.gitRepo.path, stdin=streamFile, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            output, error = process.communicate()
+        os.remove(streamFilePath)
+        if process.returncode != 0:
+            self.config.logger.error("git fast-import failed to graft the partitions onto {0}. Err: {1}".format(branchName, error))
+            return None
+
+        return self.GetLastCommitHash(branchName=branchName)
+
+    # Converts a new stream by splitting its transaction range into `partitionCount` consecutive partitions which are converted concurrently.
+    # Each partition is converted onto its own temporary branch, in its own git worktree, starting with a full populate of its first transaction
+    # which is also the last transaction of the previous partition. The partitions are then joined into a single history (see GraftPartitions()).
+    # If the conversion of any of the partitions fails the temporary branches are kept for inspection and nothing is written to the branch.
+    def ProcessStreamPartitioned(self, depot, stream, branchName, startTransaction, endTransaction, partitionCount):
+        self.config.logger.info( "Processing {0} -> {1} : {2} - {3} in {4} partitions".format(stream.name, branchName, startTransaction, endTransaction, partitionCount) )
+
+        firstTr = self.GetFirstTransaction(depot=depot, streamName=stream.name, startTransaction=startTransaction, endTransaction=endTransaction)
+        if firstTr is None:
+            self.config.logger.info( "Failed to get the first transaction for {0} from accurev. Won't process any further.".format(stream.name) )
+            return (None, None)
+        endTrHist = self.TryHist(depot=depot, trNum=endTransaction, transactionOnly=True)
+        if endTrHist is None:
+            self.config.logger.dbg("accurev hist -p {0} -t {1}.1 failed.".format(depot, endTransaction))
+            return (None, None)
+        endTr = endTrHist.transactions[0]
+
+        # Don't create partitions with fewer than two transactions, there would be nothing to convert in them besides the full populate.
+        partitionCount = min(partitionCount, endTr.id - firstTr.id)
+        if partitionCount < 2:
+            self.config.logger.info( "{0}: #{1} - #{2} is too short to split, converting it without partitions.".format(stream.name, firstTr.id, endTr.id) )
+            return self.ProcessStream(depot=depot, stream=stream, branchName=branchName, startTransaction=startTransaction, endTransaction=endTransaction)
+
+        worktreeBase = self.GetWorktreeBase()
+        if worktreeBase is None:
+            self.config.logger.error( "Can't create the git worktrees for the partitions of {0}, there is no commit to base them on. Err: {1}. Converting it without partitions.".format(stream.name, self.gitRepo.lastResult.stderr) )
+            return self.ProcessStream(depot=depot, stream=stream, branchName=branchName, startTransaction=startTransaction, endTransaction=endTransaction)
+
+        boundaries = [ firstTr.id + ((endTr.id - firstTr.id) * i) // partitionCount for i in range(0, partitionCount) ] + [ endTr.id ]
+        partitions = []
+        for i in range(0, partitionCount):
+            partitionPath = tempfile.mkdtemp(prefix='ac2git_partition_{0}_'.format(i), dir=os.path.dirname(os.path.abspath(self.gitRepo.path)))
+            if self.gitRepo.raw_cmd([ u'git', u'worktree', u'add', u'--detach', partitionPath, worktreeBase ]) is None:
+                self.config.logger.error( "Failed to create a git worktree for partition {0} at {1}. Err: {2}".format(i, partitionPath, self.gitRepo.lastResult.stderr) )
+                os.rmdir(partitionPath)
                 break
+            partitions.append({ "branch_name": "{0}_partition_{1}".format(branchName, i), "path": partitionPath, "start": boundaries[i], "end": boundaries[i + 1] })
+
+        def ConvertPartition(partition):
+            converter = AccuRev2Git(self.config)
+            converter.cwd = self.cwd
+            converter.gitRepo = git.repo(path=partition["path"]) # git.open() doesn't accept worktrees since their .git is a file.
+            converter.gitBranchList = []
+            self.config.logger.info( "{0}: converting partition #{1} - #{2} onto {3}".format(stream.name, partition["start"], partition["end"], partition["branch_name"]) )
+            return converter.ProcessStream(depot=depot, stream=stream, branchName=partition["branch_name"], startTransaction=partition["start"], endTransaction=partition["end"])
+
+        results = []
+        if len(partitions) == partitionCount:
+            with ThreadPoolExecutor(max_workers=partitionCount) as executor:
+                results = list(executor.map(ConvertPartition, partitions))
+
+        commitHash = None
+        if len(results) == partitionCount and all(tr is not None for tr, partitionCommitHash in results):
+            commitHash = self.GraftPartitions(branchName=branchName, partitions=partitions)
+
+        for partition in partitions:
+            if self.gitRepo.raw_cmd([ u'git', u'worktree', u'remove', u'--force', partition["path"] ]) is None:
+                self.config.logger.error( "Failed to remove the git worktree at {0}. Err: {1}".format(partition["path"], self.gitRepo.lastResult.stderr) )
+        if commitHash is None:
+            self.config.logger.error( "Failed to convert {0} in partitions. The partition branches {1} were kept for inspection.".format(stream.name, ', '.join([ partition["branch_name"] for partition in partitions ])) )
+            return (None, None)
+        for partition in partitions:
+            self.gitRepo.raw_cmd([ u'git', u'branch', u'-D', partition["branch_name"] ])
+            self.gitRepo.raw_cmd([ u'git', u'update-ref', u'-d', u'refs/notes/{0}'.format(partition["branch_name"]) ])
+
+        self.gitBranchList = self.gitRepo.branch_list()
+        if not self.SwitchToBranch(branchName=branchName):
+            return (None, None)
+
+        self.config.logger.info( "Reached end transaction #{0} for {1} -> {2}".format(endTr.id, stream.name, branchName) )
+        return (results[-1][0], commitHash)
+
+    # Returns the commit on which the partition worktrees are created, which doesn't matter since each partition starts an orphan branch,
+    # but `git worktree add` needs one. A new repository has no valid HEAD so an empty commit, which no branch refers to, is made instead.
+    # Returns None on failure.
+    def GetWorktreeBase(self):
+        head = self.gitRepo.raw_cmd([ u'git', u'rev-parse', u'--verify', u'--quiet', u'HEAD^{commit}' ])
+        if head is not None:
+            return head.strip()
+
+        emptyFile = tempfile.NamedTemporaryFile(delete=False)
+        emptyFile.close()
+        try:
+            emptyTree = self.gitRepo.raw_cmd([ u'git', u'hash-object', u'-w', u'-t', u'tree', emptyFile.name ])
+        finally:
+            os.remove(emptyFile.name)
+        if emptyTree is None:
+            return None
+
+        env = os.environ.copy()
+        env.setdefault('GIT_AUTHOR_NAME', 'ac2git')
+        env.setdefault('GIT_AUTHOR_EMAIL', 'ac2git@localhost')
+        env.setdefault('GIT_COMMITTER_NAME', 'ac2git')
+        env.setdefault('GIT_COMMITTER_EMAIL', 'ac2git@localhost')
+        result = self.gitRepo.run([ u'git', u'commit-tree', emptyTree.strip(), u'-m', u'ac2git partition worktree base' ], env=env)
+        if result.returncode != 0:
+            return None
+        return result.stdout.strip()
+
+    # Checks out an existing branch, discarding anything that is left in the working tree from the previous branch.
+    def SwitchToBranch(self, branchName):
+        if self.gitRepo.checkout(branchName=branchName) is None:
+            self.config.logger.error( "Failed to checkout branch {0}. Err: {1}".format(branchName, self.gitRepo.lastResult.stderr) )
+            return False
+        self.gitRepo.reset(isHard=True)
+        self.gitRepo.clean(force=True)
+        return True
+
+    # Converts all of the configured streams in a single pass over the depot's transactions, in the order in which they were made.
+    # Each transaction is only processed for the streams that it can affect (see accurev.ext.affected_streams_batch()). Every
+    # branch keeps its own cursor, the last transaction that was committed onto it, from which the diffs for it are taken.
+    def ProcessStreamsSinglePass(self, depot, streamList):
+        endTrHist = self.TryHist(depot=depot, trNum=self.config.accurev.endTransaction, transactionOnly=True)
+        if endTrHist is None:
+            self.config.logger.error("accurev hist -p {0} -t {1}.1 failed.".format(depot, self.config.accurev.endTransaction))
+            return False
+        endTr = endTrHist.transactions[0]
+
+        # The state of each branch, keyed by the stream number so that renamed streams are still found.
+        branches = OrderedDict()
+        currentBranchName = None
+        for streamInfo, branchName in streamList:
+            self.config.logger.info( "Starting {0} -> {1} : {2} - {3}".format(streamInfo.name, branchName, self.config.accurev.startTransaction, self.config.accurev.endTransaction) )
+            tr, stream, commitHash = self.StartStream(depot=depot, stream=streamInfo, branchName=branchName, startTransaction=self.config.accurev.startTransaction, endTransaction=self.config.accurev.endTransaction)
+            if tr is None:
+                self.config.logger.error( "Error while processing stream {0}, branch {1}".format(streamInfo.name, branchName) )
+                continue
+            currentBranchName = branchName
+            branches[stream.streamNumber] = { "stream": stream, "branch_name": branchName, "transaction": tr, "commit_hash": commitHash }
+
+        if len(branches) == 0:
+            return False
+
+        startTrNumber = min([ branch["transaction"].id for branch in branches.values() ])
+        self.config.logger.info( "Single pass over transactions #{0} - #{1} for {2} streams.".format(startTrNumber, endTr.id, len(branches)) )
+        for chunkStart in range(startTrNumber + 1, endTr.id + 1, AccuRev2Git.singlePassChunkSize):
+            chunkEnd = min(chunkStart + AccuRev2Git.singlePassChunkSize - 1, endTr.id)
+            affected = accurev.ext.affected_streams_batch(depot=depot, timeSpec="{0}-{1}".format(chunkStart, chunkEnd), includeWorkspaces=True, ignoreTimelocks=False)
+            if affected is None:
+                self.config.logger.error( "Failed to get the affected streams for transactions #{0} - #{1}.".format(chunkStart, chunkEnd) )
+                return False
 
+            for transaction, streams in affected:
+                if len(streams) > 0 and not self.config.accurev.pathFilter.IsTransactionIncluded(transaction):
+                    self.config.logger.dbg( "Skipping tr. #{0}, no included paths...".format(transaction.id) )
+                    continue
+                for affectedStream in streams:
+                    branch = branches.get(affectedStream.streamNumber)
+                    if branch is None or transaction.id <= branch["transaction"].id:
+                        continue
+
+                    # The stream could have been affected by the transaction but it doesn't mean that its contents have changed.
+                    diff = self.TryDiff(streamName=branch["stream"].name, firstTrNumber=branch["transaction"].id, secondTrNumber=transaction.id)
+                    if diff is None:
+                        return False
+                    elif len(diff.elements) == 0:
+                        self.config.logger.dbg( "{0}: skipping tr. #{1}, diff was empty...".format(branch["stream"].name, transaction.id) )
+                        continue
+
+                    if currentBranchName != branch["branch_name"]:
+                        if not self.SwitchToBranch(branchName=branch["branch_name"]):
+                            return False
+                        currentBranchName = branch["branch_name"]
+
+                    tr, stream, commitHash = self.CommitTransaction(depot=depot, stream=branch["stream"], branchName=branch["branch_name"], trNumber=transaction.id, diff=diff)
+                    if tr is None or (commitHash is None and not self.IsNothingToCommit()):
+                        self.config.logger.error( "Error while processing stream {0}, branch {1}. Won't process it any further.".format(branch["stream"].name, branch["branch_name"]) )
+                        del branches[affectedStream.streamNumber]
+                        currentBranchName = None
+                        continue
+                    branch["transaction"] = tr
+                    branch["stream"] = stream
+                    if commitHash is not None:
+                        branch["commit_hash"] = commitHash
+
+        for branch in branches.values():
+            self.config.logger.info( "Reached end transaction #{0} for {1} -> {2}".format(endTr.id, branch["stream"].name, branch["branch_name"]) )
+
+        return True
+
+    # Converts a stream onto its branch, in partitions if configured, and returns a (tr, commitHash) tuple like ProcessStream().
+    def ConvertStream(self, depot, streamInfo, branchName):
+        partitionCount = self.config.accurev.partitions
+        if partitionCount is not None and partitionCount > 1 and self.config.method != "update" and branchName not in [ b.name for b in self.gitBranchList ]:
+            tr, commitHash = self.ProcessStreamPartitioned(depot=depot, stream=streamInfo, branchName=branchName, startTransaction=self.config.accurev.startTransaction, endTransaction=self.config.accurev.endTransaction, partitionCount=partitionCount)
+        else:
+            tr, commitHash = self.ProcessStream(depot=depot, stream=streamInfo, branchName=branchName, startTransaction=self.config.accurev.startTransaction, endTransaction=self.config.accurev.endTransaction)
+        if tr is None or commitHash is None:
+            self.config.logger.error( "Error while processing stream {0}, branch {1}".format(streamInfo.name, branchName) )
         return (tr, commitHash)
 
+    # Returns a copy of the config for converting the given depot (a Config.Depot) into its own git repository.
+    def GetDepotConfig(self, depot):
+        depotConfig = copy.copy(self.config)
+        depotConfig.accurev = copy.copy(self.config.accurev)
+        depotConfig.accurev.depot = depot.name
+        depotConfig.accurev.streamMap = depot.streamMap
+        depotConfig.git = copy.copy(self.config.git)
+        depotConfig.git.repoPath = depot.repoPath
+        depotConfig.depots = []
+        if depotConfig.method == "update":
+            # `accurev update` works on the workspace in the current working directory, which is the main repository.
+            self.config.logger.info( "The 'update' method can only be used for the main depot. Depot {0} will be converted with the 'deep-hist' method.".format(depot.name) )
+            depotConfig.method = "deep-hist"
+        return depotConfig
+
+    # Converts the configured streams together with the streams of every depot in the depots list, each depot into its own git repository.
+    # A single scheduler interleaves the streams of the depots, round robin, and converts up to `max-concurrent` of them at a time but only
+    # one at a time per repository. All of the conversions share the accurev login, the command cache and the transaction time index.
+    def ProcessDepots(self):
+        converters = [ self ]
+        for depot in self.config.depots:
+            converter = AccuRev2Git(self.GetDepotConfig(depot))
+            converter.cwd = self.cwd
+            if depot.repoPath is None or not os.path.isdir(depot.repoPath) or not converter.InitGitRepo(depot.repoPath):
+                self.config.logger.error( "git repository directory '{0}' for depot {1} doesn't exist. Skipping the depot.".format(depot.repoPath, depot.name) )
+                continue
+            converter.gitRepo = git.open(depot.repoPath)
+            converter.gitBranchList = converter.gitRepo.branch_list()
+            converter.gitRepo.raw_cmd([u'git', u'config', u'--local', u'gc.auto', u'0'])
+            if converter.config.accurev.streamMap is None:
+                # All of the depot's streams are converted onto branches of the same name.
+                streams = accurev.show.streams(depot=depot.name)
+                if streams is None:
+                    self.config.logger.error( "Failed to get the streams of depot {0}. Skipping the depot.".format(depot.name) )
+                    continue
+                converter.config.accurev.streamMap = OrderedDict([ (stream.name, stream.name) for stream in streams.streams ])
+            converters.append(converter)
+
+        # Each job converts one stream, or all of a depot's streams for the single-pass method.
+        def ConvertJob(converter, streamNames):
+            depot = converter.config.accurev.depot
+            streamList = []
+            for streamName in streamNames:
+                streamInfo = converter.GetStreamInfo(depot=depot, streamName=streamName)
+                if streamInfo is not None:
+                    streamList.append((streamInfo, converter.config.accurev.streamMap[streamName]))
+                    if depot is None or len(depot) == 0:
+                        depot = streamInfo.depotName
+            if converter.config.method == "single-pass":
+                if len(streamList) > 0:
+                    converter.ProcessStreamsSinglePass(depot=depot, streamList=streamList)
+            else:
+                for streamInfo, branchName in streamList:
+                    converter.ConvertStream(depot=depot, streamInfo=streamInfo, branchName=branchName)
+            converter.gitBranchList = converter.gitRepo.branch_list()
+
+        pending = OrderedDict()
+        for converter in converters:
+            streamNames = list(converter.config.accurev.streamMap.keys())
+            if converter.config.method == "single-pass":
+                pending[converter] = [ streamNames ]
+            else:
+                pending[converter] = [ [ streamName ] for streamName in streamNames ]
+
+        if self.config.accurev.commandCacheFilename is not None:
+            accurev.ext.enable_command_cache(self.config.accurev.commandCacheFilename)
+
+        maxConcurrent = max(1, self.config.maxConcurrentDepots if self.config.maxConcurrentDepots is not None else 1)
+        self.config.logger.info( "Converting {0} depots, at most {1} streams at a time.".format(len(converters), maxConcurrent) )
+        running = {} # Future -> converter
+        with ThreadPoolExecutor(max_workers=maxConcurrent) as executor:
+            while len(pending) > 0 or len(running) > 0:
+                for converter in list(pending.keys()):
+                    if len(running) >= maxConcurrent:
+                        break
+                    elif converter in running.values():
+                        continue # A repository has a single working tree.
+                    future = executor.submit(ConvertJob, converter, pending[converter].pop(0))
+                    running[future] = converter
+                    if len(pending[converter]) == 0:
+                        del pending[converter]
+                    else:
+                        pending.move_to_end(converter)
+                done, notDone = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    converter = running.pop(future)
+                    if future.exception() is not None:
+                        self.config.logger.error( "Error while converting depot {0}: {1}".format(converter.config.accurev.depot, future.exception()) )
+
+        if self.config.accurev.commandCacheFilename is not None:
+            accurev.ext.disable_command_cache()
+        for converter in converters[1:]:
+            converter.gitRepo.raw_cmd([u'git', u'config', u'--local', u'--unset-all', u'gc.auto'])
+
     def ProcessStreams(self):
         if self.config.accurev.commandCacheFilename is not None:
             accurev.ext.enable_command_cache(self.config.accurev.commandCacheFilename)
         
+        singlePassStreamList = []
+        singlePassDepot = None
         for stream in self.config.accurev.streamMap:
             branch = self.config.accurev.streamMap[stream]
             depot  = self.config.accurev.depot
-            streamInfo = None
-            try:
-                streamInfo = accurev.show.streams(depot=depot, stream=stream).streams[0]
-            except IndexError:
-                self.config.logger.error( "Failed to get stream information. `accurev show streams -p {0} -s {1}` returned no streams".format(depot, stream) )
-                return
-            except AttributeError:
-                self.config.logger.error( "Failed to get stream information. `accurev show streams -p {0} -s {1}` returned None".format(depot, stream) )
+            streamInfo = self.GetStreamInfo(depot=depot, streamName=stream)
+            if streamInfo is None:
                 return
 
             if depot is None or len(depot) == 0:
                 depot = streamInfo.depotName
-            tr, commitHash = self.ProcessStream(depot=depot, stream=streamInfo, branchName=branch, startTransaction=self.config.accurev.startTransaction, endTransaction=self.config.accurev.endTransaction)
-            if tr is None or commitHash is None:
-                self.config.logger.error( "Error while processing stream {0}, branch {1}".format(stream, branch) )
+            if self.config.method == "single-pass":
+                singlePassStreamList.append((streamInfo, branch))
+                singlePassDepot = depot
+                continue
+            self.ConvertStream(depot=depot, streamInfo=streamInfo, branchName=branch)
+
+        if len(singlePassStreamList) > 0:
+            self.ProcessStreamsSinglePass(depot=singlePassDepot, streamList=singlePassStreamList)
         
         if self.config.accurev.commandCacheFilename is not None:
             accurev.ext.disable_command_cache()
 
+    # Returns the obj.Stream for the given stream name or None if it can't be retrieved.
+    def GetStreamInfo(self, depot, streamName):
+        try:
+            return accurev.show.streams(depot=depot, stream=streamName).streams[0]
+        except IndexError:
+            self.config.logger.error( "Failed to get stream information. `accurev show streams -p {0} -s {1}` returned no streams".format(depot, streamName) )
+        except AttributeError:
+            self.config.logger.error( "Failed to get stream information. `accurev show streams -p {0} -s {1}` returned None".format(depot, streamName) )
+        return None
+
+    # Converts all of the configured streams and then keeps the git repository in sync with the depot by polling for new transactions every
+    # `interval` seconds. Only the streams that the new transactions could have affected are converted, continuing from their last commit.
+    # The stream information, the command cache and the transaction time index are kept between the polls. Runs until interrupted.
+    def Follow(self, interval):
+        depot = self.config.accurev.depot
+        streams = OrderedDict() # The configured streams that have been found, keyed by stream name, as (obj.Stream, branchName) tuples.
+        for streamName in self.config.accurev.streamMap:
+            streamInfo = self.GetStreamInfo(depot=depot, streamName=streamName)
+            if streamInfo is not None:
+                streams[streamName] = (streamInfo, self.config.accurev.streamMap[streamName])
+                if depot is None or len(depot) == 0:
+                    depot = streamInfo.depotName
+        if depot is None or len(depot) == 0:
+            self.config.logger.error( "Can't follow the depot. None of the configured streams were found." )
+            return False
+
+        # The highest transaction is taken before catching up so that anything that arrives while converting is picked up by the first poll.
+        highestHist = self.TryHist(depot=depot, trNum="highest", transactionOnly=True)
+        if highestHist is None:
+            self.config.logger.error( "accurev hist -p {0} -t highest failed.".format(depot) )
+            return False
+        lastTrNumber = highestHist.transactions[0].id
+        self.ProcessStreams()
+        self.gitBranchList = self.gitRepo.branch_list()
+
+        if self.config.accurev.commandCacheFilename is not None:
+            accurev.ext.enable_command_cache(self.config.accurev.commandCacheFilename)
+        self.config.logger.info( "Following depot {0} from tr. #{1}, polling every {2} seconds.".format(depot, lastTrNumber, interval) )
+        try:
+            while True:
+                time.sleep(interval)
+
+                # If this script is being run on a replica then the new transactions are only visible once it is synced.
+                accurev.replica.sync()
+                highestHist = self.TryHist(depot=depot, trNum="highest", transactionOnly=True)
+                if highestHist is None:
+                    self.config.logger.error( "accurev hist -p {0} -t highest failed. Retrying in {1} seconds.".format(depot, interval) )
+                    continue
+                highestTrNumber = highestHist.transactions[0].id
+                if highestTrNumber <= lastTrNumber:
+                    continue
+
+                # Streams which didn't exist when we started following may have been created since.
+                for streamName in self.config.accurev.streamMap:
+                    if streamName not in streams:
+                        streamInfo = self.GetStreamInfo(depot=depot, streamName=streamName)
+                        if streamInfo is not None:
+                            streams[streamName] = (streamInfo, self.config.accurev.streamMap[streamName])
+
+                affected = accurev.ext.affected_streams_batch(depot=depot, timeSpec="{0}-{1}".format(lastTrNumber + 1, highestTrNumber), includeWorkspaces=True, ignoreTimelocks=False)
+                if affected is None:
+                    self.config.logger.error( "Failed to get the affected streams for transactions #{0} - #{1}. Retrying in {2} seconds.".format(lastTrNumber + 1, highestTrNumber, interval) )
+                    continue
+                affectedStreamNumbers = set([ stream.streamNumber for transaction, affectedStreams in affected for stream in affectedStreams ])
+                streamList = [ (streamInfo, branchName) for streamInfo, branchName in streams.values() if streamInfo.streamNumber in affectedStreamNumbers ]
+                self.config.logger.info( "New transactions #{0} - #{1} affect {2} of the followed streams.".format(lastTrNumber + 1, highestTrNumber, len(streamList)) )
+
+                if self.config.method == "single-pass":
+                    if len(streamList) > 0 and not self.ProcessStreamsSinglePass(depot=depot, streamList=streamList):
+                        continue
+                else:
+                    for streamInfo, branchName in streamList:
+                        tr, commitHash = self.ProcessStream(depot=depot, stream=streamInfo, branchName=branchName, startTransaction=self.config.accurev.startTransaction, endTransaction=highestTrNumber)
+                        if tr is None:
+                            self.config.logger.error( "Error while processing stream {0}, branch {1}".format(streamInfo.name, branchName) )
+                self.gitBranchList = self.gitRepo.branch_list()
+                lastTrNumber = highestTrNumber
+        except KeyboardInterrupt:
+            self.config.logger.info( "Stopped following depot {0} at tr. #{1}.".format(depot, lastTrNumber) )
+        finally:
+            if self.config.accurev.commandCacheFilename is not None:
+                accurev.ext.disable_command_cache()
+
+        return True
+
+    # Writes the branch and its script state notes into a git bundle at the given path. Returns True on success.
+    def CreateBundle(self, branchName, bundlePath):
+        if self.gitRepo.raw_cmd([ u'git', u'bundle', u'create', bundlePath, u'refs/heads/{0}'.format(branchName), u'refs/notes/{0}'.format(branchName) ]) is None:
+            self.config.logger.error( "Failed to bundle branch {0} into {1}. Err: {2}".format(branchName, bundlePath, self.gitRepo.lastResult.stderr) )
+            return False
+        return True
+
+    # Fetches the branch and its script state notes from a bundle made by CreateBundle(). Unless `force` is set the branch and the notes
+    # must be new or fast-forwarded. Returns True on success.
+    def FetchBundle(self, branchName, bundlePath, force=False):
+        refspecs = [ u'{0}refs/{1}/{2}:refs/{1}/{2}'.format(u'+' if force else u'', namespace, branchName) for namespace in [ u'heads', u'notes' ] ]
+        if self.gitRepo.raw_cmd([ u'git', u'fetch', u'--update-head-ok', bundlePath ] + refspecs) is None:
+            self.config.logger.error( "Failed to fetch branch {0} from {1}. Err: {2}".format(branchName, bundlePath, self.gitRepo.lastResult.stderr) )
+            return False
+        self.gitBranchList = self.gitRepo.branch_list()
+        return True
+
+    # Returns a (commitHash, transactionNumber) tuple for the last commit on the branch and the transaction recorded in its script state note.
+    def GetBranchTipState(self, branchName):
+        commitHash = self.GetLastCommitHash(branchName=branchName)
+        if commitHash is None:
+            return (None, None)
+        stateObj = self.GetStateForCommit(commitHash=commitHash, branchName=branchName)
+        if stateObj is None or stateObj.get("transaction_number") is None:
+            return (commitHash, None)
+        return (commitHash, int(stateObj["transaction_number"]))
+
+    # Distributes the conversion of the configured streams, one work item per stream, to the workers (see Work()) through the work queue
+    # and fetches the branches that they publish into this repository. A branch which already exists here is sent to the worker as a seed
+    # bundle so that it continues from the last commit. The fetched branch tips are verified against the commit and transaction that the
+    # worker recorded. Returns once all of the work items have either been fetched or have failed.
+    def Coordinate(self, queueFilename, pollInterval=10):
+        with WorkQueue(queueFilename) as queue:
+            queue.RequeueStale()
+            queuedBranchNames = [ item['branch_name'] for item in queue.Items() if item['state'] in [ WorkQueue.statePending, WorkQueue.stateClaimed, WorkQueue.stateDone ] ]
+            for streamName in self.config.accurev.streamMap:
+                branchName = self.config.accurev.streamMap[streamName]
+                if branchName in queuedBranchNames:
+                    self.config.logger.info( "Work item for {0} -> {1} is already queued.".format(streamName, branchName) )
+                    continue
+                seedBundle = None
+                if branchName in [ b.name for b in self.gitBranchList ]:
+                    seedBundle = os.path.join(queue.bundleDir, 'seed_{0}_{1}.bundle'.format(re.sub(r'[^\w.-]', '_', branchName), int(time.time())))
+                    if not self.CreateBundle(branchName=branchName, bundlePath=seedBundle):
+                        continue
+                itemId = queue.Add(streamName=streamName, branchName=branchName, startTransaction=self.config.accurev.startTransaction, endTransaction=self.config.accurev.endTransaction, seedBundle=seedBundle)
+                self.config.logger.info( "Queued work item {0}: {1} -> {2}{3}".format(itemId, streamName, branchName, ' (seeded from the existing branch)' if seedBundle is not None else '') )
+
+        while True:
+            with WorkQueue(queueFilename) as queue:
+                for item in queue.Items(state=WorkQueue.stateDone):
+                    state = WorkQueue.stateFailed
+                    if self.FetchBundle(branchName=item['branch_name'], bundlePath=item['bundle']):
+                        commitHash, trNumber = self.GetBranchTipState(branchName=item['branch_name'])
+                        if commitHash == item['commit_hash'] and trNumber == item['transaction_id']:
+                            self.config.logger.info( "Fetched {0} from {1}: commit {2} at tr. #{3}".format(item['branch_name'], item['worker'], commitHash[:8], trNumber) )
+                            state = WorkQueue.stateFetched
+                        else:
+                            self.config.logger.error( "Branch {0} from {1} is at commit {2} (tr. #{3}) but the worker recorded commit {4} (tr. #{5}).".format(item['branch_name'], item['worker'], commitHash, trNumber, item['commit_hash'], item['transaction_id']) )
+                    queue.SetState(itemId=item['id'], state=state)
+                requeued = queue.RequeueStale()
+                if requeued > 0:
+                    self.config.logger.info( "Requeued {0} work items whose workers stopped renewing their claims.".format(requeued) )
+                remaining = len(queue.Items(state=WorkQueue.statePending)) + len(queue.Items(state=WorkQueue.stateClaimed))
+                failed = len(queue.Items(state=WorkQueue.stateFailed))
+            if remaining == 0:
+                break
+            self.config.logger.dbg( "Waiting for {0} work items.".format(remaining) )
+            time.sleep(pollInterval)
+
+        if failed > 0:
+            self.config.logger.error( "{0} work items have failed. Run the coordinator again to retry them.".format(failed) )
+        return failed == 0
+
+    # Claims work items from the work queue made by Coordinate() until there are none left. Each stream is converted into this repository
+    # and the resulting branch is published as a bundle next to the work queue.
+    def Work(self, queueFilename):
+        worker = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+        while True:
+            with WorkQueue(queueFilename) as queue:
+                item = queue.Claim(worker=worker)
+                bundleDir = queue.bundleDir
+            if item is None:
+                self.config.logger.info( "No more work items in {0}.".format(queueFilename) )
+                break
+            self.config.logger.info( "Claimed work item {0}: {1} -> {2}".format(item['id'], item['stream'], item['branch_name']) )
+
+            # The claim is renewed from another thread, with its own connection, for as long as the item is being converted.
+            stopHeartbeat = threading.Event()
+            def Heartbeat(itemId):
+                while not stopHeartbeat.wait(WorkQueue.heartbeatInterval):
+                    with WorkQueue(queueFilename) as queue:
+                        if not queue.Heartbeat(itemId=itemId, worker=worker):
+                            self.config.logger.error( "Lost the claim on work item {0}.".format(itemId) )
+                            return
+            heartbeatThread = threading.Thread(target=Heartbeat, args=(item['id'],))
+            heartbeatThread.daemon = True
+            heartbeatThread.start()
+
+            commitHash, trNumber, bundlePath = None, None, None
+            try:
+                depot = self.config.accurev.depot
+                streamInfo = self.GetStreamInfo(depot=depot, streamName=item['stream'])
+                if streamInfo is not None and (item['seed_bundle'] is None or self.FetchBundle(branchName=item['branch_name'], bundlePath=item['seed_bundle'], force=True)):
+                    if depot is None or len(depot) == 0:
+                        depot = streamInfo.depotName
+                    tr, lastCommitHash = self.ProcessStream(depot=depot, stream=streamInfo, branchName=item['branch_name'], startTransaction=item['start_transaction'], endTransaction=item['end_transaction'])
+                    self.gitBranchList = self.gitRepo.branch_list()
+                    if tr is not None:
+                        commitHash, trNumber = self.GetBranchTipState(branchName=item['branch_name'])
+                        bundlePath = os.path.join(bundleDir, 'item_{0}.bundle'.format(item['id']))
+                        if commitHash is None or trNumber is None or not self.CreateBundle(branchName=item['branch_name'], bundlePath=bundlePath):
+                            commitHash = None
+            except Exception as e:
+                self.config.logger.error( "Failed to convert work item {0} ({1} -> {2}). {3}: {4}".format(item['id'], item['stream'], item['branch_name'], type(e).__name__, e) )
+                commitHash = None
+            finally:
+                stopHeartbeat.set()
+                heartbeatThread.join()
+
+            with WorkQueue(queueFilename) as queue:
+                if commitHash is not None:
+                    queue.Complete(itemId=item['id'], transactionId=trNumber, commitHash=commitHash, bundle=bundlePath)
+                    self.config.logger.info( "Published work item {0}: {1} at tr. #{2} -> {3}".format(item['id'], item['branch_name'], trNumber, bundlePath) )
+                else:
+                    queue.SetState(itemId=item['id'], state=WorkQueue.stateFailed)
+                    self.config.logger.error( "Work item {0} ({1} -> {2}) has failed.".format(item['id'], item['stream'], item['branch_name']) )
+
+        return True
+
     def InitGitRepo(self, gitRepoPath):
         gitRootDir, gitRepoDir = os.path.split(gitRepoPath)
         if os.path.isdir(gitRootDir):
@@ -1300,6 +2692,12 @@ class AccuRev2Git(object):
             self.config.accurev.commandCacheFilename = os.path.abspath(self.config.accurev.commandCacheFilename)
         self.cwd = os.getcwd()
         os.chdir(self.config.git.repoPath)
+
+        if self.config.accurev.governor.Enable() is not None:
+            self.config.logger.dbg( "Enabled the accurev command governor: {0}".format(self.config.accurev.governor) )
+        if self.config.accurev.queryService is not None:
+            accurev.ext.use_query_service(self.config.accurev.queryService)
+            self.config.logger.dbg( "Forwarding the accurev queries to the query service at {0}".format(self.config.accurev.queryService) )
         
         # This try/catch/finally block is here to ensure that we change directory back to self.cwd in order
         # to allow other scripts to safely call into this method.
@@ -1346,7 +2744,17 @@ class AccuRev2Git(object):
                 self.StitchBranches()
             else:
                 self.gitRepo.raw_cmd([u'git', u'config', u'--local', u'gc.auto', u'0'])
-                self.ProcessStreams()
+                if self.config.workQueueRole == "coordinator":
+                    self.Coordinate(queueFilename=self.config.workQueueFilename)
+                elif self.config.workQueueRole == "worker":
+                    self.Work(queueFilename=self.config.workQueueFilename)
+                elif self.config.followInterval is not None:
+                    self.Follow(interval=self.config.followInterval)
+                elif len(self.config.depots) > 0:
+                    self.ProcessDepots()
+                else:
+                    self.ProcessStreams()
+                self.ClearDiffPrefetch()
                 self.gitRepo.raw_cmd([u'git', u'config', u'--local', u'--unset-all', u'gc.auto'])
               
             if doLogout:
@@ -1376,6 +2784,19 @@ def DumpExampleConfigFile(outputFilename):
             start-transaction:    The conversion will start at this transaction. If interrupted the next time it starts it will continue from where it stopped.
             end-transaction:      Stop at this transaction. This can be the keword "now" if you want it to convert the repo up to the latest transaction.
             command-cache-filename: The filename which will be given to the accurev.py script to use as a local command result cache for the accurev hist, accurev diff and accurev show streams commands.
+            populate-jobs:        Optional. The number of concurrent `accurev pop` commands used for a full populate (the first commit of a stream and every commit of the pop method).
+                                  The top-level elements of the stream are split between them. Defaults to 1.
+            diff-probe-window:    Optional. The number of transactions that the diff and deep-hist methods check for changes concurrently when searching for the next transaction
+                                  to commit. The transactions are still committed one at a time and in order. Defaults to 1.
+            diff-prefetch:        Optional. The number of diffs between consecutive deep-hist transactions that are computed ahead of time, while the earlier transactions
+                                  are being committed. Only used by the deep-hist method. Defaults to 0 (disabled).
+            partitions:           Optional. The number of consecutive transaction ranges into which the conversion of a new stream is split. The ranges are converted
+                                  concurrently, each starting with a full populate, and are then joined into a single history. Not used by the single-pass and
+                                  update methods or for streams whose branches already exist. Defaults to 1 (disabled).
+            workspace:            Required by the update method. The name of a workspace dedicated to the conversion. It is reparented onto each stream and moved
+                                  into the git repository with `accurev chws`. Its files are overwritten.
+            query-service:        Optional. The url of an `accurev.py serve` process (e.g. http://127.0.0.1:8765/) which answers the hist, show streams, deep-hist and
+                                  affected-streams queries for this and other converters from its warm caches. The queries are run locally if it can't be reached.
     -->
     <accurev 
         username="joe_bloggs" 
@@ -1383,13 +2804,38 @@ def DumpExampleConfigFile(outputFilename):
         depot="Trunk" 
         start-transaction="1" 
         end-transaction="now" 
-        command-cache-filename="command_cache.sqlite3" >
+        command-cache-filename="command_cache.sqlite3" 
+        populate-jobs="1" 
+        diff-probe-window="1" 
+        diff-prefetch="0" 
+        partitions="1" 
+        workspace="ac2git_workspace" 
+        query-service="http://127.0.0.1:8765/" >
         <!-- The stream-list is optional. If not given all streams are processed -->
         <!-- The branch-name attribute is also optional for each stream element. If provided it specifies the git branch name to which the stream will be mapped. -->
         <stream-list>
             <stream branch-name="some_branch">some_stream</stream>
             <stream>some_other_stream</stream>
         </stream-list>
+        <!-- The path-filter is optional. If given only the paths that match one of the include patterns (or all paths if there are none) and none of the
+             exclude patterns are converted. Patterns are matched from the depot root one path component at a time, may use the *, ? and [] wildcards
+             and also match everything under a matching directory. Only the included paths are populated and the deep-hist transactions which don't
+             touch any included path are skipped without running an `accurev diff`. -->
+        <path-filter>
+            <include>src/some_component</include>
+            <exclude>src/some_component/third_party</exclude>
+        </path-filter>
+        <!-- The governor is optional. If given it limits how the accurev commands are sent to the server, which matters when several of them run
+             concurrently (see populate-jobs, diff-probe-window, diff-prefetch, partitions and the <depots> element) or several workers share a server.
+                max-concurrent:       The most accurev commands that run at the same time. The limit is lowered automatically while the commands slow down
+                                      or fail and is raised again once they recover. Defaults to 8.
+                commands-per-second:  Optional. The most accurev commands that are started per second.
+             Each <limit> element caps the concurrency of one accurev command (e.g. pop, hist or diff). The diffs that only check for changes,
+             which stop reading the output early, are limited separately as diff-probe.
+             Failed commands are always retried after a randomized, exponentially growing delay. -->
+        <governor max-concurrent="8" commands-per-second="20">
+            <limit command="pop">2</limit>
+        </governor>
     </accurev>
     <git repo-path="/put/the/git/repo/here" finalize="false" /> <!-- The system path where you want the git repo to be populated. Note: this folder should already exist. 
                                                                      The finalize attribute switches this script from converting accurev transactions to independent orphaned
@@ -1397,7 +2843,7 @@ def DumpExampleConfigFile(outputFilename):
                                                                      Make sure to have a backup of your repo just in case. Once finalize is set to true this script will rewrite
                                                                      the git history in an attempt to recreate merge points.
                                                                 -->
-    <method>deep-hist</method> <!-- The method specifies what approach is taken to perform the conversion. Allowed values are 'deep-hist', 'diff' and 'pop'.
+    <method>deep-hist</method> <!-- The method specifies what approach is taken to perform the conversion. Allowed values are 'deep-hist', 'diff', 'pop', 'single-pass', 'update' and 'auto'.
                                      - deep-hist: Works by using the accurev.ext.deep_hist() function to return a list of transactions that could have affected the stream.
                                                   It then performs a diff between the transactions and only populates the files that have changed like the 'diff' method.
                                                   It is the quickest method but is only as reliable as the information that accurev.ext.deep_hist() provides.
@@ -1410,8 +2856,37 @@ def DumpExampleConfigFile(outputFilename):
                                      - pop: This is the naive method which doesn't care about changes and always performs a full deletion of the whole tree and a complete
                                             `accurev pop` command. It is a lot slower than the other methods for streams with a lot of files but should work even with older
                                             accurev releases. This is the method originally implemented by Ryan LaNeve in his https://github.com/rlaneve/accurev2git repo.
+                                     - single-pass: Converts all of the streams together by walking the depot's transactions once, in order. Each transaction is only
+                                                    diffed and populated for the streams that it could have affected, according to the stream hierarchy at the time,
+                                                    and the streams are diffed from their own last converted transaction like in the 'diff' method. Best suited for
+                                                    converting many streams of the same depot since the history is scanned once instead of once per stream.
+                                     - update: Reparents the workspace given by the workspace attribute of the accurev element onto the stream with `accurev chws`,
+                                               moves it into the git repository and then steps it through the transactions one at a time with `accurev update -t`.
+                                               The update only transfers the changes and reports the changed elements so no diffs are needed. The workspace can't be
+                                               updated to a transaction before its current update level, in which case the 'deep-hist' method is used instead.
+                                     - auto: Chooses between the 'deep-hist', 'diff' and 'pop' methods for each stream as it goes. It starts with 'deep-hist' and, every
+                                             50 commits, switches to 'diff' if most of the transactions turn out to be deep-hist candidates, back to 'deep-hist' if most
+                                             of the diffs turn out to be empty and to 'pop' if a full populate is measured to be cheaper. The decisions are logged.
                                -->
     <logfile>accurev2git.log</logfile>
+    <!-- <follow>60</follow> --> <!-- Optional. Once the streams are converted keep polling the depot for new transactions every given number of seconds and convert them
+                                      for the streams that they could have affected, until the script is interrupted. -->
+    <!-- The depots element is optional. It lists more depots to convert in the same run, each into its own git repository (which should already exist),
+         alongside the depot and repository configured above. The streams of all of the depots are interleaved and up to max-concurrent of them are converted
+         at the same time but each depot only converts one stream at a time. The stream-list is optional and works like the one in the accurev element. If it is
+         omitted all of the depot's streams are converted. The depots share the accurev login, the command cache and every other setting above.
+    <depots max-concurrent="2">
+        <depot name="OtherDepot" repo-path="/put/the/other/git/repo/here">
+            <stream-list>
+                <stream branch-name="other_branch">other_stream</stream>
+            </stream-list>
+        </depot>
+    </depots>
+    -->
+    <!-- <work-queue role="worker">/shared/ac2git_queue.sqlite3</work-queue> --> <!-- Optional. Distributes the conversion of the streams over several nodes. The coordinator
+                                      queues one work item per stream in the given sqlite database. Each worker, with its own git repo-path, converts the
+                                      streams that it claims and publishes them as git bundles next to the database. The coordinator fetches the bundles into
+                                      its repository. The role is either 'coordinator' or 'worker' and the database must be on a filesystem shared by the nodes. -->
     <!-- The user maps are used to convert users from AccuRev into git. Please spend the time to fill them in properly. -->
     <usermaps>
          <!-- The timezone attribute is optional. All times are retrieved in UTC from AccuRev and will converted to the local timezone by default.
@@ -1625,6 +3100,32 @@ def SetConfigFromArgs(config, args):
         config.method = args.conversionMethod
     if args.logFile is not None:
         config.logFilename      = args.logFile
+    if args.followInterval is not None:
+        config.followInterval = args.followInterval
+    if args.maxConcurrentDepots is not None:
+        config.maxConcurrentDepots = args.maxConcurrentDepots
+    if args.coordinatorQueueFilename is not None:
+        config.workQueueFilename = args.coordinatorQueueFilename
+        config.workQueueRole = "coordinator"
+    if args.workerQueueFilename is not None:
+        config.workQueueFilename = args.workerQueueFilename
+        config.workQueueRole = "worker"
+    if args.populateJobs is not None:
+        config.accurev.populateJobs = args.populateJobs
+    if args.diffProbeWindow is not None:
+        config.accurev.diffProbeWindow = args.diffProbeWindow
+    if args.diffPrefetch is not None:
+        config.accurev.diffPrefetch = args.diffPrefetch
+    if args.partitions is not None:
+        config.accurev.partitions = args.partitions
+    if args.workspace is not None:
+        config.accurev.workspace = args.workspace
+    if args.maxConcurrentCommands is not None:
+        config.accurev.governor.maxConcurrent = args.maxConcurrentCommands
+    if args.commandsPerSecond is not None:
+        config.accurev.governor.rate = args.commandsPerSecond
+    if args.queryService is not None:
+        config.accurev.queryService = args.queryService
 
 def ValidateConfig(config):
     # Validate the program args and configuration up to this point.
@@ -1665,9 +3166,25 @@ def PrintConfigSummary(config):
         config.logger.info('    end tran.:   #{0}'.format(config.accurev.endTransaction))
         config.logger.info('    username: {0}'.format(config.accurev.username))
         config.logger.info('    command cache: {0}'.format(config.accurev.commandCacheFilename))
+        config.logger.info('    populate jobs: {0}'.format(config.accurev.populateJobs))
+        config.logger.info('    diff probe window: {0}'.format(config.accurev.diffProbeWindow))
+        config.logger.info('    diff prefetch: {0}'.format(config.accurev.diffPrefetch))
+        config.logger.info('    partitions: {0}'.format(config.accurev.partitions))
+        config.logger.info('    workspace: {0}'.format(config.accurev.workspace))
+        if config.accurev.queryService is not None:
+            config.logger.info('    query service: {0}'.format(config.accurev.queryService))
+        if config.accurev.governor.IsActive():
+            config.logger.info('    governor: {0} concurrent, {1} per second, limits {2}'.format(config.accurev.governor.maxConcurrent, config.accurev.governor.rate, config.accurev.governor.kindLimits))
         config.logger.info('  method: {0}'.format(config.method))
         config.logger.info('  usermaps: {0}'.format(len(config.usermaps)))
         config.logger.info('  log file: {0}'.format(config.logFilename))
+        if len(config.depots) > 0:
+            config.logger.info('  depots: (at most {0} streams at a time)'.format(config.maxConcurrentDepots if config.maxConcurrentDepots is not None else 1))
+            for depot in config.depots:
+                config.logger.info('    - {0} -> {1}'.format(depot.name, depot.repoPath))
+        if config.workQueueRole is not None:
+            config.logger.info('  work queue: {0} ({1})'.format(config.workQueueFilename, config.workQueueRole))
+        config.logger.info('  follow:   {0}'.format('every {0} seconds'.format(config.followInterval) if config.followInterval is not None else 'no'))
         config.logger.info('  verbose:  {0}'.format(config.logger.isDbgEnabled))
     
 # ################################################################################################ #
@@ -1687,7 +3204,19 @@ def AccuRev2GitMain(argv):
     parser.add_argument('-t', '--accurev-depot', dest='accurevDepot',        metavar='<accurev-depot>',     help="The AccuRev depot in which the streams that are being converted are located. This script currently assumes only one depot is being converted at a time.")
     parser.add_argument('-g', '--git-repo-path', dest='gitRepoPath',         metavar='<git-repo-path>',     help="The system path to an existing folder where the git repository will be created.")
     parser.add_argument('-f', '--finalize',      dest='finalize', action='store_const', const=True,         help="Finalize the git repository by creating branch merge points. This flag will trigger this scripts 'branch stitching' mode and should only be used once the conversion has been completed. It won't work as expected if the repo continues to be processed after this step. The script will attempt to collapse commits which are a result of a promotion into a parent stream where the diff between the parent and the child is empty. It will also try to link promotions correctly into a merge commit from the child into the parent.")
-    parser.add_argument('-M', '--method', dest='conversionMethod', choices=['pop', 'diff', 'deep-hist'], metavar='<conversion-method>', help="Specifies the method which is used to perform the conversion. Can be either 'pop', 'diff' or 'deep-hist'. 'pop' specifies that every transaction is populated in full. 'diff' specifies that only the differences are populated but transactions are iterated one at a time. 'deep-hist' specifies that only the differences are populated and that only transactions that could have affected this stream are iterated.")
+    parser.add_argument('-M', '--method', dest='conversionMethod', choices=['pop', 'diff', 'deep-hist', 'single-pass', 'update', 'auto'], metavar='<conversion-method>', help="Specifies the method which is used to perform the conversion. Can be either 'pop', 'diff', 'deep-hist', 'single-pass', 'update' or 'auto'. 'pop' specifies that every transaction is populated in full. 'diff' specifies that only the differences are populated but transactions are iterated one at a time. 'deep-hist' specifies that only the differences are populated and that only transactions that could have affected this stream are iterated. 'single-pass' converts all of the streams at once, walking the depot's transactions only once and processing each for the streams that it could have affected. 'update' steps a dedicated workspace through the transactions with `accurev update -t`, which only transfers the changes. 'auto' switches between 'deep-hist', 'diff' and 'pop' for each stream based on what it measures during the conversion.")
+    parser.add_argument('-j', '--populate-jobs', dest='populateJobs', type=int, metavar='<populate-jobs>', help="The number of concurrent `accurev pop` commands used for a full populate. The top-level elements of the stream are split between them.")
+    parser.add_argument('-w', '--diff-probe-window', dest='diffProbeWindow', type=int, metavar='<diff-probe-window>', help="The number of transactions that are checked for changes concurrently by the 'diff' and 'deep-hist' methods when searching for the next transaction to commit.")
+    parser.add_argument('--diff-prefetch', dest='diffPrefetch', type=int, metavar='<diff-prefetch>', help="The number of diffs between consecutive transactions that the 'deep-hist' method computes ahead of time.")
+    parser.add_argument('--workspace', dest='workspace', metavar='<workspace>', help="The name of the workspace dedicated to the 'update' method. It is reparented onto each stream and moved into the git repository.")
+    parser.add_argument('--partitions', dest='partitions', type=int, metavar='<partitions>', help="The number of consecutive transaction ranges into which the conversion of a new stream is split. The ranges are converted concurrently and then joined into a single history.")
+    parser.add_argument('--max-concurrent-commands', dest='maxConcurrentCommands', type=int, metavar='<count>', help="The most accurev commands that run at the same time. The limit is lowered automatically while the AccuRev server slows down or fails and is raised again once it recovers.")
+    parser.add_argument('--commands-per-second', dest='commandsPerSecond', type=float, metavar='<rate>', help="The most accurev commands that are started per second.")
+    parser.add_argument('--query-service', dest='queryService', metavar='<url>', help="The url of an `accurev.py serve` process which answers the hist, show streams, deep-hist and affected-streams queries from its warm caches, shared with the other converters. The queries are run locally if it can't be reached.")
+    parser.add_argument('--follow', nargs='?', dest='followInterval', type=int, const=60, default=None, metavar='<seconds>', help="Once the streams are converted keep the git repository in sync with the depot by polling for new transactions every <seconds> seconds (60 by default) until interrupted.")
+    parser.add_argument('--max-concurrent-depots', dest='maxConcurrentDepots', type=int, metavar='<count>', help="The number of streams that are converted at the same time when the config file lists several depots. Each depot is still converted one stream at a time.")
+    parser.add_argument('--coordinator', dest='coordinatorQueueFilename', metavar='<queue-filename>', help="Distribute the conversion of the streams to the workers through the given work queue (an sqlite database on a shared filesystem) and fetch the branches that they convert into the git repository.")
+    parser.add_argument('--worker', dest='workerQueueFilename', metavar='<queue-filename>', help="Convert the streams queued by a coordinator in the given work queue into the git repository and publish them next to the queue.")
     parser.add_argument('-r', '--restart',    dest='restart', action='store_const', const=True, help="Discard any existing conversion and start over.")
     parser.add_argument('-v', '--verbose',    dest='debug',   action='store_const', const=True, help="Print the script debug information. Makes the script more verbose.")
     parser.add_argument('-L', '--log-file',   dest='logFile', metavar='<log-filename>',         help="Sets the filename to which all console output will be logged (console output is still printed).")
@@ -10,11 +10,28 @@
 # ################################################################################################ #
 
 import sys
+import os
 import subprocess
 import xml.etree.ElementTree as ElementTree
 import datetime
 import re
 import sqlite3
+import tempfile
+import bisect
+import heapq
+import threading
+import time
+import io
+import asyncio
+import random
+import json
+import inspect
+import functools
+import socketserver
+import http.server
+import urllib.request
+import urllib.error
+from collections import OrderedDict
 
 # ################################################################################################ #
 # Script Globals                                                                                   #
@@ -29,6 +46,15 @@ def GetXmlContents(xmlElement):
         return xmlElement.text + ''.join(ElementTree.tostring(e) for e in xmlElement)
     return None
 
+# Parses the XML output of an accurev command. The xmlSource can be a string, bytes or a binary file object, which is read
+# incrementally, so that large outputs don't have to be decoded and copied into a string first. Returns None for None.
+def ParseXml(xmlSource):
+    if xmlSource is None:
+        return None
+    elif hasattr(xmlSource, 'read'):
+        return ElementTree.parse(xmlSource).getroot()
+    return ElementTree.fromstring(xmlSource)
+
 def IntOrNone(value):
     if value is None:
         return None
@@ -456,15 +482,31 @@ class obj:
                 
                 return None
             
-        def __init__(self, id, Type, time, user, comment, versions = [], moves = [], stream = None):
-            self.id       = IntOrNone(id)
-            self.Type     = Type
-            self.time     = UTCDateTimeOrNone(time)
-            self.user     = user
-            self.comment  = comment
-            self.versions = versions
-            self.moves    = moves
-            self.stream   = stream
+        def __init__(self, id, Type, time, user, comment, versions = None, moves = None, stream = None, streamName = None, streamNumber = None):
+            self.id           = IntOrNone(id)
+            self.Type         = Type
+            self.time         = UTCDateTimeOrNone(time)
+            self.user         = user
+            self.comment      = comment
+            self.versions     = list(versions) if versions is not None else []
+            self.moves        = list(moves) if moves is not None else []
+            self.stream       = stream
+            self.streamName   = streamName
+            self.streamNumber = IntOrNone(streamNumber)
+
+        # The versions are only parsed from their XML elements the first time that they are accessed since large promotes
+        # can have a great number of them and most of the callers only need the transaction information.
+        @property
+        def versions(self):
+            if self._versions is None and self._versionElements is not None:
+                self._versions = [ obj.Transaction.Version.fromxmlelement(versionElement) for versionElement in self._versionElements ]
+                self._versionElements = None
+            return self._versions
+
+        @versions.setter
+        def versions(self, value):
+            self._versions        = value
+            self._versionElements = None
             
         def __repr__(self):
             str = "Transaction(id="        + repr(self.id)
@@ -472,12 +514,15 @@ class obj:
             str += ", time="               + repr(self.time)
             str += ", user="               + repr(self.user)
             str += ", comment="            + repr(self.comment)
-            if len(self.versions) > 0:
+            if self.versions is not None and len(self.versions) > 0:
                 str += ", versions="       + repr(self.versions)
-            if len(self.moves) > 0:
+            if self.moves is not None and len(self.moves) > 0:
                 str += ", moves="          + repr(self.moves)
             if self.stream is not None:
                 str += ", stream="         + repr(self.stream)
+            if self.streamName is not None or self.streamNumber is not None:
+                str += ", streamName="     + repr(self.streamName)
+                str += ", streamNumber="   + repr(self.streamNumber)
             str += ")"
             
             return str
@@ -498,6 +543,10 @@ class obj:
             elif self.stream is not None:
                 streamName   = self.stream.name
                 streamNumber = self.stream.streamNumber
+            else:
+                # The transaction-only hist (`accurev hist -ft`) has no versions but names the stream on the transaction itself.
+                streamName   = self.streamName
+                streamNumber = self.streamNumber
 
             return (streamName, streamNumber)
         
@@ -510,9 +559,7 @@ class obj:
                 user = xmlElement.attrib.get('user')
                 comment = GetXmlContents(xmlElement.find('comment'))
     
-                versions = []
-                for versionElement in xmlElement.findall('version'):
-                    versions.append(obj.Transaction.Version.fromxmlelement(versionElement))
+                versionElements = xmlElement.findall('version')
     
                 moves = []
                 for moveElement in xmlElement.findall('move'):
@@ -520,8 +567,13 @@ class obj:
     
                 streamElement = xmlElement.find('stream')
                 stream = obj.Stream.fromxmlelement(streamElement)
+                streamName   = xmlElement.attrib.get('streamName')
+                streamNumber = xmlElement.attrib.get('streamNumber')
     
-                return cls(id, Type, time, user, comment, versions, moves, stream)
+                transaction = cls(id, Type, time, user, comment, None, moves, stream, streamName, streamNumber)
+                transaction._versions = None
+                transaction._versionElements = versionElements
+                return transaction
     
             return None
     
@@ -543,7 +595,7 @@ class obj:
         def fromxmlstring(cls, xmlText):
             try:
                 # Load the XML
-                xmlRoot = ElementTree.fromstring(xmlText)
+                xmlRoot = ParseXml(xmlText)
                 #xpathPredicate = ".//AcResponse[@Command='hist']"
             except ElementTree.ParseError:
                 return None
@@ -568,6 +620,106 @@ class obj:
                 # Invalid XML for an AccuRev hist command response.
                 return None
     
+    # A sorted list of transactions without duplicates which can be indexed by the transaction id. Returned by ext.deep_hist().
+    class TransactionList(object):
+        def __init__(self, transactions = [], isAsc = True):
+            transactionMap = {}
+            for tr in transactions:
+                if tr.id not in transactionMap:
+                    transactionMap[tr.id] = tr
+            self.ids          = sorted(transactionMap.keys())
+            self.transactions = [ transactionMap[id] for id in self.ids ]
+            self.isAsc        = True
+            if not isAsc:
+                self.reverse()
+
+        def __repr__(self):
+            str = "TransactionList(transactions=" + repr(self.transactions)
+            str += ", isAsc="                      + repr(self.isAsc)
+            str += ")"
+
+            return str
+
+        def __len__(self):
+            return len(self.transactions)
+
+        def __iter__(self):
+            return iter(self.transactions)
+
+        def __getitem__(self, index):
+            return self.transactions[index]
+
+        def reverse(self):
+            self.ids.reverse()
+            self.transactions.reverse()
+            self.isAsc = not self.isAsc
+
+        # Returns the transaction with the given id or None if it isn't in the list.
+        def get(self, id):
+            index = self.index(id)
+            if index is None:
+                return None
+            return self.transactions[index]
+
+        # Returns the index of the transaction with the given id or None if it isn't in the list.
+        def index(self, id):
+            index = self.index_after(id) - 1
+            if 0 <= index < len(self.ids) and self.ids[index] == id:
+                return index
+            return None
+
+        # Returns the index of the first transaction in the list which comes after the given transaction id,
+        # or the length of the list if there isn't one. Only supported on lists in ascending order.
+        def index_after(self, id):
+            if not self.isAsc:
+                raise Exception("TransactionList.index_after() requires the list to be in ascending order.")
+            return bisect.bisect_right(self.ids, id)
+
+        # Iterates over the transactions which come after the given transaction id. Only supported on lists in ascending order.
+        def iter_after(self, id):
+            for index in range(self.index_after(id), len(self.transactions)):
+                yield self.transactions[index]
+
+    # A forward-only cursor over transactions in ascending order, like the ones yielded by ext.iter_deep_hist(). It has the same
+    # iter_after() method as the TransactionList but only keeps the transactions that were read and not yet passed over in memory.
+    # Hence the id given to iter_after() must never decrease between calls.
+    class TransactionCursor(object):
+        def __init__(self, transactions):
+            self.transactions = iter(transactions)
+            self.buffer       = []
+            self.isExhausted  = False
+
+        def __repr__(self):
+            str = "TransactionCursor(buffer=" + repr(self.buffer)
+            str += ", isExhausted="            + repr(self.isExhausted)
+            str += ")"
+
+            return str
+
+        def iter_after(self, id):
+            passedCount = 0
+            while passedCount < len(self.buffer) and self.buffer[passedCount].id <= id:
+                passedCount += 1
+            del self.buffer[:passedCount]
+
+            index = 0
+            while True:
+                if index < len(self.buffer):
+                    tr = self.buffer[index]
+                elif self.isExhausted:
+                    return
+                else:
+                    try:
+                        tr = next(self.transactions)
+                    except StopIteration:
+                        self.isExhausted = True
+                        return
+                    if tr.id <= id:
+                        continue
+                    self.buffer.append(tr)
+                index += 1
+                yield tr
+
     class Stat(object):
         class Element(object):
             def __init__(self, location=None, isDir=False, isExecutable=False, id=None, elemType=None, size=None, modTime=None, hierType=None, virtualVersion=None, namedVersion=None, realVersion=None, status=None):
@@ -663,7 +815,7 @@ class obj:
         @classmethod
         def fromxmlstring(cls, xmlText):
             try:
-                xmlRoot = ElementTree.fromstring(xmlText)
+                xmlRoot = ParseXml(xmlText)
             except ElementTree.ParseError:
                 return None
     
@@ -778,7 +930,7 @@ class obj:
             # This parser has been made from an example given by running:
             #   accurev diff -a -i -v Stream -V Stream -t 11-16 -fx
             try:
-                xmlRoot = ElementTree.fromstring(xmlText)
+                xmlRoot = ParseXml(xmlText)
             except ElementTree.ParseError:
                 return None
     
@@ -834,7 +986,7 @@ class obj:
             @classmethod
             def fromxmlstring(cls, xmlText):
                 try:
-                    xmlRoot = ElementTree.fromstring(xmlText)
+                    xmlRoot = ParseXml(xmlText)
                 except ElementTree.ParseError:
                     return None
     
@@ -901,7 +1053,7 @@ class obj:
             @classmethod
             def fromxmlstring(cls, xmlText):
                 try:
-                    xmlRoot = ElementTree.fromstring(xmlText)
+                    xmlRoot = ParseXml(xmlText)
                 except ElementTree.ParseError:
                     return None
                 
@@ -931,7 +1083,7 @@ class obj:
             @classmethod
             def fromxmlstring(cls, xmlText):
                 try:
-                    xmlRoot = ElementTree.fromstring(xmlText)
+                    xmlRoot = ParseXml(xmlText)
                 except ElementTree.ParseError:
                     return None
     
@@ -975,9 +1127,9 @@ class obj:
             return None
         
         @classmethod
-        def fromxmlstring(cls, xmlString):
+        def fromxmlstring(cls, xmlText):
             try:
-                xmlRoot = ElementTree.fromstring(xmlText)
+                xmlRoot = ParseXml(xmlText)
             except ElementTree.ParseError:
                 return None
             
@@ -1028,25 +1180,34 @@ class obj:
                     return cls(location)
                 return None
         
-        def __init__(self, taskId = None, progressItems = None, messages = None, elements = None):
+        def __init__(self, taskId = None, progressItems = None, messages = None, elements = None, errors = None):
             self.taskId        = IntOrNone(taskId)
-            self.progressItems = streams
-            self.messages      = messages
-            self.elements      = elements
+            self.progressItems = progressItems if progressItems is not None else []
+            self.messages      = messages if messages is not None else []
+            self.elements      = elements if elements is not None else []
+            self.errors        = errors if errors is not None else [] # The messages which report that the update failed.
         
         def __repr__(self):
             str = "Update(taskId="    + repr(self.taskId)
             str += ", progressItems=" + repr(self.progressItems)
             str += ", messages="      + repr(self.messages)
             str += ", elements="      + repr(self.elements)
+            if len(self.errors) > 0:
+                str += ", errors="    + repr(self.errors)
             str += ")"
             
             return str
+
+        def __nonzero__(self):
+            return self.__bool__()
+
+        def __bool__(self):
+            return len(self.errors) == 0
             
         @classmethod
         def fromxmlstring(cls, xmlText):
             try:
-                xmlRoot = ElementTree.fromstring(xmlText)
+                xmlRoot = ParseXml(xmlText)
             except ElementTree.ParseError:
                 return None
 
@@ -1059,14 +1220,17 @@ class obj:
                     progressItems.append(obj.CommandProgress.fromxmlelement(progressElement))
                 
                 messages = []
+                errors = []
                 for messageElement in xmlRoot.findall('message'):
                     messages.append(GetXmlContents(messageElement))
+                    if obj.Bool.fromstring(messageElement.attrib.get('error')):
+                        errors.append(messages[-1])
                 
                 elements = []
                 for element in xmlRoot.findall('element'):
-                    messages.append(obj.Update.Element.fromxmlelement(element))
+                    elements.append(obj.Update.Element.fromxmlelement(element))
                 
-                return cls(taskId=taskId, progressItems=progressItems, messages=messages, elements=elements)
+                return cls(taskId=taskId, progressItems=progressItems, messages=messages, elements=elements, errors=errors)
             else:
                 return None
 
@@ -1149,7 +1313,7 @@ class obj:
         @classmethod
         def fromxmlstring(cls, xmlText):
             try:
-                xmlRoot = ElementTree.fromstring(xmlText)
+                xmlRoot = ParseXml(xmlText)
             except ElementTree.ParseError:
                 return None
 
@@ -1242,11 +1406,18 @@ class obj:
 # The raw class namespaces raw accurev commands that return text output directly from the terminal #
 # ################################################################################################ #
 class raw(object):
-    # The __lastCommand is used to access the return code that the last command had generated in most
-    # cases.
+    # The _lastCommand holds the CommandResult of the last command that was run by any thread and is only kept for
+    # compatibility. Use raw._lastResult(), which is tracked per thread, or an AccuRevClient instead.
     _lastCommand = None
     _accurevCmd = "accurev"
     _commandCacheFilename = None
+    _local = threading.local()
+    _defaultClient = None
+    _defaultAsyncClient = None
+    _governor = None
+    _queryService = None
+    _singleFlight = None # The _SingleFlight shared by all of the clients, set below its definition.
+    _defaultClientLock = threading.Lock()
 
     class CommandCache(object):
         createTableQuery = '''
@@ -1308,47 +1479,60 @@ CREATE TABLE IF NOT EXISTS command_cache (
             self.Remove(cmd)
             self.Add(cmd=cmd, result=result, stdout=stdout, stderr=stderr)
  
+    # Returns the AsyncAccuRevClient that is used by the module level async_*() functions.
     @staticmethod
-    def _runCommand(cmd, outputFilename=None, useCache=False):
-        outputFile = None
-        
-        # Try and see if we are able to use the command cache.
-        if outputFilename is None and raw._commandCacheFilename is not None and useCache:
-            with raw.CommandCache(raw._commandCacheFilename) as cc:
-                row = cc.Get(cmd=cmd)
-                if row is not None:
-                    # Cache hit!
-                    cmd, returncode, output, error = row
-                    raw._lastCommand = None
-                    return output
+    def _asyncClient():
+        with raw._defaultClientLock:
+            if raw._defaultAsyncClient is None:
+                raw._defaultAsyncClient = AsyncAccuRevClient()
+            return raw._defaultAsyncClient
+
+    # Returns the client which runs the commands for the current thread. Inside of an AccuRevClient.call() this is the
+    # calling client, otherwise a default client which uses the module level command cache.
+    @staticmethod
+    def _client():
+        client = getattr(raw._local, 'client', None)
+        if client is None:
+            with raw._defaultClientLock:
+                if raw._defaultClient is None:
+                    raw._defaultClient = AccuRevClient()
+                client = raw._defaultClient
+        return client
+
+    # Stores the result of a command as the last result of the current thread.
+    @staticmethod
+    def _recordResult(result):
+        results = getattr(raw._local, 'results', None)
+        if results is not None:
+            results.append(result)
+        raw._local.lastResult = result
+        raw._lastCommand = result
+
+    # Returns the CommandResult of the last command which was run by the current thread or None if no command was run.
+    @staticmethod
+    def _lastResult():
+        return getattr(raw._local, 'lastResult', None)
 
+    @staticmethod
+    def _runCommand(cmd, outputFilename=None, useCache=False):
+        result = raw._client().run(cmd=cmd, outputFilename=outputFilename, useCache=useCache)
         if outputFilename is not None:
-            outputFile = open(outputFilename, "w")
-            accurevCommand = subprocess.Popen(cmd, stdout=outputFile, stdin=subprocess.PIPE, universal_newlines=True)
-        else:
-            accurevCommand = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE, universal_newlines=True)
-            
-        output = ''
-        error = ''
-        accurevCommand.poll()
-        while accurevCommand.returncode is None:
-            stdoutdata, stderrdata = accurevCommand.communicate()
-            error += stderrdata
-            if outputFile is None:
-                output += stdoutdata
-            accurevCommand.poll()
-        
-        raw._lastCommand = accurevCommand
-
-        if raw._commandCacheFilename is not None and useCache:
-            with raw.CommandCache(raw._commandCacheFilename) as cc:
-               cc.Add(cmd=cmd, result=accurevCommand.returncode, stdout=output, stderr=error)
-        
-        if outputFile is None:
-            return output
-        else:
-            outputFile.close()
             return 'Written to ' + outputFilename
+        return result.stdout
+
+    # Runs the command which the raw function builds and returns its CommandResult. Used by the module level functions which
+    # parse the output so that they can parse the CommandResult.output() without decoding it into a string first.
+    @staticmethod
+    def _runResult(function, *args, **kwargs):
+        captured = _captureCommand(function, *args, **kwargs)
+        return raw._client().run(cmd=captured.cmd, outputFilename=captured.outputFilename, useCache=captured.useCache)
+
+    # Runs the command and reads its output incrementally until the marker is found at which point the command is terminated.
+    # Returns True if the marker was found, False if the command completed successfully without printing it and None if the
+    # command failed. See AccuRevClient.probe().
+    @staticmethod
+    def _probeCommand(cmd, marker, useCache=False):
+        return raw._client().probe(cmd=cmd, marker=marker, useCache=useCache).value
 
     @staticmethod
     def getAcSync():
@@ -1372,32 +1556,17 @@ CREATE TABLE IF NOT EXISTS command_cache (
                 cmd.append("-n")
             cmd.extend([ username, password ])
 
-            accurevCommand = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-
-            output = ''
-            error  = ''
-            accurevCommand.poll()
-            while accurevCommand.returncode is None:
-                stdoutdata, stderrdata = accurevCommand.communicate()
-                output += stdoutdata
-                if stderrdata is not None:
-                    error  += stderrdata
-                accurevCommand.poll()
-            
-            raw._lastCommand = accurevCommand
+            result = raw._client().run(cmd=cmd)
             
-            return obj.Login(errorMessage=error)
+            return obj.Login(errorMessage=result.stderr)
         
         return False
         
     @staticmethod
     def logout():
-        accurevCommand = subprocess.Popen([ "accurev", "logout" ], universal_newlines=True)
-        accurevCommand.wait()
+        result = raw._client().run(cmd=[ "accurev", "logout" ])
         
-        raw._lastCommand = accurevCommand
-        
-        return (accurevCommand.returncode == 0)
+        return (result.returncode == 0)
 
     @staticmethod
     def stat(all=False, inBackingStream=False, dispBackingChain=False, defaultGroupOnly=False
@@ -1556,7 +1725,9 @@ CREATE TABLE IF NOT EXISTS command_cache (
     def diff( verSpec1=None, verSpec2=None, transactionRange=None, toBacking=False, toOtherBasisVersion=False, toPrevious=False
             , all=False, onlyDefaultGroup=False, onlyKept=False, onlyModified=False, onlyExtModified=False, onlyOverlapped=False, onlyPending=False
             , ignoreBlankLines=False, isContextDiff=False, informationOnly=False, ignoreCase=False, ignoreWhitespace=False, ignoreAmountOfWhitespace=False, useGUI=False
-            , extraParams=None, isXmlOutput=False, useCache=False):
+            , extraParams=None, isXmlOutput=False, useCache=False, isProbe=False):
+        # When isProbe is True the XML output is read only until the first changed element is found and a boolean is returned
+        # instead of the output. See raw._probeCommand().
         cmd = [ raw._accurevCmd, "diff" ]
         
         if all:
@@ -1610,6 +1781,11 @@ CREATE TABLE IF NOT EXISTS command_cache (
         if extraParams is not None:
             cmd.extend([ '--', extraParams ])
         
+        if isProbe:
+            if not isXmlOutput:
+                raise Exception('accurev.raw.diff can only probe the XML output!')
+            return raw._probeCommand(cmd=cmd, marker='<Element', useCache=useCache)
+
         return raw._runCommand(cmd=cmd, useCache=useCache)
         
     # AccuRev populate command
@@ -1763,7 +1939,7 @@ CREATE TABLE IF NOT EXISTS command_cache (
                     timeSpecStr = str(timeSpec)
                 cmd.extend(["-t", str(timeSpecStr)])
             if newName is not None:
-                renameCmd.append(newName)
+                cmd.append(newName)
             
             return raw._runCommand(cmd)
         
@@ -1787,7 +1963,7 @@ CREATE TABLE IF NOT EXISTS command_cache (
         if eolType is not None:
             cmd.extend([ '-e', eolType ])
         if newName is not None:
-            renameCmd.append(newName)
+            cmd.append(newName)
         
         return raw._runCommand(cmd)
         
@@ -1800,7 +1976,7 @@ CREATE TABLE IF NOT EXISTS command_cache (
         if doPreview:
             cmd.append('-i')
         if transactionNumber is not None:
-            cmd.extend([ '-t', transactionNumber ])
+            cmd.extend([ '-t', str(transactionNumber) ])
         if mergeOnUpdate:
             cmd.append('-m')
         if isXmlOutput:
@@ -1901,6 +2077,245 @@ CREATE TABLE IF NOT EXISTS command_cache (
             
             return raw._runCommand(cmd)
     
+# ################################################################################################ #
+# AccuRev query service                                                                            #
+# The `accurev.py serve` command answers the hist, show streams, deep-hist and affected-streams    #
+# queries of several converters from a single process so that they share its warm caches.          #
+# ################################################################################################ #
+# Raised by the QueryServiceClient when the query service can't answer a query.
+class QueryServiceError(Exception):
+    pass
+
+# Converts the values returned by the functions of this library, which are made of obj objects, into JSON compatible
+# values. The obj objects are stored as their class name and attributes.
+def _encodeQueryValue(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    elif isinstance(value, datetime.datetime):
+        return { '__datetime__': [ value.year, value.month, value.day, value.hour, value.minute, value.second, value.microsecond ] }
+    elif isinstance(value, list):
+        return [ _encodeQueryValue(item) for item in value ]
+    elif isinstance(value, tuple):
+        return { '__tuple__': [ _encodeQueryValue(item) for item in value ] }
+    elif isinstance(value, dict):
+        return { '__dict__': [ [ _encodeQueryValue(key), _encodeQueryValue(item) ] for key, item in value.items() ] }
+    elif type(value).__qualname__.startswith('obj.') and hasattr(value, '__dict__'):
+        if isinstance(value, obj.Transaction):
+            value.versions # Parses the versions from their XML elements, which can't be encoded, see obj.Transaction.versions.
+        return { '__obj__': type(value).__qualname__, 'attributes': { name: _encodeQueryValue(item) for name, item in vars(value).items() } }
+    raise TypeError("Can't encode a {0} for the query service.".format(type(value).__name__))
+
+# The inverse of _encodeQueryValue(). Only the classes of the obj namespace are ever instantiated.
+def _decodeQueryValue(value):
+    if isinstance(value, list):
+        return [ _decodeQueryValue(item) for item in value ]
+    elif isinstance(value, dict):
+        if '__datetime__' in value:
+            return datetime.datetime(*value['__datetime__'])
+        elif '__tuple__' in value:
+            return tuple([ _decodeQueryValue(item) for item in value['__tuple__'] ])
+        elif '__dict__' in value:
+            return { _decodeQueryValue(key): _decodeQueryValue(item) for key, item in value['__dict__'] }
+        elif '__obj__' in value:
+            names = value['__obj__'].split('.')
+            cls = obj
+            for name in names[1:]:
+                cls = getattr(cls, name, None)
+            if names[0] != 'obj' or not isinstance(cls, type):
+                raise ValueError("Can't decode a {0} from the query service.".format(value['__obj__']))
+            instance = cls.__new__(cls)
+            instance.__dict__.update({ name: _decodeQueryValue(item) for name, item in value['attributes'].items() })
+            return instance
+        raise ValueError("Can't decode {0} from the query service.".format(repr(value)))
+    return value
+
+# Sends the queries to an `accurev.py serve` process at the given url, see ext.use_query_service(). Once the service can't
+# be reached it isn't asked again for retryInterval seconds.
+class QueryServiceClient(object):
+    def __init__(self, url='http://127.0.0.1:8765/', timeout=None, retryInterval=30.0):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.retryInterval = retryInterval
+        self.unavailableUntil = None
+        self.lastError = None
+
+    def __repr__(self):
+        return "QueryServiceClient(url=" + repr(self.url) + ")"
+
+    def IsAvailable(self):
+        return self.unavailableUntil is None or time.time() >= self.unavailableUntil
+
+    # Returns the result of the named query for the given keyword arguments. Raises a QueryServiceError if the service can't
+    # answer it.
+    def Query(self, name, **kwargs):
+        body = json.dumps(_encodeQueryValue(kwargs)).encode('utf-8')
+        request = urllib.request.Request('{0}/{1}'.format(self.url, name), data=body, headers={ 'Content-Type': 'application/json' })
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                reply = json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            try:
+                self.lastError = json.loads(e.read().decode('utf-8')).get('error')
+            except ValueError:
+                self.lastError = str(e)
+            raise QueryServiceError("The query service failed to answer {0}: {1}".format(name, self.lastError))
+        except (OSError, ValueError) as e:
+            self.lastError = str(e)
+            self.unavailableUntil = time.time() + self.retryInterval
+            raise QueryServiceError("The query service at {0} is unavailable: {1}".format(self.url, self.lastError))
+        self.unavailableUntil = None
+        return _decodeQueryValue(reply.get('result'))
+
+    # Returns the statistics of the service, see QueryService.GetStats().
+    def GetStats(self):
+        with urllib.request.urlopen('{0}/stats'.format(self.url), timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8')).get('result')
+
+# Forwards the calls of the decorated function to the query service as the named query, when one is in use, and falls back to
+# calling the function if the service can't answer. Calls that read or write files are never forwarded, nor are the calls made
+# through an AccuRevClient other than the default one. The transform is applied to the result of a forwarded call.
+def _served(queryName, transform=None):
+    def decorator(function):
+        signature = inspect.signature(function)
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            service = raw._queryService
+            if service is not None and service.IsAvailable() and getattr(raw._local, 'client', None) is None:
+                arguments = signature.bind(*args, **kwargs).arguments
+                if arguments.get('listFile') is None and arguments.get('outputFilename') is None:
+                    try:
+                        result = service.Query(queryName, **arguments)
+                        return transform(result) if transform is not None else result
+                    except QueryServiceError:
+                        pass
+            return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Answers the queries of the QueryServiceClients. The results of the queries whose time-spec or transaction are fixed, which can
+# no longer change, are kept in memory (up to maxResults of them) while every query benefits from the command cache, when one is
+# enabled, and the stream hierarchy and transaction time indices that ext keeps between the calls.
+class QueryService(object):
+    def __init__(self, host='127.0.0.1', port=8765, maxResults=1000):
+        self.host = host
+        self.port = port
+        self.maxResults = maxResults
+        self.queries = {
+            'hist':                   hist,
+            'show_streams':           show.streams,
+            'deep_hist':              ext.deep_hist,
+            'affected_streams':       ext.affected_streams,
+            'affected_streams_batch': ext.affected_streams_batch,
+            'stream_info':            ext.stream_info
+        }
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+        self.queryCount = 0
+        self.hitCount = 0
+        self.server = None
+
+    # Returns True if the result of a query with the given arguments can't change anymore.
+    @staticmethod
+    def IsFixed(kwargs):
+        isFixed = False
+        for name in [ 'timeSpec', 'transaction' ]:
+            if name not in kwargs:
+                continue
+            value = kwargs[name]
+            if isinstance(value, obj.Transaction):
+                value = value.id
+            ts = value if isinstance(value, obj.TimeSpec) else obj.TimeSpec.fromstring(str(value))
+            if ts is None or isinstance(ts.start, str) or isinstance(ts.end, str):
+                return False
+            isFixed = True
+        return isFixed
+
+    # Returns the JSON encoded reply to the named query.
+    def Query(self, name, kwargs):
+        if name not in self.queries:
+            raise KeyError(name)
+        key = None
+        if self.IsFixed(kwargs) and kwargs.get('listFile') is None and kwargs.get('outputFilename') is None:
+            key = (name, json.dumps(_encodeQueryValue(kwargs), sort_keys=True))
+        with self.lock:
+            self.queryCount += 1
+            if key in self.results:
+                self.hitCount += 1
+                self.results.move_to_end(key)
+                return self.results[key]
+
+        result = self.queries[name](**kwargs)
+        try:
+            reply = json.dumps({ 'result': _encodeQueryValue(result) }).encode('utf-8')
+        except TypeError as e:
+            raise QueryServiceError("The result of {0} can't be encoded. {1}".format(name, e))
+
+        if key is not None:
+            with self.lock:
+                self.results[key] = reply
+                while len(self.results) > self.maxResults:
+                    self.results.popitem(last=False)
+        return reply
+
+    def GetStats(self):
+        with self.lock:
+            return { 'queries': self.queryCount, 'hits': self.hitCount, 'results': len(self.results) }
+
+    # Serves the queries, each on its own thread, until Shutdown() is called.
+    def Serve(self):
+        self.server = _QueryHTTPServer((self.host, self.port), _QueryRequestHandler)
+        self.server.service = self
+        self.port = self.server.server_address[1]
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+    def Shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+class _QueryHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+# Each query is a POST to /<query name> with the JSON encoded keyword arguments as its body. The reply is a JSON object with
+# either the "result" or the "error".
+class _QueryRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.strip('/') == 'stats':
+            self.reply(200, json.dumps({ 'result': self.server.service.GetStats() }).encode('utf-8'))
+        else:
+            self.replyError(404, "Unknown path {0}".format(self.path))
+
+    def do_POST(self):
+        name = self.path.strip('/')
+        if name not in self.server.service.queries:
+            self.replyError(404, "Unknown query {0}".format(name))
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            kwargs = _decodeQueryValue(json.loads(self.rfile.read(length).decode('utf-8'))) if length > 0 else {}
+            reply = self.server.service.Query(name, kwargs)
+        except Exception as e:
+            self.log_error("%s failed. %s: %s", name, type(e).__name__, e)
+            self.replyError(500, "{0}: {1}".format(type(e).__name__, e))
+            return
+        self.reply(200, reply)
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def replyError(self, status, message):
+        self.reply(status, json.dumps({ 'error': message }).encode('utf-8'))
+
+    # Only the errors are logged, not every request.
+    def log_request(self, code='-', size='-'):
+        pass
+
 # ################################################################################################ #
 # Script Functions (the main interface to this library)                                            #
 # ################################################################################################ #
@@ -1924,7 +2339,7 @@ def stat(all=False, inBackingStream=False, dispBackingChain=False, defaultGroupO
         , underlapedElementsOnly=False, pendingElementsOnly=False, dontOptimizeSearch=False
         , directoryTreePath=None, stream=None, externalOnly=False, showExcluded=False
         , timeSpec=None, ignorePatternsList=[], listFile=None, elementList=None, outputFilename=None):
-    outputXml = raw.stat(all=all, inBackingStream=inBackingStream, dispBackingChain=dispBackingChain, defaultGroupOnly=defaultGroupOnly
+    result = raw._runResult(raw.stat, all=all, inBackingStream=inBackingStream, dispBackingChain=dispBackingChain, defaultGroupOnly=defaultGroupOnly
         , defunctOnly=defunctOnly, absolutePaths=absolutePaths, filesOnly=filesOnly, directoriesOnly=directoriesOnly
         , locationsOnly=locationsOnly, twoLineListing=twoLineListing, showLinkTarget=showLinkTarget, isXmlOutput=True
         , dispElemID=dispElemID, dispElemType=dispElemType, strandedElementsOnly=strandedElementsOnly, keptElementsOnly=keptElementsOnly
@@ -1932,12 +2347,13 @@ def stat(all=False, inBackingStream=False, dispBackingChain=False, defaultGroupO
         , underlapedElementsOnly=underlapedElementsOnly, pendingElementsOnly=pendingElementsOnly, dontOptimizeSearch=dontOptimizeSearch
         , directoryTreePath=directoryTreePath, stream=stream, externalOnly=externalOnly, showExcluded=showExcluded
         , timeSpec=timeSpec, ignorePatternsList=ignorePatternsList, listFile=listFile, elementList=elementList, outputFilename=outputFilename)
-    if raw._lastCommand.returncode == 0:
-        return obj.Stat.fromxmlstring(outputXml)
+    if result.returncode == 0:
+        return obj.Stat.fromxmlstring(result.output())
     else:
         return None
 
 # AccuRev history command
+@_served('hist')
 def hist( depot=None, stream=None, timeSpec=None, listFile=None, isListFileXml=False, elementList=None
         , allElementsFlag=False, elementId=None, transactionKind=None, commentString=None, username=None
         , expandedMode=False, showIssues=False, verboseMode=False, listMode=False, showStatus=False, transactionMode=False
@@ -1953,11 +2369,11 @@ def hist( depot=None, stream=None, timeSpec=None, listFile=None, isListFileXml=F
         useCache = ts is not None and not (isinstance(ts.start, str) or isinstance(ts.end, str)) # If both values are non-keywords, we can cache them.
         useCache = useCache and listFile is None and outputFilename is None   # Ensure that we don't have any file operations...
         
-    xmlOutput = raw.hist(depot=depot, stream=stream, timeSpec=timeSpec, listFile=listFile, isListFileXml=isListFileXml, elementList=elementList
+    result = raw._runResult(raw.hist, depot=depot, stream=stream, timeSpec=timeSpec, listFile=listFile, isListFileXml=isListFileXml, elementList=elementList
         , allElementsFlag=allElementsFlag, elementId=elementId, transactionKind=transactionKind, commentString=commentString, username=username
         , expandedMode=expandedMode, showIssues=showIssues, verboseMode=verboseMode, listMode=listMode, showStatus=showStatus, transactionMode=transactionMode
         , isXmlOutput=True, outputFilename=outputFilename, useCache=useCache)
-    return obj.History.fromxmlstring(xmlOutput)
+    return obj.History.fromxmlstring(result.output())
 
 # AccuRev diff command
 def diff(verSpec1=None, verSpec2=None, transactionRange=None, toBacking=False, toOtherBasisVersion=False, toPrevious=False
@@ -1975,36 +2391,51 @@ def diff(verSpec1=None, verSpec2=None, transactionRange=None, toBacking=False, t
         useCache = ts is not None and not (isinstance(ts.start, str) or isinstance(ts.end, str)) # If both values are non-keywords, we can cache them.
         useCache = useCache and extraParams is None # I'm not sure what the purpose of extraParams is atm so disable the cache for the unknown.
 
-    xmlOutput = raw.diff(verSpec1=verSpec1, verSpec2=verSpec2, transactionRange=transactionRange, toBacking=toBacking, toOtherBasisVersion=toOtherBasisVersion, toPrevious=toPrevious
+    result = raw._runResult(raw.diff, verSpec1=verSpec1, verSpec2=verSpec2, transactionRange=transactionRange, toBacking=toBacking, toOtherBasisVersion=toOtherBasisVersion, toPrevious=toPrevious
         , all=all, onlyDefaultGroup=onlyDefaultGroup, onlyKept=onlyKept, onlyModified=onlyModified, onlyExtModified=onlyExtModified, onlyOverlapped=onlyOverlapped, onlyPending=onlyPending
         , ignoreBlankLines=ignoreBlankLines, isContextDiff=isContextDiff, informationOnly=informationOnly, ignoreCase=ignoreCase, ignoreWhitespace=ignoreWhitespace, ignoreAmountOfWhitespace=ignoreAmountOfWhitespace, useGUI=useGUI
         , extraParams=extraParams, isXmlOutput=True, useCache=useCache)
-    return obj.Diff.fromxmlstring(xmlOutput)
+    return obj.Diff.fromxmlstring(result.output())
+
+# Returns True if the accurev diff command would return at least one changed element, False if it wouldn't and None on
+# failure. The command is terminated as soon as the first element is seen so this is much cheaper than a full diff().
+def diff_probe(verSpec1=None, verSpec2=None, transactionRange=None, all=False, informationOnly=False, useCache=False):
+    if useCache:
+        if transactionRange is None:
+            ts = None
+        elif not isinstance(transactionRange, obj.TimeSpec):
+            ts = obj.TimeSpec.fromstring(transactionRange)
+        else:
+            ts = transactionRange
+
+        useCache = ts is not None and not (isinstance(ts.start, str) or isinstance(ts.end, str)) # If both values are non-keywords, we can cache them.
+
+    return raw.diff(verSpec1=verSpec1, verSpec2=verSpec2, transactionRange=transactionRange, all=all, informationOnly=informationOnly, isXmlOutput=True, useCache=useCache, isProbe=True)
 
 # AccuRev Populate command
 def pop(isRecursive=False, isOverride=False, verSpec=None, location=None, dontBuildDirTree=False, timeSpec=None, listFile=None, elementList=None):
-    output = raw.pop(isRecursive=isRecursive, isOverride=isOverride, verSpec=verSpec, location=location, dontBuildDirTree=dontBuildDirTree, timeSpec=timeSpec, isXmlOutput=True, listFile=listFile, elementList=elementList)
-    return obj.Pop.fromxmlstring(output)
+    result = raw._runResult(raw.pop, isRecursive=isRecursive, isOverride=isOverride, verSpec=verSpec, location=location, dontBuildDirTree=dontBuildDirTree, timeSpec=timeSpec, isXmlOutput=True, listFile=listFile, elementList=elementList)
+    return obj.Pop.fromxmlstring(result.output())
 
 # AccuRev checkout command
 def co(comment=None, selectAllModified=False, verSpec=None, isRecursive=False, transactionNumber=None, elementId=None, listFile=None, elementList=None):
     output = raw.oo(comment=comment, selectAllModified=selectAllModified, verSpec=verSpec, isRecursive=isRecursive, transactionNumber=transactionNumber, elementId=elementId, listFile=listFile, elementList=elementList)
-    if raw._lastCommand is not None:
-        return (raw._lastCommand.returncode == 0)
+    if raw._lastResult() is not None:
+        return (raw._lastResult().returncode == 0)
     return None
 
 def cat(elementId=None, element=None, depotName=None, verSpec=None, outputFilename=None, useCache=False):
     if useCache:
         useCache = useCache and outputFilename is None
     output = raw.cat(elementId=elementId, element=element, depotName=depotName, verSpec=verSpec, outputFilename=outputFilename, useCache=useCache)
-    if raw._lastCommand is not None:
+    if raw._lastResult() is not None:
         return output
     return None
 
 def purge(comment=None, stream=None, issueNumber=None, elementList=None, listFile=None, elementId=None):
     output = raw.purge(comment=comment, stream=stream, issueNumber=issueNumber, elementList=elementList, listFile=listFile, elementId=elementId)
-    if raw._lastCommand is not None:
-        return (raw._lastCommand.returncode == 0)
+    if raw._lastResult() is not None:
+        return (raw._lastResult().returncode == 0)
     return None
 
 # AccuRev ancestor command
@@ -2014,19 +2445,23 @@ def anc(element, commonAncestor=False, versionId=None, basisVersion=False, commo
     
 def chstream(stream, newBackingStream=None, timeSpec=None, newName=None):
     raw.chstream(stream=stream, newBackingStream=newBackingStream, timeSpec=timeSpec, newName=newName)
-    if raw._lastCommand is not None:
-        return (raw._lastCommand.returncode == 0)
+    if raw._lastResult() is not None:
+        return (raw._lastResult().returncode == 0)
     return None
     
 def chws(workspace, newBackingStream=None, newLocation=None, newMachine=None, kind=None, eolType=None, isMyWorkspace=True, newName=None):
     raw.chws(workspace=workspace, newBackingStream=newBackingStream, newLocation=newLocation, newMachine=newMachine, kind=kind, eolType=eolType, isMyWorkspace=isMyWorkspace, newName=newName)
-    if raw._lastCommand is not None:
-        return (raw._lastCommand.returncode == 0)
+    if raw._lastResult() is not None:
+        return (raw._lastResult().returncode == 0)
     return None
         
 def update(refTree=None, doPreview=False, transactionNumber=None, mergeOnUpdate=False, isOverride=False, outputFilename=None):
-    outputXml = raw.update(refTree=refTree, doPreview=doPreview, transactionNumber=transactionNumber, mergeOnUpdate=mergeOnUpdate, isXmlOutput=True, isOverride=isOverride, outputFilename=outputFilename)
-    return obj.Update.fromxmlstring(outputXml)
+    result = raw._runResult(raw.update, refTree=refTree, doPreview=doPreview, transactionNumber=transactionNumber, mergeOnUpdate=mergeOnUpdate, isXmlOutput=True, isOverride=isOverride, outputFilename=outputFilename)
+    updateResult = obj.Update.fromxmlstring(result.output())
+    if updateResult is not None and result.returncode != 0 and len(updateResult.errors) == 0:
+        # The update failed without saying so in its messages.
+        updateResult.errors.append(result.stderr.strip() if result.stderr else 'accurev update exited with {0}'.format(result.returncode))
+    return updateResult
     
 def info(showVersion=False):
     outputString = raw.info(showVersion=showVersion)
@@ -2044,6 +2479,7 @@ class show(object):
         return obj.Show.Depots.fromxmlstring(xmlOutput)
 
     @staticmethod
+    @_served('show_streams')
     def streams(depot=None, timeSpec=None, stream=None, matchType=None, listFile=None, listPathAndChildren=False, listChildren=False, listImmediateChildren=False, nonEmptyDefaultGroupsOnly=False, includeDeactivatedItems=False, includeOldDefinitions=False, includeHasDefaultGroupAttribute=False, useCache=False):
         if useCache:
             if timeSpec is None:
@@ -2056,17 +2492,769 @@ class show(object):
             useCache = ts is not None and not (isinstance(ts.start, str) or isinstance(ts.end, str)) # If both values are non-keywords, we can cache them.
             useCache = useCache and listFile is None # Ensure that we don't have any file operations...
             
-        xmlOutput = raw.show.streams(depot=depot, timeSpec=timeSpec, stream=stream, matchType=matchType, listFile=listFile, listPathAndChildren=listPathAndChildren, listChildren=listChildren, listImmediateChildren=listImmediateChildren, nonEmptyDefaultGroupsOnly=nonEmptyDefaultGroupsOnly, isXmlOutput=True, includeDeactivatedItems=includeDeactivatedItems, includeOldDefinitions=includeOldDefinitions, includeHasDefaultGroupAttribute=includeHasDefaultGroupAttribute, useCache=useCache)
-        return obj.Show.Streams.fromxmlstring(xmlOutput)
+        result = raw._runResult(raw.show.streams, depot=depot, timeSpec=timeSpec, stream=stream, matchType=matchType, listFile=listFile, listPathAndChildren=listPathAndChildren, listChildren=listChildren, listImmediateChildren=listImmediateChildren, nonEmptyDefaultGroupsOnly=nonEmptyDefaultGroupsOnly, isXmlOutput=True, includeDeactivatedItems=includeDeactivatedItems, includeOldDefinitions=includeOldDefinitions, includeHasDefaultGroupAttribute=includeHasDefaultGroupAttribute, useCache=useCache)
+        return obj.Show.Streams.fromxmlstring(result.output())
 
 class replica(object):
     @staticmethod
     def sync():
         raw.replica.sync()
-        if raw._lastCommand is not None:
-            return (raw._lastCommand.returncode == 0)
+        if raw._lastResult() is not None:
+            return (raw._lastResult().returncode == 0)
         return None
         
+# ################################################################################################ #
+# AccuRev client                                                                                   #
+# The AccuRevClient runs the raw commands and returns a CommandResult per call which makes it safe #
+# to use from several threads at once.                                                             #
+# ################################################################################################ #
+# A view of a binary file, shared by several CommandResults, with its own position so that the results can be read concurrently.
+class _SharedFileReader(object):
+    def __init__(self, file, lock):
+        self.file = file
+        self.lock = lock
+        self.position = 0
+
+    def seek(self, offset, whence=0):
+        if whence != 0:
+            raise ValueError("Only absolute positions are supported.")
+        self.position = offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        with self.lock:
+            self.file.seek(self.position)
+            data = self.file.read(size) if size is not None and size >= 0 else self.file.read()
+        self.position += len(data)
+        return data
+
+# Coalesces identical accurev commands which are requested while one of them is already running. The first caller (the leader)
+# runs the command and the others wait for its result instead of starting another subprocess.
+class _SingleFlight(object):
+    class Flight(object):
+        def __init__(self):
+            self.event = threading.Event()
+            self.useCache = False
+            self.result = None
+            self.error = None
+            self.lock = threading.Lock()
+
+        def Complete(self, result=None, error=None):
+            self.result = result
+            self.error = error
+            self.event.set()
+
+        # Waits for the leader and returns a copy of its result which can be used independently of the other waiters' copies.
+        def Wait(self, isLeader):
+            self.event.wait()
+            if self.error is not None:
+                raise self.error
+            result = self.result
+            stdoutFile = _SharedFileReader(result.stdoutFile, self.lock) if result.stdoutFile is not None else None
+            copy = CommandResult(cmd=result.cmd, returncode=result.returncode, stdout=result._stdout, stderr=result.stderr, seconds=result.seconds, isCached=result.isCached, value=result.value, stdoutFile=stdoutFile)
+            copy.isShared = not isLeader
+            return copy
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    # Returns the (flight, isLeader) tuple for the key. The result goes into the command cache if any of the callers uses it.
+    def Join(self, key, useCache):
+        with self.lock:
+            flight = self.flights.get(key)
+            isLeader = flight is None
+            if isLeader:
+                flight = _SingleFlight.Flight()
+                self.flights[key] = flight
+            flight.useCache = flight.useCache or useCache
+            return (flight, isLeader)
+
+    # Stops new callers from joining the flight.
+    def Land(self, key):
+        with self.lock:
+            return self.flights.pop(key, None)
+
+raw._singleFlight = _SingleFlight()
+
+class CommandResult(object):
+    def __init__(self, cmd, returncode=None, stdout=None, stderr=None, seconds=None, isCached=False, value=None, stdoutFile=None):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stderr = stderr
+        self.seconds = seconds
+        self.isCached = isCached
+        self.value = value
+        self.stdoutFile = stdoutFile # The undecoded standard output as a binary file object, if it was captured that way.
+        self.isShared = False # True if the command was run by another caller, which ran the identical command at the same time.
+        self._stdout = stdout
+
+    # The standard output as a string. When it was captured into the stdoutFile it is only decoded when it is first used.
+    @property
+    def stdout(self):
+        if self._stdout is None and self.stdoutFile is not None:
+            self.stdoutFile.seek(0)
+            self._stdout = _decodeOutput(self.stdoutFile.read())
+        return self._stdout
+
+    # Returns the standard output in the form that is the cheapest to parse with ParseXml(). This is the stdoutFile, rewound,
+    # if the output was captured into a file, otherwise the stdout string.
+    def output(self):
+        if self.stdoutFile is not None:
+            self.stdoutFile.seek(0)
+            return self.stdoutFile
+        return self._stdout
+
+    def __repr__(self):
+        return 'CommandResult(cmd={0}, returncode={1}, seconds={2}, isCached={3})'.format(repr(self.cmd), self.returncode, self.seconds, self.isCached)
+
+    def __bool__(self):
+        return (self.returncode == 0)
+
+    __nonzero__ = __bool__
+
+# Admits the accurev commands to the server so that several threads, or workers, don't overwhelm it. It combines:
+#   - a token bucket which limits the rate at which the commands are started (if a rate is given),
+#   - an adaptive concurrency limit which grows by one every `limit` commands while their latency stays within
+#     latencyTolerance times the lowest latency seen for the same kind of command, shrinks by 10% when it doesn't and is
+#     halved when a command fails,
+#   - optional per-kind concurrency limits, where the kind is the accurev subcommand (e.g. 'pop' or 'hist'),
+#   - a pause after failures which grows exponentially with the number of consecutive failures and is randomized (full jitter).
+# Enable it with ext.enable_governor(). The concurrency, queueDepth and limit attributes and GetStats() can be used for monitoring.
+class CommandGovernor(object):
+    successCodes = { 'diff': [ 1 ] } # The non-zero exit codes with which a kind of command succeeds. accurev diff exits with 1 when it finds differences.
+
+    def __init__(self, maxConcurrent=8, minConcurrent=1, rate=None, burst=None, kindLimits=None, latencyTolerance=2.0, backoffBase=0.5, backoffCap=30.0):
+        self.maxConcurrent = maxConcurrent
+        self.minConcurrent = minConcurrent
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, maxConcurrent)
+        self.kindLimits = dict(kindLimits) if kindLimits is not None else {}
+        self.latencyTolerance = latencyTolerance
+        self.backoffBase = backoffBase
+        self.backoffCap = backoffCap
+
+        self.limit = float(maxConcurrent)
+        self.concurrency = 0
+        self.queueDepth = 0
+        self.kindConcurrency = {}
+        self.latency = {} # kind -> (baseline, smoothed) in seconds
+        self.failureStreak = 0
+
+        self._tokens = float(self.burst)
+        self._lastRefill = time.time()
+        self._pausedUntil = 0
+        self._condition = threading.Condition()
+
+    # Returns the kind of the accurev command, which is its subcommand.
+    @staticmethod
+    def GetKind(cmd):
+        if cmd is not None and len(cmd) > 1:
+            return cmd[1]
+        return None
+
+    # Returns the kind under which the probes (see AccuRevClient.probe()) of the command are governed. The probes stop reading the
+    # output early so their latency isn't comparable with that of the commands which read it all.
+    @staticmethod
+    def GetProbeKind(cmd):
+        kind = CommandGovernor.GetKind(cmd)
+        if kind is not None:
+            return kind + '-probe'
+        return None
+
+    # Returns True if the command succeeded. A non-zero exit code listed in successCodes is only a success if the output, when it
+    # is given, starts with an XML element since accurev also uses the code for some of its errors, which it prints as plain text.
+    @staticmethod
+    def IsSuccess(cmd, returncode, output=None):
+        if returncode == 0:
+            return True
+        if returncode not in CommandGovernor.successCodes.get(CommandGovernor.GetKind(cmd), []):
+            return False
+        if output is None:
+            return True
+        return CommandGovernor._hasXmlRoot(output)
+
+    # Returns True if the output, a string or a file, starts with a well formed XML start tag. Only the output up to the end of
+    # the start tag is parsed and a file is left at the position at which it was given.
+    @staticmethod
+    def _hasXmlRoot(output, chunkSize=4096):
+        parser = ElementTree.XMLPullParser(events=('start',))
+        isFile = hasattr(output, 'read')
+        position = output.tell() if isFile else 0
+        offset = 0
+        try:
+            while True:
+                if isFile:
+                    chunk = output.read(chunkSize)
+                else:
+                    chunk = output[offset:offset + chunkSize]
+                    offset += len(chunk)
+                if len(chunk) == 0:
+                    parser.close()
+                    return len(list(parser.read_events())) > 0
+                parser.feed(chunk)
+                if len(list(parser.read_events())) > 0:
+                    return True
+        except ElementTree.ParseError:
+            return False
+        finally:
+            if isFile:
+                output.seek(position)
+
+    # Sets the maximum number of concurrent commands of the given kind. A limit of None removes the limit.
+    def SetKindLimit(self, kind, limit):
+        with self._condition:
+            if limit is None:
+                self.kindLimits.pop(kind, None)
+            else:
+                self.kindLimits[kind] = limit
+            self._condition.notify_all()
+
+    # Returns the randomized number of seconds to wait before the retry which follows the given number of failed attempts.
+    def GetBackoff(self, attempt):
+        return random.uniform(0, min(self.backoffCap, self.backoffBase * (2 ** attempt)))
+
+    # Returns the number of seconds to wait before the command can be admitted, None to wait for a command to finish or 0
+    # if it can be admitted now. Must be called with the _condition held.
+    def _getWait(self, kind, now):
+        if now < self._pausedUntil:
+            return self._pausedUntil - now
+        if self.concurrency >= max(self.minConcurrent, int(self.limit)):
+            return None
+        kindLimit = self.kindLimits.get(kind)
+        if kindLimit is not None and self.kindConcurrency.get(kind, 0) >= kindLimit:
+            return None
+        if self.rate is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._lastRefill) * self.rate)
+            self._lastRefill = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+        return 0
+
+    # Blocks until a command of the given kind can be run. Every Acquire() must be followed by a Release().
+    def Acquire(self, kind=None):
+        with self._condition:
+            self.queueDepth += 1
+            try:
+                wait = self._getWait(kind, time.time())
+                while wait != 0:
+                    self._condition.wait(wait)
+                    wait = self._getWait(kind, time.time())
+            finally:
+                self.queueDepth -= 1
+            self._admit(kind)
+
+    # The asyncio form of Acquire(), which waits without blocking the event loop or a thread. The wait is polled, every
+    # pollInterval seconds while it waits for a command to finish, since the commands are released from other threads. A
+    # cancelled wait doesn't admit the command.
+    async def AsyncAcquire(self, kind=None, pollInterval=0.05):
+        with self._condition:
+            self.queueDepth += 1
+        try:
+            while True:
+                with self._condition:
+                    wait = self._getWait(kind, time.time())
+                    if wait == 0:
+                        self._admit(kind)
+                        return
+                await asyncio.sleep(min(wait, pollInterval) if wait is not None else pollInterval)
+        finally:
+            with self._condition:
+                self.queueDepth -= 1
+
+    # Counts the command as running. Must be called with the _condition held.
+    def _admit(self, kind):
+        if self.rate is not None:
+            self._tokens -= 1
+        self.concurrency += 1
+        self.kindConcurrency[kind] = self.kindConcurrency.get(kind, 0) + 1
+
+    # Records the outcome of a command admitted by Acquire() and adapts the concurrency limit.
+    def Release(self, kind, seconds, isSuccess):
+        with self._condition:
+            self.concurrency -= 1
+            self.kindConcurrency[kind] -= 1
+            if isSuccess:
+                self.failureStreak = 0
+                baseline, smoothed = self.latency.get(kind, (seconds, seconds))
+                baseline = min(seconds, baseline * 1.01) # Let the baseline drift up slowly so that it follows a lasting change.
+                smoothed = 0.8 * smoothed + 0.2 * seconds
+                self.latency[kind] = (baseline, smoothed)
+                if smoothed > self.latencyTolerance * max(baseline, 0.01):
+                    self.limit = max(self.minConcurrent, self.limit * 0.9)
+                else:
+                    self.limit = min(self.maxConcurrent, self.limit + 1.0 / self.limit)
+            else:
+                self.failureStreak += 1
+                self.limit = max(self.minConcurrent, self.limit / 2)
+                self._pausedUntil = max(self._pausedUntil, time.time() + self.GetBackoff(self.failureStreak - 1))
+            self._condition.notify_all()
+
+    # Runs the function, which runs a command of the given kind, once it is admitted and returns its result. The isSuccess
+    # function tells whether the result is a success.
+    def Run(self, kind, function, isSuccess):
+        self.Acquire(kind)
+        startTime = time.time()
+        succeeded = False
+        try:
+            result = function()
+            succeeded = isSuccess(result)
+        finally:
+            self.Release(kind, seconds=(time.time() - startTime), isSuccess=succeeded)
+        return result
+
+    def GetStats(self):
+        with self._condition:
+            kinds = {}
+            for kind in set(self.kindConcurrency.keys()) | set(self.kindLimits.keys()) | set(self.latency.keys()):
+                baseline, smoothed = self.latency.get(kind, (None, None))
+                kinds[kind] = { 'concurrency': self.kindConcurrency.get(kind, 0), 'limit': self.kindLimits.get(kind), 'latency': smoothed, 'baseline': baseline }
+            return { 'concurrency': self.concurrency, 'queueDepth': self.queueDepth, 'limit': int(self.limit), 'failureStreak': self.failureStreak, 'kinds': kinds }
+
+class AccuRevClient(object):
+    sharedKinds = [ 'hist', 'diff', 'show', 'anc', 'cat', 'info' ] # The read-only commands which are run once for all of the identical concurrent requests.
+    chunkSize = 64 * 1024        # The size of the chunks in which the standard output is read.
+    spoolSize = 8 * 1024 * 1024  # The standard output is kept in memory up to this size and is spooled to a temporary file beyond it.
+
+    # If the commandCacheFilename is None the module level command cache (see ext.enable_command_cache()) is used and if the
+    # governor is None the module level CommandGovernor (see ext.enable_governor()), if any, is used.
+    def __init__(self, commandCacheFilename=None, governor=None):
+        self.commandCacheFilename = commandCacheFilename
+        self.governor = governor
+
+    def _getGovernor(self):
+        if self.governor is not None:
+            return self.governor
+        return raw._governor
+
+    def _cacheFilename(self):
+        if self.commandCacheFilename is not None:
+            return self.commandCacheFilename
+        return raw._commandCacheFilename
+
+    # Returns the cached CommandResult of the command or None if it isn't cached.
+    def _getCached(self, cmd):
+        commandCacheFilename = self._cacheFilename()
+        if commandCacheFilename is not None:
+            startTime = time.time()
+            with raw.CommandCache(commandCacheFilename) as cc:
+                row = cc.Get(cmd=cmd)
+                if row is not None:
+                    # Cache hit!
+                    cachedCmd, returncode, output, error = row
+                    return CommandResult(cmd=cmd, returncode=returncode, stdout=output, stderr=error, seconds=(time.time() - startTime), isCached=True)
+        return None
+
+    def _setCached(self, result):
+        commandCacheFilename = self._cacheFilename()
+        if commandCacheFilename is not None:
+            with raw.CommandCache(commandCacheFilename) as cc:
+                cc.Update(cmd=result.cmd, result=result.returncode, stdout=result.stdout, stderr=result.stderr)
+
+    # Returns the CommandResult of a probe answered from the cache or None if it can't be answered from the cache.
+    def _getCachedProbe(self, cmd, marker):
+        commandCacheFilename = self._cacheFilename()
+        if commandCacheFilename is not None:
+            startTime = time.time()
+            with raw.CommandCache(commandCacheFilename) as cc:
+                row = cc.Get(cmd=cmd)
+                if row is not None and CommandGovernor.IsSuccess(cmd, row[1], row[2]):
+                    # Cache hit for the full output!
+                    return CommandResult(cmd=cmd, returncode=row[1], seconds=(time.time() - startTime), isCached=True, value=(marker in row[2]))
+                row = cc.Get(cmd='probe {0} {1}'.format(marker, cmd))
+                if row is not None:
+                    # Cache hit for the probe!
+                    return CommandResult(cmd=cmd, returncode=0, seconds=(time.time() - startTime), isCached=True, value=(row[2] == 'True'))
+        return None
+
+    def _setCachedProbe(self, cmd, marker, found):
+        commandCacheFilename = self._cacheFilename()
+        if commandCacheFilename is not None:
+            with raw.CommandCache(commandCacheFilename) as cc:
+                cc.Update(cmd='probe {0} {1}'.format(marker, cmd), result=0, stdout=str(found))
+
+    # Runs the command and returns its CommandResult. When outputFilename is given the standard output is written to the
+    # file instead of being stored in the result.
+    def run(self, cmd, outputFilename=None, useCache=False):
+        # Try and see if we are able to use the command cache.
+        if outputFilename is None and useCache:
+            result = self._getCached(cmd=cmd)
+            if result is not None:
+                raw._recordResult(result)
+                return result
+
+        key = None
+        if outputFilename is None:
+            key = self._getFlightKey(cmd)
+        result = self._runOnce(key=key, useCache=(useCache and outputFilename is None), runFunction=lambda: self._runGoverned(cmd=cmd, outputFilename=outputFilename), cacheFunction=self._setCached)
+        raw._recordResult(result)
+
+        return result
+
+    # Returns the key on which identical concurrent commands are coalesced or None if the command must always be run.
+    def _getFlightKey(self, cmd, marker=None):
+        if CommandGovernor.GetKind(cmd) not in self.sharedKinds:
+            return None
+        return (self._cacheFilename(), marker, str(cmd))
+
+    # Calls the runFunction, unless an identical command (with the same key) is already running in which case its result is
+    # shared instead, and returns the result. The cacheFunction stores the result in the command cache, once, if any of the
+    # callers asked for it.
+    def _runOnce(self, key, useCache, runFunction, cacheFunction):
+        if key is None:
+            result = runFunction()
+            if useCache:
+                self._cacheResult(cacheFunction, result)
+            return result
+
+        flight, isLeader = raw._singleFlight.Join(key=key, useCache=useCache)
+        if isLeader:
+            try:
+                result = runFunction()
+            except BaseException as e:
+                raw._singleFlight.Land(key)
+                flight.Complete(error=e)
+                raise
+            raw._singleFlight.Land(key)
+            try:
+                if flight.useCache:
+                    self._cacheResult(cacheFunction, result)
+            finally:
+                flight.Complete(result=result)
+        return flight.Wait(isLeader=isLeader)
+
+    # Stores the result with the cacheFunction. The command itself succeeded so a failure to store its result, e.g. because the
+    # command cache database is locked, is only reported.
+    @staticmethod
+    def _cacheResult(cacheFunction, result):
+        try:
+            cacheFunction(result)
+        except sqlite3.Error as e:
+            sys.stderr.write("Failed to store the result of {0} in the command cache. {1}\n".format(result.cmd, e))
+
+    def _runGoverned(self, cmd, outputFilename=None):
+        governor = self._getGovernor()
+        if governor is not None:
+            return governor.Run(CommandGovernor.GetKind(cmd), lambda: self._runProcess(cmd=cmd, outputFilename=outputFilename), isSuccess=lambda r: CommandGovernor.IsSuccess(r.cmd, r.returncode, r.output()))
+        return self._runProcess(cmd=cmd, outputFilename=outputFilename)
+
+    def _runProcess(self, cmd, outputFilename=None):
+        startTime = time.time()
+
+        if outputFilename is not None:
+            with open(outputFilename, "w") as outputFile:
+                accurevCommand = subprocess.Popen(cmd, stdout=outputFile, stderr=subprocess.PIPE, stdin=subprocess.PIPE, universal_newlines=True)
+                output, error = accurevCommand.communicate()
+            result = CommandResult(cmd=cmd, returncode=accurevCommand.returncode, stderr=error, seconds=(time.time() - startTime))
+        else:
+            # The output is read in binary chunks into a file which only spills onto the disk when it gets large. It is decoded
+            # only if it is used as a string, see CommandResult.stdout and CommandResult.output().
+            stdoutFile = tempfile.SpooledTemporaryFile(max_size=self.spoolSize, mode='w+b')
+            with tempfile.TemporaryFile(mode='w+b') as errorFile:
+                accurevCommand = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errorFile, stdin=subprocess.PIPE)
+                accurevCommand.stdin.close()
+                for chunk in iter(lambda: accurevCommand.stdout.read(self.chunkSize), b''):
+                    stdoutFile.write(chunk)
+                accurevCommand.stdout.close()
+                accurevCommand.wait()
+                errorFile.seek(0)
+                error = _decodeOutput(errorFile.read())
+            result = CommandResult(cmd=cmd, returncode=accurevCommand.returncode, stderr=error, seconds=(time.time() - startTime), stdoutFile=stdoutFile)
+
+        return result
+
+    # Runs the command and reads its output incrementally until the marker is found at which point the command is terminated.
+    # The value of the returned result is True if the marker was found, False if the command completed successfully without
+    # printing it and None if the command failed. The boolean value is stored in the command cache (if enabled) so that it can
+    # be answered without a server round-trip next time. A cached full output of the same command is also used to answer the probe.
+    def probe(self, cmd, marker, useCache=False):
+        if useCache:
+            result = self._getCachedProbe(cmd=cmd, marker=marker)
+            if result is not None:
+                raw._recordResult(result)
+                return result
+
+        result = self._runOnce(key=self._getFlightKey(cmd, marker=marker), useCache=useCache, runFunction=lambda: self._probeGoverned(cmd=cmd, marker=marker), cacheFunction=lambda r: self._setCachedProbe(cmd=cmd, marker=marker, found=r.value) if r.value is not None else None)
+        raw._recordResult(result)
+
+        return result
+
+    def _probeGoverned(self, cmd, marker):
+        governor = self._getGovernor()
+        if governor is not None:
+            return governor.Run(CommandGovernor.GetProbeKind(cmd), lambda: self._probeProcess(cmd=cmd, marker=marker), isSuccess=lambda r: r.value is not None)
+        return self._probeProcess(cmd=cmd, marker=marker)
+
+    # Returns the CommandResult of the probe, see probe().
+    def _probeProcess(self, cmd, marker):
+        startTime = time.time()
+        found = False
+        with tempfile.TemporaryFile(mode='w+') as errorFile:
+            accurevCommand = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errorFile, stdin=subprocess.PIPE, universal_newlines=True)
+            tail = ''
+            for line in accurevCommand.stdout:
+                if marker in tail + line:
+                    found = True
+                    break
+                tail = line[-len(marker):]
+            if found:
+                accurevCommand.kill()
+            accurevCommand.stdout.close()
+            accurevCommand.wait()
+            errorFile.seek(0)
+            error = errorFile.read()
+
+        result = CommandResult(cmd=cmd, returncode=accurevCommand.returncode, stderr=error, seconds=(time.time() - startTime), value=found)
+        if not found and not CommandGovernor.IsSuccess(cmd, accurevCommand.returncode):
+            result.value = None
+
+        return result
+
+    # Calls any of the module level, raw or ext functions so that the commands it runs go through this client. Returns the
+    # CommandResult of the last command that the function ran with its value set to what the function returned. The results
+    # of all of the commands that were run are available in the results attribute of the returned object.
+    # Note: commands which the function runs on other threads (e.g. ext.parallel_pop) use the default client.
+    def call(self, function, *args, **kwargs):
+        previousClient = getattr(raw._local, 'client', None)
+        previousResults = getattr(raw._local, 'results', None)
+        results = []
+        raw._local.client = self
+        raw._local.results = results
+        try:
+            value = function(*args, **kwargs)
+        finally:
+            raw._local.client = previousClient
+            raw._local.results = previousResults
+            if previousResults is not None:
+                previousResults.extend(results)
+
+        if len(results) > 0:
+            result = results[-1]
+        else:
+            result = CommandResult(cmd=None, seconds=0)
+        result.value = value
+        result.results = results
+        return result
+
+    def info(self, **kwargs):
+        return self.call(info, **kwargs)
+
+    def stat(self, **kwargs):
+        return self.call(stat, **kwargs)
+
+    def hist(self, **kwargs):
+        return self.call(hist, **kwargs)
+
+    def diff(self, **kwargs):
+        return self.call(diff, **kwargs)
+
+    def diff_probe(self, **kwargs):
+        return self.call(diff_probe, **kwargs)
+
+    def pop(self, **kwargs):
+        return self.call(pop, **kwargs)
+
+    def cat(self, **kwargs):
+        return self.call(cat, **kwargs)
+
+    def update(self, **kwargs):
+        return self.call(update, **kwargs)
+
+    def chws(self, workspace, **kwargs):
+        return self.call(chws, workspace, **kwargs)
+
+    def show_streams(self, **kwargs):
+        return self.call(show.streams, **kwargs)
+
+    def show_depots(self):
+        return self.call(show.depots)
+
+    def replica_sync(self):
+        return self.call(replica.sync)
+
+# Raised by the _CommandRecorder to stop the function that built the command before it is run.
+class _CommandCaptured(Exception):
+    def __init__(self, cmd, outputFilename=None, useCache=False, marker=None):
+        super(_CommandCaptured, self).__init__(cmd)
+        self.cmd = cmd
+        self.outputFilename = outputFilename
+        self.useCache = useCache
+        self.marker = marker
+
+# Stands in for the AccuRevClient of the current thread so that the command which a function would run can be captured
+# and run some other way, see AsyncAccuRevClient.
+class _CommandRecorder(object):
+    def run(self, cmd, outputFilename=None, useCache=False):
+        raise _CommandCaptured(cmd=cmd, outputFilename=outputFilename, useCache=useCache)
+
+    def probe(self, cmd, marker, useCache=False):
+        raise _CommandCaptured(cmd=cmd, useCache=useCache, marker=marker)
+
+# Returns the _CommandCaptured for the first accurev command that the function would run, without running it.
+def _captureCommand(function, *args, **kwargs):
+    previousClient = getattr(raw._local, 'client', None)
+    raw._local.client = _CommandRecorder()
+    try:
+        function(*args, **kwargs)
+    except _CommandCaptured as captured:
+        return captured
+    finally:
+        raw._local.client = previousClient
+    raise Exception("{0}() didn't run an accurev command.".format(function.__name__))
+
+# Decodes the output of a command the same way that subprocess.Popen(universal_newlines=True) does.
+def _decodeOutput(data):
+    if data is None:
+        return None
+    return io.TextIOWrapper(io.BytesIO(data)).read()
+
+# Runs the accurev commands as asyncio subprocesses so that many of them can be in flight without a thread each. At most
+# maxConcurrent commands are run at the same time, the rest wait for their turn. The command cache is shared with the
+# AccuRevClient. The async methods must be awaited from a running event loop.
+class AsyncAccuRevClient(AccuRevClient):
+    def __init__(self, maxConcurrent=16, commandCacheFilename=None, governor=None):
+        super(AsyncAccuRevClient, self).__init__(commandCacheFilename=commandCacheFilename, governor=governor)
+        self.maxConcurrent = maxConcurrent
+        self._semaphore = None
+        self._semaphoreLoop = None
+
+    # An asyncio.Semaphore can only be used by the event loop that it was first used with.
+    def _getSemaphore(self):
+        loop = asyncio.get_event_loop()
+        if self._semaphore is None or self._semaphoreLoop is not loop:
+            self._semaphore = asyncio.Semaphore(self.maxConcurrent)
+            self._semaphoreLoop = loop
+        return self._semaphore
+
+    # Waits, without blocking the event loop, until the governor (if any) admits the command.
+    async def _asyncAcquire(self, governor, kind):
+        if governor is not None:
+            await governor.AsyncAcquire(kind)
+
+    # See AccuRevClient.run().
+    async def async_run(self, cmd, outputFilename=None, useCache=False):
+        if outputFilename is None and useCache:
+            result = self._getCached(cmd=cmd)
+            if result is not None:
+                return result
+
+        governor = self._getGovernor()
+        kind = CommandGovernor.GetKind(cmd)
+        async with self._getSemaphore():
+            await self._asyncAcquire(governor, kind)
+            startTime = time.time()
+            returncode = None
+            isSuccess = False
+            try:
+                if outputFilename is not None:
+                    with open(outputFilename, "w") as outputFile:
+                        process = await asyncio.create_subprocess_exec(*cmd, stdout=outputFile, stderr=asyncio.subprocess.PIPE, stdin=asyncio.subprocess.PIPE)
+                        output, error = await process.communicate()
+                else:
+                    process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, stdin=asyncio.subprocess.PIPE)
+                    output, error = await process.communicate()
+                returncode = process.returncode
+                isSuccess = CommandGovernor.IsSuccess(cmd, returncode, output)
+            finally:
+                if governor is not None:
+                    governor.Release(kind, seconds=(time.time() - startTime), isSuccess=isSuccess)
+
+        stdoutFile = io.BytesIO(output) if output is not None else None
+        result = CommandResult(cmd=cmd, returncode=returncode, stderr=_decodeOutput(error), seconds=(time.time() - startTime), stdoutFile=stdoutFile)
+
+        if outputFilename is None and useCache:
+            self._setCached(result)
+
+        return result
+
+    # See AccuRevClient.probe().
+    async def async_probe(self, cmd, marker, useCache=False):
+        if useCache:
+            result = self._getCachedProbe(cmd=cmd, marker=marker)
+            if result is not None:
+                return result
+
+        governor = self._getGovernor()
+        kind = CommandGovernor.GetProbeKind(cmd)
+        async with self._getSemaphore():
+            await self._asyncAcquire(governor, kind)
+            startTime = time.time()
+            found = False
+            isSuccess = False
+            try:
+                with tempfile.TemporaryFile(mode='w+') as errorFile:
+                    process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=errorFile, stdin=asyncio.subprocess.PIPE)
+                    tail = ''
+                    while True:
+                        line = _decodeOutput(await process.stdout.readline())
+                        if len(line) == 0:
+                            break
+                        if marker in tail + line:
+                            found = True
+                            break
+                        tail = line[-len(marker):]
+                    if found:
+                        process.kill()
+                    await process.wait()
+                    errorFile.seek(0)
+                    error = errorFile.read()
+                isSuccess = found or CommandGovernor.IsSuccess(cmd, process.returncode)
+            finally:
+                if governor is not None:
+                    governor.Release(kind, seconds=(time.time() - startTime), isSuccess=isSuccess)
+
+        result = CommandResult(cmd=cmd, returncode=process.returncode, stderr=error, seconds=(time.time() - startTime), value=found)
+
+        if not found and not CommandGovernor.IsSuccess(cmd, process.returncode):
+            result.value = None
+            return result
+
+        if useCache:
+            self._setCachedProbe(cmd=cmd, marker=marker, found=found)
+
+        return result
+
+    # Builds the command that the function would run, runs it asynchronously and returns its CommandResult with the value set
+    # to parser(stdout), or to the probe result for probing functions. Only functions that run a single command are supported.
+    async def async_call(self, function, parser, *args, **kwargs):
+        captured = _captureCommand(function, *args, **kwargs)
+        if captured.marker is not None:
+            return await self.async_probe(cmd=captured.cmd, marker=captured.marker, useCache=captured.useCache)
+
+        result = await self.async_run(cmd=captured.cmd, outputFilename=captured.outputFilename, useCache=captured.useCache)
+        if captured.outputFilename is None and parser is not None:
+            result.value = parser(result.output())
+        return result
+
+    async def async_hist(self, **kwargs):
+        return await self.async_call(hist, obj.History.fromxmlstring, **kwargs)
+
+    async def async_diff(self, **kwargs):
+        return await self.async_call(diff, obj.Diff.fromxmlstring, **kwargs)
+
+    async def async_diff_probe(self, **kwargs):
+        return await self.async_call(diff_probe, None, **kwargs)
+
+    async def async_pop(self, **kwargs):
+        return await self.async_call(pop, obj.Pop.fromxmlstring, **kwargs)
+
+# Asynchronous counterparts of hist(), diff(), diff_probe() and pop(). They take the same arguments and return the same
+# values but must be awaited. The commands are run by a shared AsyncAccuRevClient, see ext.set_async_limit().
+async def async_hist(**kwargs):
+    return (await raw._asyncClient().async_hist(**kwargs)).value
+
+async def async_diff(**kwargs):
+    return (await raw._asyncClient().async_diff(**kwargs)).value
+
+async def async_diff_probe(**kwargs):
+    return (await raw._asyncClient().async_diff_probe(**kwargs)).value
+
+async def async_pop(**kwargs):
+    return (await raw._asyncClient().async_pop(**kwargs)).value
+
 # ################################################################################################ #
 # AccuRev Command Extensions                                                                       #
 # ################################################################################################ #
@@ -2085,10 +3273,58 @@ class ext(object):
     def disable_command_cache():
         raw._commandCacheFilename = None
 
+    # Enables the CommandGovernor, which is shared by all of the clients that don't have their own, and returns it. See the
+    # CommandGovernor for the arguments.
+    @staticmethod
+    def enable_governor(**kwargs):
+        raw._governor = CommandGovernor(**kwargs)
+        return raw._governor
+
+    @staticmethod
+    def disable_governor():
+        raw._governor = None
+
+    # Returns the enabled CommandGovernor or None.
+    @staticmethod
+    def get_governor():
+        return raw._governor
+
+    # Waits before the retry which follows the given number of failed attempts, no wait is needed before the first attempt.
+    # The exponential backoff with jitter of the enabled CommandGovernor is used, or the defaults of a CommandGovernor if it
+    # isn't enabled, so that retries of failed commands don't pile onto a busy server.
+    @staticmethod
+    def backoff(attempt):
+        if attempt > 0:
+            governor = raw._governor if raw._governor is not None else CommandGovernor()
+            time.sleep(governor.GetBackoff(attempt - 1))
+
+    # Forwards the hist, show streams, deep_hist, affected_streams and stream_info calls to the query service (`accurev.py serve`)
+    # at the given url. Calls that the service can't answer are run locally. Returns the QueryServiceClient.
+    @staticmethod
+    def use_query_service(url, timeout=None):
+        raw._queryService = QueryServiceClient(url=url, timeout=timeout)
+        return raw._queryService
+
+    @staticmethod
+    def disable_query_service():
+        raw._queryService = None
+
+    # Returns the QueryServiceClient in use or None.
+    @staticmethod
+    def get_query_service():
+        return raw._queryService
+
+    # Sets the maximum number of accurev commands that the async_*() functions run at the same time.
+    @staticmethod
+    def set_async_limit(maxConcurrent):
+        raw._asyncClient().maxConcurrent = maxConcurrent
+        raw._asyncClient()._semaphore = None
+
     # Get the last chstream transaction. If no chstream transactions have been made the mkstream
     # transaction is returned. If no mkstream transaction exists None is returned.
     # returns obj.Transaction
     @staticmethod
+    @_served('stream_info')
     def stream_info(stream, transaction):
         # As of AccuRev 4.7.2, the data stored in the database by the mkstream command includes the stream-ID. 
         # Streams and workspaces created after installing 4.7.2 will display this additional stream information 
@@ -2146,6 +3382,106 @@ class ext(object):
 
         return parentObjects
 
+    # A local index from the time of a transaction to its number for a depot. It is used to resolve date based time-specs and
+    # timelocks without asking the accurev server. The index only grows, since transactions are never removed from a depot,
+    # and it is stored in the command cache database when the command cache is enabled (see enable_command_cache()).
+    class TransactionTimeIndex(object):
+        createTableQuery = '''
+CREATE TABLE IF NOT EXISTS transaction_time_index (
+  depot TEXT NOT NULL,
+  id    INT NOT NULL,
+  time  INT NOT NULL,
+  PRIMARY KEY (depot, id)
+);
+'''
+        refreshChunkSize = 10000 # The most transactions that are fetched by a single hist command.
+
+        def __init__(self, depot, filepath=None):
+            self.depot    = depot
+            self.filepath = filepath
+            self.ids      = []
+            self.times    = [] # The running maximum of the transaction times so that the list can be bisected.
+            self.lock     = threading.Lock()
+            self.Load()
+
+        def Load(self):
+            if self.filepath is not None:
+                connection = sqlite3.connect(self.filepath)
+                try:
+                    connection.execute(ext.TransactionTimeIndex.createTableQuery)
+                    rows = connection.execute('SELECT id, time FROM transaction_time_index WHERE depot = ? ORDER BY id;', (self.depot,)).fetchall()
+                finally:
+                    connection.close()
+                self._Append(rows)
+
+        def _Append(self, rows):
+            for id, trTime in rows:
+                if len(self.ids) > 0:
+                    if id <= self.ids[-1]:
+                        continue
+                    trTime = max(trTime, self.times[-1])
+                self.ids.append(id)
+                self.times.append(trTime)
+
+        # Fetches the transactions that were made since the index was last updated, refreshChunkSize transactions per hist command, and
+        # stores each chunk as soon as it is fetched so that an interrupted refresh resumes where it stopped. If untilTimestamp is given
+        # the refresh stops once the index has a transaction made after it. Returns False if accurev failed.
+        def Refresh(self, untilTimestamp=None):
+            highest = hist(depot=self.depot, timeSpec='highest', transactionMode=True)
+            if highest is None or len(highest.transactions) == 0:
+                return False
+            highestId = highest.transactions[0].id
+            lastId = self.ids[-1] if len(self.ids) > 0 else 0
+
+            while lastId < highestId:
+                if untilTimestamp is not None and len(self.times) > 0 and self.times[-1] > untilTimestamp:
+                    break
+                chunkEndId = min(highestId, lastId + self.refreshChunkSize)
+                history = hist(depot=self.depot, timeSpec='{0}-{1}'.format(lastId + 1, chunkEndId), transactionMode=True)
+                if history is None:
+                    return False
+                rows = sorted([ (tr.id, int(GetTimestamp(tr.time))) for tr in history.transactions ])
+                self._Append(rows)
+                self._Store(rows)
+                lastId = chunkEndId
+            return True
+
+        def _Store(self, rows):
+            if self.filepath is not None and len(rows) > 0:
+                connection = sqlite3.connect(self.filepath)
+                try:
+                    connection.execute(ext.TransactionTimeIndex.createTableQuery)
+                    connection.executemany('INSERT OR IGNORE INTO transaction_time_index (depot, id, time) VALUES (?, ?, ?);', [ (self.depot, id, trTime) for id, trTime in rows ])
+                    connection.commit()
+                finally:
+                    connection.close()
+
+        # Returns the number of the last transaction that was made at or before the given UTC timestamp, like `accurev hist -t <time>.1`
+        # would, or None if there isn't one. The server is only asked for the transactions made since the last update of the index and
+        # only if the timestamp is later than the last transaction in the index.
+        def TransactionAt(self, timestamp):
+            with self.lock:
+                if len(self.times) == 0 or timestamp >= self.times[-1]:
+                    self.Refresh(untilTimestamp=timestamp)
+                index = bisect.bisect_right(self.times, timestamp) - 1
+                if index < 0:
+                    return None
+                return self.ids[index]
+
+    _transactionTimeIndexes = {}
+    _transactionTimeIndexesLock = threading.Lock()
+
+    @staticmethod
+    # Returns the ext.TransactionTimeIndex for the depot. The index is shared by all callers in this process.
+    def transaction_time_index(depot):
+        with ext._transactionTimeIndexesLock:
+            key = (depot, raw._commandCacheFilename)
+            index = ext._transactionTimeIndexes.get(key)
+            if index is None:
+                index = ext.TransactionTimeIndex(depot=depot, filepath=raw._commandCacheFilename)
+                ext._transactionTimeIndexes[key] = index
+            return index
+
     @staticmethod
     def normalize_timespec(depot, timeSpec):
         if isinstance(timeSpec, obj.TimeSpec):
@@ -2160,10 +3496,11 @@ class ext(object):
         #   1. Change the accurev keywords (e.g. highest, now) and dates into transaction numbers:
         #      Note: The keywords highest/now are translated w.r.t. the depot and not the stream.
         #            Otherwise we might miss later promotes to parent streams...
+        #      Note: Dates are resolved using the local transaction time index (see ext.TransactionTimeIndex).
         if not isinstance(ts.start, int):
-            ts.start = hist(depot=depot, timeSpec=ts.start).transactions[0].id
-        if not isinstance(ts.end, int):
-            ts.end = hist(depot=depot, timeSpec=ts.end).transactions[0].id
+            ts.start = ext._timespec_part_to_transaction(depot=depot, timeSpecPart=ts.start)
+        if ts.end is not None and not isinstance(ts.end, int):
+            ts.end = ext._timespec_part_to_transaction(depot=depot, timeSpecPart=ts.end)
         #   2. If there is a limit set on the number of transactions convert it into a start and end without a limit...
         if ts.limit is not None:
             if ts.end is None or abs(ts.end - ts.start + 1) > ts.limit:
@@ -2177,6 +3514,15 @@ class ext(object):
 
         return ts
 
+    @staticmethod
+    def _timespec_part_to_transaction(depot, timeSpecPart):
+        if isinstance(timeSpecPart, datetime.datetime):
+            # The dates in time-specs are in local time, like they are for the accurev commands.
+            trNumber = ext.transaction_time_index(depot).TransactionAt(time.mktime(timeSpecPart.timetuple()))
+            if trNumber is not None:
+                return trNumber
+        return hist(depot=depot, timeSpec=timeSpecPart, transactionMode=True).transactions[0].id
+
     @staticmethod
     def restrict_timespec_to_timelock(depot=None, timeSpec=None, timelock=None):
         if timeSpec is not None and timelock is not None:
@@ -2206,35 +3552,126 @@ class ext(object):
                         # Make descending
                         timeSpec = timeSpec.reversed()
                     # Get the transaction number at the given time.
-                    preLockTr = hist(depot=depot, timeSpec=UTCDateTimeOrNone(timelock)).transactions[0]
-                    if timeSpec.start > preLockTr.id + 1:
+                    preLockTrId = ext.transaction_time_index(depot).TransactionAt(timelock)
+                    if preLockTrId is None:
+                        return None # There were no transactions before the timelock.
+                    if timeSpec.start > preLockTrId + 1:
                         return None
-                    elif timeSpec.end > preLockTr.id:
-                        timeSpec.end = preLockTr.id
+                    elif timeSpec.end > preLockTrId:
+                        timeSpec.end = preLockTrId
 
                     if not isAsc:
                         timeSpec = timeSpec.reversed()
 
         return timeSpec
 
+    # Returns a list of the top-level element locations (e.g. ['dir1', 'file1']) of the stream at the given transaction, or
+    # None if the accurev stat command failed.
     @staticmethod
+    def top_level_elements(stream, timeSpec):
+        status = stat(stream=stream, timeSpec=timeSpec, elementList='/./*')
+        if status is None or status.elements is None:
+            return None
+
+        rv = []
+        for element in status.elements:
+            if element is not None and element.location is not None:
+                location = element.location.replace('\\', '/')
+                if location.startswith('/./'):
+                    location = location[3:]
+                if len(location) > 0 and location != '.':
+                    rv.append(location)
+        return rv
+
+    # Populates the stream at the given time-spec by splitting its top-level elements into `jobs` disjoint groups and running
+    # one `accurev pop -R` command per group concurrently. The results are merged into a single obj.Pop object.
+    # If the elementList is given then it is split up instead of the stream's top-level elements.
+    # Each of the top-level elements is checked to exist in the location after the populate and if any of them is missing,
+    # or if any of the populate commands failed, the returned obj.Pop will evaluate to False.
+    # If the top-level elements can't be determined (the stat of '/./*' failed or listed nothing) a single recursive populate of
+    # the whole stream is run instead. Returns None if any of the populate commands produced no output.
+    # The populate commands are run from a thread pool, which relies on the results of the commands being kept per thread (see
+    # raw._lastResult() and AccuRevClient).
+    @staticmethod
+    def parallel_pop(verSpec, location, timeSpec, jobs=4, isOverride=False, elementList=None):
+        if elementList is not None:
+            topLevel = [ e[3:] if e.startswith('/./') else e for e in elementList ]
+        else:
+            topLevel = ext.top_level_elements(stream=verSpec, timeSpec=timeSpec)
+        if topLevel is None or len(topLevel) == 0 or jobs <= 1:
+            return pop(isRecursive=True, isOverride=isOverride, verSpec=verSpec, location=location, timeSpec=timeSpec, elementList=(elementList if elementList is not None else '.'))
+
+        groups = [ [] for i in range(0, min(jobs, len(topLevel))) ]
+        for i, element in enumerate(sorted(topLevel)):
+            groups[i % len(groups)].append(element)
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+            futures = [ executor.submit(pop, isRecursive=True, isOverride=isOverride, verSpec=verSpec, location=location, timeSpec=timeSpec, elementList=group) for group in groups ]
+            results = [ f.result() for f in futures ]
+
+        messages = []
+        elements = []
+        for result in results:
+            if result is None:
+                return None
+            if result.messages is not None:
+                messages.extend(result.messages)
+            if result.elements is not None:
+                elements.extend(result.elements)
+
+        # Check that every one of the expected top-level elements made it into the location.
+        missing = [ element for element in topLevel if not os.path.lexists(os.path.join(location, element)) ]
+        for element in missing:
+            messages.append(obj.Pop.Message(text='Top-level element {0} is missing after the parallel populate ({1} of {2} present).'.format(element, len(topLevel) - len(missing), len(topLevel)), error='true'))
+
+        return obj.Pop(messages=messages, elements=elements)
+
+    @staticmethod
+    @_served('deep_hist')
     # Retrieves a list of _all transactions_ which affect the given stream, directly or indirectly (via parent promotes).
-    # Returns a list of obj.Transaction(object) types.
-    def deep_hist(depot=None, stream=None, timeSpec='now', ignoreTimelocks=True):
-        # Validate arguments
-        # ==================
+    # Returns an obj.TransactionList of obj.Transaction(object) types.
+    # If transactionsOnly is set the hist commands are run in transaction mode (`accurev hist -ft`) and the returned transactions
+    # have no versions. Only use it when the id, type, time, user and comment of the transactions are all that you need.
+    def deep_hist(depot=None, stream=None, timeSpec='now', ignoreTimelocks=False, transactionsOnly=False):
         if stream is None:
             # When the stream is not specified then we just want all the depot transactions for the given time-spec.
-            return hist(depot=depot, timeSpec=timeSpec)
+            history = hist(depot=depot, timeSpec=timeSpec, transactionMode=transactionsOnly)
+            if history is None:
+                return None
+            return obj.TransactionList(history.transactions)
 
-        if isinstance(timeSpec, obj.TimeSpec):
-            ts = timeSpec
-        elif isinstance(timeSpec, str):
-            ts = obj.TimeSpec.fromstring(timeSpec)
-        else:
+        depot, ts, isAsc = ext._deep_hist_timespec(depot=depot, stream=stream, timeSpec=timeSpec)
+        return obj.TransactionList(ext._iter_deep_hist(depot=depot, stream=stream, timeSpec=ts, ignoreTimelocks=ignoreTimelocks, transactionsOnly=transactionsOnly), isAsc=isAsc)
+
+    @staticmethod
+    @_served('deep_hist', transform=lambda transactions: iter(sorted(transactions, key=lambda tr: tr.id) if transactions is not None else []))
+    # The generator form of deep_hist(). Yields the same transactions, always in ascending order, as they become available.
+    # The history of each stream in the hierarchy is merged lazily with the histories of its parents so the first transactions
+    # are returned before the parents' histories for the later parts of the time-spec are even requested.
+    def iter_deep_hist(depot=None, stream=None, timeSpec='now', ignoreTimelocks=False, transactionsOnly=False):
+        if stream is None:
+            history = hist(depot=depot, timeSpec=timeSpec, transactionMode=transactionsOnly)
+            if history is not None:
+                for tr in sorted(history.transactions, key=lambda tr: tr.id):
+                    yield tr
+            return
+
+        depot, ts, isAsc = ext._deep_hist_timespec(depot=depot, stream=stream, timeSpec=timeSpec)
+        for tr in ext._iter_deep_hist(depot=depot, stream=stream, timeSpec=ts, ignoreTimelocks=ignoreTimelocks, transactionsOnly=transactionsOnly):
+            yield tr
+
+    @staticmethod
+    # Returns the (depot, timeSpec, isAsc) tuple where the timeSpec is the normalized and ascending form of the given one.
+    def _deep_hist_timespec(depot, stream, timeSpec):
+        # Validate arguments
+        # ==================
+        if not isinstance(timeSpec, obj.TimeSpec) and not isinstance(timeSpec, str):
             raise Exception("Unrecognized time-spec type {0}".format(type(timeSpec)))
 
         streamInfo = show.streams(stream=stream).streams[0]
+        if depot is None:
+            depot = streamInfo.depotName
 
         # Normalize the timeSpec
         # ======================
@@ -2245,11 +3682,21 @@ class ext(object):
         if not isAsc:
             # Make descending
             ts = ts.reversed()
+
+        return (depot, ts, isAsc)
+
+    @staticmethod
+    # Yields the transactions which affect the stream in the normalized, ascending timeSpec in ascending order. The stream's own
+    # history is split into time ranges by its chstream transactions and the deep history of the stream's parent for each range
+    # is heap-merged with it. A transaction can appear in more than one of the histories so the duplicates are skipped.
+    def _iter_deep_hist(depot, stream, timeSpec, ignoreTimelocks, transactionsOnly=False):
+        ts = obj.TimeSpec(start=timeSpec.start, end=timeSpec.end)
+
         # Next, we need to ensure that we don't query things before the stream existed.
-        mkstream = hist(stream=stream, transactionKind="mkstream", timeSpec="now")
+        mkstream = hist(stream=stream, transactionKind="mkstream", timeSpec="now", transactionMode=True)
         if len(mkstream.transactions) == 0:
             # the assumption is that the depot name matches the root stream name (for which there is no mkstream transaction)
-            firstTr = hist(depot=depot, timeSpec="1")
+            firstTr = hist(depot=depot, timeSpec="1", transactionMode=True)
             if firstTr is None or len(firstTr.transactions) == 0:
                 raise Exception("Error: assumption that the root stream has the same name as the depot doesn't hold. Aborting...")
             mkstreamTr = firstTr.transactions[0]
@@ -2259,7 +3706,7 @@ class ext(object):
                 raise Exception("There seem to be multiple mkstream transactions for the stream {0}".format(stream))
         if ts.start < mkstreamTr.id:
             if ts.end < mkstreamTr.id:
-                return [] # Nothing to be done here. The stream doesn't exist in the range.
+                return # Nothing to be done here. The stream doesn't exist in the range.
             else:
                 ts.start = mkstreamTr.id
 
@@ -2267,50 +3714,108 @@ class ext(object):
 
         # Perform deep-hist algorithm
         # ===========================
-        # The transaction list that combines all of the transactions which affect this stream.
-        trList = []
-
         # Get the history for the requested stream.
-        history = hist(depot=depot, stream=stream, timeSpec=str(ts))
+        history = hist(depot=depot, stream=stream, timeSpec=str(ts), transactionMode=transactionsOnly)
 
+        # Split the time-spec into the ranges in which the stream had the same parent.
+        parentTsList = []
         prevTr = None
         parentTs = ts
         for tr in history.transactions:
             if tr.Type == "chstream":
                 # Parent stream changed.
                 if prevTr is not None:
-                    parentTs = obj.TimeSpec(start=parentTs.start, end=(tr.id - 1))
-                    streamInfo = show.streams(depot=depot, stream=stream, timeSpec=parentTs.start).streams[0]
-                    parentStream = streamInfo.basis
-                    if parentStream is not None:
-                        timelockTs = parentTs
-                        if not ignoreTimelocks:
-                            timelockTs = ext.restrict_timespec_to_timelock(depot=streamInfo.depotName, timeSpec=parentTs, timelock=streamInfo.time)
-                        if timelockTs is not None: # A None value indicates that the entire timespec is after the timelock.
-                            parentTrList = ext.deep_hist(depot=depot, stream=parentStream, timeSpec=timelockTs, ignoreTimelocks=ignoreTimelocks)
-                            trList.extend(parentTrList)
+                    parentTsList.append(obj.TimeSpec(start=parentTs.start, end=(tr.id - 1)))
                     parentTs = obj.TimeSpec(start=tr.id, end=ts.end)
-
-            trList.append(tr)
             prevTr = tr
+        parentTsList.append(parentTs)
+
+        def parentHistory():
+            # The ranges are consecutive so their histories are already in ascending order one after the other.
+            for parentTs in parentTsList:
+                streamInfo = show.streams(depot=depot, stream=stream, timeSpec=parentTs.start).streams[0]
+                parentStream = streamInfo.basis
+                if parentStream is not None:
+                    timelockTs = parentTs
+                    if not ignoreTimelocks:
+                        timelockTs = ext.restrict_timespec_to_timelock(depot=streamInfo.depotName, timeSpec=parentTs, timelock=streamInfo.time)
+                    if timelockTs is not None: # A None value indicates that the entire timespec is after the timelock.
+                        timelockTs = ext.normalize_timespec(depot=depot, timeSpec=timelockTs)
+                        if not timelockTs.is_asc():
+                            timelockTs = timelockTs.reversed()
+                        for tr in ext._iter_deep_hist(depot=depot, stream=parentStream, timeSpec=timelockTs, ignoreTimelocks=ignoreTimelocks, transactionsOnly=transactionsOnly):
+                            yield tr
+
+        # The index in the tuples only keeps the heap from comparing the transactions themselves.
+        ownHistory = ( (tr.id, 0, tr) for tr in sorted(history.transactions, key=lambda tr: tr.id) )
+        parentHistory = ( (tr.id, 1, tr) for tr in parentHistory() )
+        prevId = None
+        for id, index, tr in heapq.merge(ownHistory, parentHistory):
+            if id != prevId:
+                yield tr
+                prevId = id
+
+    # The stream hierarchy of a depot at some transaction, indexed by the basis stream, for finding the streams that a transaction
+    # into one of them can affect. The hierarchy only changes with the topologyTransactionTypes transactions so the same object
+    # can be used for all of the transactions between two of them.
+    class StreamTopology(object):
+        topologyTransactionTypes = [ 'mkstream', 'chstream', 'mkws', 'chws', 'rmws', 'remove', 'reactivate' ] # The transactions which create, reparent, remove or restore streams and workspaces.
+
+        def __init__(self, streams):
+            self.streams       = {}
+            self.streamNumbers = {}
+            self.children      = {}
+            for stream in streams:
+                self.streams[stream.name] = stream
+                self.streamNumbers[stream.streamNumber] = stream.name
+                self.children.setdefault(stream.basis, []).append(stream.name)
 
-        streamInfo = show.streams(depot=depot, stream=stream, timeSpec=parentTs.start).streams[0]
-        parentStream = streamInfo.basis
-        if parentStream is not None:
-            timelockTs = parentTs
-            if not ignoreTimelocks:
-                timelockTs = ext.restrict_timespec_to_timelock(depot=streamInfo.depotName, timeSpec=parentTs, timelock=streamInfo.time)
-            if timelockTs is not None: # A None value indicates that the entire timespec is after the timelock.
-                parentTrList = ext.deep_hist(depot=depot, stream=parentStream, timeSpec=timelockTs, ignoreTimelocks=ignoreTimelocks)
-                trList.extend(parentTrList)
-
-        rv = sorted(trList, key=lambda tr: tr.id)
-        if not isAsc:
-            rv.reverse()
+        def __repr__(self):
+            str = "StreamTopology(streams=" + repr(list(self.streams.values()))
+            str += ")"
 
-        return rv
+            return str
+
+        @classmethod
+        def fromtransaction(cls, depot, transaction):
+            streamDict = ext.stream_dict(depot=depot, transaction=transaction)
+            if streamDict is None:
+                return None
+            return cls(streamDict.values())
+
+        # Returns the stream name for the given stream name or number or None if it isn't in the topology.
+        def stream_name(self, stream):
+            if stream in self.streams:
+                return stream
+            try:
+                return self.streamNumbers.get(int(stream))
+            except (TypeError, ValueError):
+                return None
+
+        # Returns the list of obj.Stream objects that are affected by a transaction into the given stream which was made at the
+        # transactionTime. The list includes the stream itself.
+        def affected_streams(self, stream, transactionTime=None, includeWorkspaces=True, ignoreTimelocks=True):
+            streamName = self.stream_name(stream)
+            if streamName is None:
+                return []
+
+            rv = [ self.streams[streamName] ]
+            visited = set([ streamName ])
+            index = 0
+            while index < len(rv):
+                for childName in self.children.get(rv[index].name, []):
+                    child = self.streams[childName]
+                    if childName not in visited:
+                        if includeWorkspaces or child.Type.lower() != "workspace":
+                            if ignoreTimelocks or transactionTime is None or child.time is None or child.time >= transactionTime:
+                                visited.add(childName)
+                                rv.append(child)
+                index += 1
+
+            return rv
 
     @staticmethod
+    @_served('affected_streams')
     # Returns a list of streams which are affected by the given transaction.
     # The transaction must be of type obj.Transaction which is obtained from the obj.History.transactions
     # which is returned by the hist() function.
@@ -2324,26 +3829,51 @@ class ext(object):
         destStream = show.streams(depot=depot, timeSpec=transaction.id, stream=destStreamNum).streams[0].name
 
         if destStream is not None:
-            streamMap = ext.stream_dict(depot=depot, transaction=transaction.id)
+            topology = ext.StreamTopology.fromtransaction(depot=depot, transaction=transaction.id)
+            if topology is not None:
+                rv = topology.affected_streams(stream=destStream, transactionTime=transaction.time, includeWorkspaces=includeWorkspaces, ignoreTimelocks=ignoreTimelocks)
+            
+        return rv
 
-            childrenSet = set()
-            newChildrenSet = set()
+    affectedStreamsBatchChunkSize = 10000 # The most transactions that affected_streams_batch() fetches with a single hist command.
 
-            newChildrenSet.add(destStream)
-            while len(newChildrenSet) > 0:
-                childrenSet |= newChildrenSet
-                newChildrenSet = set()
+    @staticmethod
+    @_served('affected_streams_batch')
+    # The batch form of affected_streams(). Returns a list of (transaction, streams) tuples, one for every transaction in the time-spec
+    # in ascending order, where streams is the list of obj.Stream objects that the transaction can affect. If streamNames is given
+    # only the affected streams in it are returned. Returns None if an accurev command failed.
+    # The transactions are fetched affectedStreamsBatchChunkSize at a time, like ext.TransactionTimeIndex.Refresh() does, and the
+    # stream hierarchy is only retrieved again after the transactions that can change it (see ext.StreamTopology).
+    def affected_streams_batch(depot, timeSpec, includeWorkspaces=True, ignoreTimelocks=True, streamNames=None):
+        ts = ext.normalize_timespec(depot=depot, timeSpec=timeSpec)
+        if not ts.is_asc():
+            ts = ts.reversed()
+
+        rv = []
+        topology = None
+        chunkStartId = ts.start
+        while chunkStartId <= ts.end:
+            chunkEndId = min(ts.end, chunkStartId + ext.affectedStreamsBatchChunkSize - 1)
+            history = hist(depot=depot, timeSpec='{0}-{1}'.format(chunkStartId, chunkEndId))
+            if history is None:
+                return None
+
+            for transaction in sorted(history.transactions, key=lambda tr: tr.id):
+                if topology is None or transaction.Type in ext.StreamTopology.topologyTransactionTypes:
+                    topology = ext.StreamTopology.fromtransaction(depot=depot, transaction=transaction.id)
+                    if topology is None:
+                        return None
+
+                destStreamName, destStreamNumber = transaction.affectedStream()
+                destStream = destStreamNumber if destStreamNumber is not None else destStreamName
+                streams = []
+                if destStream is not None:
+                    streams = topology.affected_streams(stream=destStream, transactionTime=transaction.time, includeWorkspaces=includeWorkspaces, ignoreTimelocks=ignoreTimelocks)
+                if streamNames is not None:
+                    streams = [ stream for stream in streams if stream.name in streamNames ]
+                rv.append((transaction, streams))
+            chunkStartId = chunkEndId + 1
 
-                for stream in streamMap:
-                    if streamMap[stream].basis in childrenSet and stream not in childrenSet:
-                        if includeWorkspaces or streamMap[stream].Type.lower() != "workspace":
-                            if ignoreTimelocks or streamMap[stream].time is None or streamMap[stream].time >= transaction.time:
-                                newChildrenSet.add(stream)
-            
-            rv = []
-            for stream in childrenSet:
-                rv.append(streamMap[stream])
-            
         return rv
 
 # ################################################################################################ #
@@ -2353,17 +3883,35 @@ import sys
 import argparse
 
 def clDeepHist(args):
-    transactions = ext.deep_hist(depot=args.depot, stream=args.stream, timeSpec=args.timeSpec, ignoreTimelocks=args.ignoreTimelocks)
-    if transactions is not None and len(transactions) > 0:
-        print("tr. type; destination stream; tr. number; username;")
-        for tr in transactions:
-            print("{Type}; {stream}; {id}; {user};".format(id=tr.id, user=tr.user, Type=tr.Type, stream=tr.affectedStream()[0]))
+    # The transactions are printed as they are found, in ascending order, instead of waiting for the entire deep history.
+    count = 0
+    for tr in ext.iter_deep_hist(depot=args.depot, stream=args.stream, timeSpec=args.timeSpec, ignoreTimelocks=args.ignoreTimelocks, transactionsOnly=args.transactionsOnly):
+        if count == 0:
+            print("tr. type; destination stream; tr. number; username;")
+        print("{Type}; {stream}; {id}; {user};".format(id=tr.id, user=tr.user, Type=tr.Type, stream=tr.affectedStream()[0]))
+        sys.stdout.flush()
+        count += 1
+    if count > 0:
         return 0
     else:
         print("No affected streams")
         return 1
 
 def clAffectedStreams(args):
+    ts = obj.TimeSpec.fromstring(args.transaction)
+    if ts is not None and ts.end is not None:
+        # A range of transactions was given.
+        affected = ext.affected_streams_batch(depot=args.depot, timeSpec=ts, includeWorkspaces=args.includeWorkspaces, ignoreTimelocks=args.ignoreTimelocks)
+        if affected is not None and len(affected) > 0:
+            print("tr. number; stream name; stream id; stream type;")
+            for tr, streams in affected:
+                for s in streams:
+                    print("{trNumber}; {streamName}; {streamId}; {Type};".format(trNumber=tr.id, streamName=s.name, streamId=s.streamNumber, Type=s.Type))
+            return 0
+        else:
+            print("No affected streams")
+            return 1
+
     streams = ext.affected_streams(depot=args.depot, transaction=args.transaction, includeWorkspaces=args.includeWorkspaces, ignoreTimelocks=args.ignoreTimelocks)
     if streams is not None and len(streams) > 0:
         print("stream name; stream id; stream type;")
@@ -2374,6 +3922,18 @@ def clAffectedStreams(args):
         print("No affected streams")
         return 1
 
+def clServe(args):
+    if args.commandCacheFilename is not None:
+        ext.enable_command_cache(args.commandCacheFilename)
+    service = QueryService(host=args.host, port=args.port, maxResults=args.maxResults)
+    print("Serving the accurev queries on http://{0}:{1}/ (Ctrl+C to stop)".format(args.host, args.port))
+    sys.stdout.flush()
+    try:
+        service.Serve()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
 if __name__ == "__main__":
     # Define the argument parser
     argparser = argparse.ArgumentParser(description='Custom extensions to the main accurev command line tool.')
@@ -2387,6 +3947,7 @@ if __name__ == "__main__":
     deepHistParser.add_argument('-s', '--stream',    dest='stream',   help='The accurev stream for which we want to know all the transactions which could have affected it.')
     deepHistParser.add_argument('-t', '--time-spec', dest='timeSpec', required=True, help='The accurev time-spec. e.g. 17-21 or 99.')
     deepHistParser.add_argument('-i', '--ignore-timelocks', dest='ignoreTimelocks', action='store_true', default=False, help='The returned set of transactions will include transactions which occurred in the parent stream before the timelock of the child stream (if any).')
+    deepHistParser.add_argument('-l', '--transactions-only', dest='transactionsOnly', action='store_true', default=False, help='Only request the transaction information from accurev (accurev hist -ft). Faster for large promotes but the destination stream of promotes is not shown.')
 
     deepHistParser.set_defaults(func=clDeepHist)
 
@@ -2395,12 +3956,22 @@ if __name__ == "__main__":
     affectedStreamsParser = subparsers.add_parser('affected-streams', help='Shows all the transactions that could have affected the current stream.')
     affectedStreamsParser.description = 'Shows all the transactions that could have affected the current stream.'
     affectedStreamsParser.add_argument('-p', '--depot',     dest='depot',    required=True, help='The name of the depot in which the transaction occurred')
-    affectedStreamsParser.add_argument('-t', '--transaction', dest='transaction', required=True, help='The accurev transaction number for which we want to know the affected streams.')
+    affectedStreamsParser.add_argument('-t', '--transaction', dest='transaction', required=True, help='The accurev transaction number for which we want to know the affected streams. A transaction range (e.g. 17-21) lists the affected streams of each transaction in it.')
     affectedStreamsParser.add_argument('-w', '--include-workspaces', dest='includeWorkspaces', action='store_true', default=False, help='The returned set of streams will include workspaces if this option is specified.')
     affectedStreamsParser.add_argument('-i', '--ignore-timelocks', dest='ignoreTimelocks', action='store_true', default=False, help='The returned set of streams will include streams whose timelocks would have otherwise prevented this stream from affecting them.')
 
     affectedStreamsParser.set_defaults(func=clAffectedStreams)
 
+    # serve subcommand
+    serveParser = subparsers.add_parser('serve', help='Answers the queries of the ac2git.py converters from a shared process.')
+    serveParser.description = 'Answers the hist, show streams, deep-hist and affected-streams queries of the ac2git.py converters (see their --query-service option) from a single process whose caches stay warm between them.'
+    serveParser.add_argument('--host', dest='host', default='127.0.0.1', help='The address on which the queries are served. Defaults to 127.0.0.1, only the local machine.')
+    serveParser.add_argument('--port', dest='port', type=int, default=8765, help='The port on which the queries are served. Defaults to 8765.')
+    serveParser.add_argument('-c', '--command-cache', dest='commandCacheFilename', help='The sqlite3 database in which the results of the accurev commands are cached across runs.')
+    serveParser.add_argument('--max-results', dest='maxResults', type=int, default=1000, help='The number of query results, for fixed time-specs, which are kept in memory. Defaults to 1000.')
+
+    serveParser.set_defaults(func=clServe)
+
     # Parse the arguments and execute
     args = argparser.parse_args()
 
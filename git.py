@@ -16,6 +16,11 @@ import xml.etree.ElementTree as ElementTree
 import datetime
 import re
 import types
+import threading
+import time
+import tempfile
+import io
+import asyncio
 from math import floor
 
 gitCmd = u'git'
@@ -218,6 +223,12 @@ class GitBranchListItem(object):
             return cls(name=name, shortHash=shortHash, remote=remote, shortComment=comment, isCurrent=isCurrent)
         return None
     
+# Decodes the output of a command the same way that subprocess.Popen(universal_newlines=True) does.
+def _decodeOutput(data):
+    if data is None:
+        return None
+    return io.TextIOWrapper(io.BytesIO(data)).read()
+
 def getDatetimeString(date, timezone=None):
     dateStr = None
     if date is not None:
@@ -247,41 +258,115 @@ def getDatetimeString(date, timezone=None):
     
     return dateStr
 
+# The result of running a git command. Returned by repo.run(), unlike the repo.lastStdout, repo.lastStderr and
+# repo.lastReturnCode attributes it belongs to a single call and can be used when several threads share the repo.
+class GitResult(object):
+    def __init__(self, cmd, returncode=None, stdout=None, stderr=None, seconds=None, stdoutFile=None):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stderr = stderr
+        self.seconds = seconds
+        self.stdoutFile = stdoutFile # The undecoded standard output as a binary file object, if it was captured that way.
+        self._stdout = stdout
+
+    # The standard output as a string. When it was captured into the stdoutFile it is only decoded when it is first used.
+    @property
+    def stdout(self):
+        if self._stdout is None and self.stdoutFile is not None:
+            self.stdoutFile.seek(0)
+            self._stdout = _decodeOutput(self.stdoutFile.read())
+        return self._stdout
+
+    # Returns the standard output as the stdoutFile, rewound, if it was captured into a file, otherwise as the stdout string.
+    def output(self):
+        if self.stdoutFile is not None:
+            self.stdoutFile.seek(0)
+            return self.stdoutFile
+        return self._stdout
+
+    def __repr__(self):
+        return 'GitResult(cmd={0}, returncode={1}, seconds={2})'.format(repr(self.cmd), self.returncode, self.seconds)
+
+    def __bool__(self):
+        return (self.returncode == 0)
+
+    __nonzero__ = __bool__
+
 class repo(object):
+    asyncMaxConcurrent = 16      # The maximum number of commands that async_cmd() runs at the same time, per repo.
+    chunkSize = 64 * 1024        # The size of the chunks in which the standard output is read.
+    spoolSize = 8 * 1024 * 1024  # The standard output is kept in memory up to this size and is spooled to a temporary file beyond it.
+
     def __init__(self, path):
         self.path = path
         self.notes = repo.notes(self)
-        # Debug
-        self.lastStderr = None
-        self.lastStdout = None
-        self.lastReturnCode = None
         # Private
-        self._lastCommand = None
-    
+        self._local = threading.local()
+        self._asyncSemaphore = None
+        self._asyncSemaphoreLoop = None
+
+    # The result of the last command that was run on this repo by the current thread or None.
+    @property
+    def lastResult(self):
+        return getattr(self._local, 'lastResult', None)
+
+    # Debug, kept for compatibility. Prefer the GitResult returned by run() or the lastResult.
+    @property
+    def lastStderr(self):
+        return self.lastResult.stderr if self.lastResult is not None else None
+
+    @property
+    def lastStdout(self):
+        return self.lastResult.stdout if self.lastResult is not None else None
+
+    @property
+    def lastReturnCode(self):
+        return self.lastResult.returncode if self.lastResult is not None else None
+
+    # Runs the command in the repo and returns its GitResult. The repo object holds no other state about the command so it
+    # can be shared by several threads.
+    def run(self, cmd, env=None):
+        startTime = time.time()
+        # The output is read in binary chunks into a file which only spills onto the disk when it gets large. It is decoded
+        # only if it is used as a string, see GitResult.stdout and GitResult.output().
+        stdoutFile = tempfile.SpooledTemporaryFile(max_size=self.spoolSize, mode='w+b')
+        with tempfile.TemporaryFile(mode='w+b') as errorFile:
+            process = subprocess.Popen(args=cmd, cwd=self.path, env=env, stdout=subprocess.PIPE, stderr=errorFile)
+            for chunk in iter(lambda: process.stdout.read(self.chunkSize), b''):
+                stdoutFile.write(chunk)
+            process.stdout.close()
+            process.wait()
+            errorFile.seek(0)
+            error = _decodeOutput(errorFile.read())
+
+        result = GitResult(cmd=cmd, returncode=process.returncode, stderr=error, seconds=(time.time() - startTime), stdoutFile=stdoutFile)
+        self._local.lastResult = result
+
+        return result
+
+    # The asyncio counterpart of run(). Many commands can be awaited at the same time but only asyncMaxConcurrent of them are
+    # run at once. Must be awaited from a running event loop.
+    async def async_cmd(self, cmd, env=None):
+        loop = asyncio.get_event_loop()
+        if self._asyncSemaphore is None or self._asyncSemaphoreLoop is not loop:
+            self._asyncSemaphore = asyncio.Semaphore(self.asyncMaxConcurrent)
+            self._asyncSemaphoreLoop = loop
+
+        async with self._asyncSemaphore:
+            startTime = time.time()
+            process = await asyncio.create_subprocess_exec(*cmd, cwd=self.path, env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            output, error = await process.communicate()
+
+        return GitResult(cmd=cmd, returncode=process.returncode, stderr=_decodeOutput(error), seconds=(time.time() - startTime), stdoutFile=io.BytesIO(output))
+
     def _docmd(self, cmd, env=None):
-        process = subprocess.Popen(args=cmd, cwd=self.path, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-
-        output = ''
-        error  = ''
-        process.poll()
-        while process.returncode is None:
-            stdoutdata, stderrdata = process.communicate()
-            output += stdoutdata
-            error  += stderrdata
-            process.poll()
-        
-        self._lastCommand = process
-        self.lastStderr = error
-        self.lastStdout = output
-        self.lastReturnCode = process.returncode
-
-        if process.returncode == 0:
-            return output
+        result = self.run(cmd=cmd, env=env)
+
+        if result.returncode == 0:
+            return result.stdout
         else:
             return None
 
-
-
     def raw_cmd(self, cmd):
         return self._docmd(cmd)
         
@@ -452,6 +537,36 @@ class repo(object):
         
         return self._docmd(cmd)
 
+    def read_tree(self, treeish, reset=False, update=False):
+        cmd = [ gitCmd, u'read-tree' ]
+
+        if reset:
+            cmd.append(u'--reset')
+        if update:
+            cmd.append(u'-u')
+
+        cmd.append(treeish)
+
+        output = self._docmd(cmd)
+
+        return (output is not None)
+
+    def checkout_index(self, all=False, force=False, fileList=[]):
+        cmd = [ gitCmd, u'checkout-index' ]
+
+        if all:
+            cmd.append(u'-a')
+        if force:
+            cmd.append(u'-f')
+
+        if fileList is not None and len(fileList) > 0:
+            cmd.append(u'--')
+            cmd.extend(fileList)
+
+        output = self._docmd(cmd)
+
+        return (output is not None)
+
     class notes(object):
         def __init__(self, repo):
             self.repo = repo
@@ -0,0 +1,244 @@
+import io
+import sqlite3
+import threading
+import time
+import unittest
+
+import accurev
+
+histXml = '''<?xml version="1.0" encoding="utf-8"?>
+<AcResponse Command="hist" TaskId="7">
+  <transaction id="12" type="promote" time="1400000000" user="bob">
+    <comment>Fixed the build</comment>
+    <version path="/./src/main.c" eid="5" virtual="2/3" real="4/1" virtualNamedVersion="Trunk/3" realNamedVersion="bob_ws/1" elem_type="text" dir="no" />
+    <version path="/./src" eid="2" virtual="2/1" real="4/1" virtualNamedVersion="Trunk/1" realNamedVersion="bob_ws/1" elem_type="dir" dir="yes" />
+  </transaction>
+  <transaction id="13" type="promote" time="1400000100" user="alice">
+    <comment>Updated the readme</comment>
+    <version path="/./README" eid="9" virtual="2/7" real="6/2" virtualNamedVersion="Trunk/7" realNamedVersion="alice_ws/2" elem_type="text" dir="no" />
+  </transaction>
+</AcResponse>'''
+
+streamsXml = '''<?xml version="1.0" encoding="utf-8"?>
+<streams>
+  <stream name="Trunk" depotName="Depot" streamNumber="2" isDynamic="true" type="normal" startTime="1300000000" />
+  <stream name="bob_ws" basis="Trunk" basisStreamNumber="2" depotName="Depot" streamNumber="4" isDynamic="false" type="workspace" time="1400000000" startTime="1300000000" />
+</streams>'''
+
+transactionsOnlyHistXml = '''<?xml version="1.0" encoding="utf-8"?>
+<AcResponse Command="hist" TaskId="8">
+  <transaction id="12" type="promote" time="1400000000" user="bob" streamName="Trunk" streamNumber="2" fromStreamName="bob_ws" fromStreamNumber="4">
+    <comment>Fixed the build</comment>
+  </transaction>
+</AcResponse>'''
+
+class TransactionTest(unittest.TestCase):
+    def test_affected_stream(self):
+        transactions = accurev.obj.History.fromxmlstring(histXml).transactions
+        self.assertEqual(('Trunk', 2), transactions[0].affectedStream())
+        transaction = accurev.obj.History.fromxmlstring(transactionsOnlyHistXml).transactions[0]
+        self.assertEqual([], transaction.versions)
+        self.assertEqual(('Trunk', 2), transaction.affectedStream())
+
+    def test_defaults(self):
+        first = accurev.obj.Transaction(1, 'promote', 1400000000, 'bob', None)
+        second = accurev.obj.Transaction(2, 'promote', 1400000000, 'bob', None)
+        first.moves.append('move')
+        self.assertEqual([], second.moves)
+        self.assertIsNot(first.versions, second.versions)
+
+        first.versions = None
+        self.assertTrue(repr(first).startswith('Transaction(id=1'))
+
+# Checks that the results of the queries answered by `accurev.py serve` are the same once they are sent to the converters.
+class QueryValueTest(unittest.TestCase):
+    def roundTrip(self, value):
+        return accurev._decodeQueryValue(accurev._encodeQueryValue(value))
+
+    def assertSameTransaction(self, expected, actual):
+        self.assertIsInstance(actual, accurev.obj.Transaction)
+        self.assertEqual(repr(expected), repr(actual))
+        self.assertEqual(repr(expected.versions), repr(actual.versions))
+        self.assertEqual(expected.affectedStream(), actual.affectedStream())
+
+    def test_hist(self):
+        history = accurev.obj.History.fromxmlstring(histXml)
+        decoded = self.roundTrip(history)
+        self.assertIsInstance(decoded, accurev.obj.History)
+        self.assertEqual(history.taskId, decoded.taskId)
+        self.assertEqual(len(history.transactions), len(decoded.transactions))
+        for expected, actual in zip(history.transactions, decoded.transactions):
+            self.assertSameTransaction(expected, actual)
+
+    def test_deep_hist(self):
+        transactions = accurev.obj.TransactionList(accurev.obj.History.fromxmlstring(histXml).transactions, isAsc=False)
+        decoded = self.roundTrip(transactions)
+        self.assertIsInstance(decoded, accurev.obj.TransactionList)
+        self.assertEqual(transactions.ids, decoded.ids)
+        self.assertEqual(transactions.isAsc, decoded.isAsc)
+        for expected, actual in zip(transactions, decoded):
+            self.assertSameTransaction(expected, actual)
+
+    def test_affected_streams_batch(self):
+        transactions = accurev.obj.History.fromxmlstring(histXml).transactions
+        streams = accurev.obj.Show.Streams.fromxmlstring(streamsXml).streams
+        batch = [ (transactions[0], streams), (transactions[1], []) ]
+        decoded = self.roundTrip(batch)
+        self.assertEqual(len(batch), len(decoded))
+        for (expectedTr, expectedStreams), (actualTr, actualStreams) in zip(batch, decoded):
+            self.assertSameTransaction(expectedTr, actualTr)
+            self.assertEqual(repr(expectedStreams), repr(actualStreams))
+        self.assertIsInstance(decoded[0][1][1], accurev.obj.Stream)
+
+    def test_unknown_class(self):
+        with self.assertRaises(ValueError):
+            accurev._decodeQueryValue({ '__obj__': 'os.system', 'attributes': {} })
+        with self.assertRaises(TypeError):
+            accurev._encodeQueryValue(object())
+
+# Stands in for the QueryServiceClient and records the queries that are forwarded to it.
+class RecordingQueryService(object):
+    def __init__(self):
+        self.queries = []
+
+    def IsAvailable(self):
+        return True
+
+    def Query(self, name, **kwargs):
+        self.queries.append((name, kwargs))
+        return 'served'
+
+# Checks that each of the functions forwarded to `accurev.py serve` sends the query that the service answers with that function.
+class ServedFunctionTest(unittest.TestCase):
+    def setUp(self):
+        self.service = RecordingQueryService()
+        accurev.raw._queryService = self.service
+
+    def tearDown(self):
+        accurev.raw._queryService = None
+
+    def test_forwarded_queries(self):
+        transaction = accurev.obj.History.fromxmlstring(histXml).transactions[0]
+        calls = [
+            (lambda: accurev.hist(depot='Depot', timeSpec='10-20'),                                 'hist',                   { 'depot': 'Depot', 'timeSpec': '10-20' }),
+            (lambda: accurev.show.streams(depot='Depot', timeSpec=12),                              'show_streams',           { 'depot': 'Depot', 'timeSpec': 12 }),
+            (lambda: accurev.ext.deep_hist(depot='Depot', stream='Trunk', timeSpec='1-5'),          'deep_hist',              { 'depot': 'Depot', 'stream': 'Trunk', 'timeSpec': '1-5' }),
+            (lambda: accurev.ext.affected_streams('Depot', transaction, includeWorkspaces=False),   'affected_streams',       { 'depot': 'Depot', 'transaction': transaction, 'includeWorkspaces': False }),
+            (lambda: accurev.ext.affected_streams_batch(depot='Depot', timeSpec='1-5'),             'affected_streams_batch', { 'depot': 'Depot', 'timeSpec': '1-5' }),
+            (lambda: accurev.ext.stream_info('Trunk', 12),                                          'stream_info',            { 'stream': 'Trunk', 'transaction': 12 })
+        ]
+        for call, name, kwargs in calls:
+            self.service.queries = []
+            self.assertEqual('served', call())
+            self.assertEqual([ (name, kwargs) ], [ (query, dict(arguments)) for query, arguments in self.service.queries ])
+
+        # The served deep history is iterated in ascending order.
+        self.service.Query = lambda name, **kwargs: self.service.queries.append((name, kwargs)) or accurev.obj.TransactionList(accurev.obj.History.fromxmlstring(histXml).transactions, isAsc=False)
+        self.service.queries = []
+        self.assertEqual([ 12, 13 ], [ tr.id for tr in accurev.ext.iter_deep_hist(depot='Depot', stream='Trunk', timeSpec='5-1') ])
+        self.assertEqual([ 'deep_hist' ], [ query for query, arguments in self.service.queries ])
+
+# Checks that the callers which share the result of an identical command being run by another caller get it.
+class SingleFlightTest(unittest.TestCase):
+    def test_waiters_get_the_result_when_the_cache_write_fails(self):
+        client = accurev.AccuRevClient()
+        key = ('test', None, 'accurev hist -t 1-2')
+        running = threading.Event()
+        release = threading.Event()
+        def Run():
+            running.set()
+            release.wait(5)
+            return accurev.CommandResult(cmd=[ 'accurev', 'hist' ], returncode=0, stdout='output')
+        def Cache(result):
+            raise sqlite3.OperationalError('database is locked')
+
+        results = {}
+        def Call(name, runFunction):
+            results[name] = client._runOnce(key=key, useCache=True, runFunction=runFunction, cacheFunction=Cache)
+        leader = threading.Thread(target=Call, args=('leader', Run))
+        leader.daemon = True
+        leader.start()
+        running.wait(5)
+        waiter = threading.Thread(target=Call, args=('waiter', lambda: self.fail('The waiter ran the command.')))
+        waiter.daemon = True
+        waiter.start()
+        time.sleep(0.2) # Let the waiter join the flight.
+        release.set()
+        leader.join(5)
+        waiter.join(5)
+
+        self.assertFalse(leader.is_alive())
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual('output', results['leader'].stdout)
+        self.assertEqual('output', results['waiter'].stdout)
+        self.assertTrue(results['waiter'].isShared)
+
+# Checks that a stream whose top-level elements can't be listed is populated with a single recursive populate.
+class ParallelPopTest(unittest.TestCase):
+    def setUp(self):
+        self.stat, self.pop = accurev.stat, accurev.pop
+        self.pops = []
+        accurev.pop = lambda **kwargs: self.pops.append(kwargs) or accurev.obj.Pop(messages=[], elements=[])
+
+    def tearDown(self):
+        accurev.stat, accurev.pop = self.stat, self.pop
+
+    def test_falls_back_to_a_single_pop(self):
+        for status in [ None, accurev.obj.Stat(taskId=1, directory=None, elements=[]) ]:
+            self.pops = []
+            accurev.stat = lambda **kwargs: status
+            self.assertIsNotNone(accurev.ext.parallel_pop(verSpec='Trunk', location='/tmp/ws', timeSpec=12, jobs=4))
+            self.assertEqual([ '.' ], [ kwargs['elementList'] for kwargs in self.pops ])
+
+class StubTopology(object):
+    def affected_streams(self, stream, transactionTime, includeWorkspaces, ignoreTimelocks):
+        return [ accurev.obj.Stream(name='Trunk', streamNumber=stream, depotName='Depot', Type='normal') ]
+
+# Checks that the transactions of a batch are fetched in bounded chunks and merged in order.
+class AffectedStreamsBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.hist, self.fromtransaction, self.chunkSize = accurev.hist, accurev.ext.StreamTopology.fromtransaction, accurev.ext.affectedStreamsBatchChunkSize
+        self.timeSpecs = []
+        def Hist(depot, timeSpec):
+            self.timeSpecs.append(timeSpec)
+            start, end = [ int(part) for part in timeSpec.split('-') ]
+            transactions = [ accurev.obj.Transaction(id, 'promote', 1400000000, 'bob', None, streamName='Trunk', streamNumber=2) for id in range(end, start - 1, -1) ]
+            return accurev.obj.History(taskId=1, transactions=transactions)
+        accurev.hist = Hist
+        accurev.ext.StreamTopology.fromtransaction = staticmethod(lambda depot, transaction: StubTopology())
+        accurev.ext.affectedStreamsBatchChunkSize = 2
+
+    def tearDown(self):
+        accurev.hist = self.hist
+        accurev.ext.StreamTopology.fromtransaction = staticmethod(self.fromtransaction)
+        accurev.ext.affectedStreamsBatchChunkSize = self.chunkSize
+
+    def test_chunks(self):
+        affected = accurev.ext.affected_streams_batch(depot='Depot', timeSpec='5-1')
+        self.assertEqual([ '1-2', '3-4', '5-5' ], self.timeSpecs)
+        self.assertEqual([ 1, 2, 3, 4, 5 ], [ tr.id for tr, streams in affected ])
+        self.assertEqual([ [ 2 ] ] * 5, [ [ stream.streamNumber for stream in streams ] for tr, streams in affected ])
+
+class CommandGovernorTest(unittest.TestCase):
+    def test_is_success(self):
+        cmd = [ 'accurev', 'diff', '-a' ]
+        self.assertTrue(accurev.CommandGovernor.IsSuccess(cmd, 0, 'not xml'))
+        self.assertTrue(accurev.CommandGovernor.IsSuccess(cmd, 1))
+        self.assertFalse(accurev.CommandGovernor.IsSuccess(cmd, 2, '<AcResponse />'))
+        self.assertFalse(accurev.CommandGovernor.IsSuccess([ 'accurev', 'hist' ], 1, '<AcResponse />'))
+        self.assertFalse(accurev.CommandGovernor.IsSuccess(cmd, 1, 'Stream not found: Trunk'))
+        self.assertFalse(accurev.CommandGovernor.IsSuccess(cmd, 1, ''))
+
+        # Only the start of the output is checked, so a truncated diff is still a success.
+        output = '<?xml version="1.0" encoding="utf-8"?>\n<AcResponse Command="diff">' + '<Element />' * 10000
+        self.assertTrue(accurev.CommandGovernor.IsSuccess(cmd, 1, output))
+        outputFile = io.BytesIO(output.encode('utf-8'))
+        self.assertTrue(accurev.CommandGovernor.IsSuccess(cmd, 1, outputFile))
+        self.assertEqual(0, outputFile.tell())
+
+    def test_probe_kind(self):
+        self.assertEqual('diff-probe', accurev.CommandGovernor.GetProbeKind([ 'accurev', 'diff', '-a' ]))
+        self.assertIsNone(accurev.CommandGovernor.GetProbeKind([ 'accurev' ]))
+
+if __name__ == '__main__':
+    unittest.main()